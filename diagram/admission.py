@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from .config import ADMISSION_CONFIG, CHESS_BOARD_CONFIG, JOB_CONFIG, PDF_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a render request is refused; `status` is the HTTP status to answer with and
+    `retry_after` the seconds after which retrying may succeed (None when retrying cannot help).
+    """
+    def __init__(self, message, status, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def diagram_cost(render_options, described=False):
+    """
+    Returns the estimated cost of rendering one diagram with `render_options` (see ADMISSION_CONFIG).
+    """
+    renderer = render_options.get('renderer', CHESS_BOARD_CONFIG['renderer'])
+    output_mode = render_options.get('output_mode', PDF_CONFIG['output_mode'])
+    cost = (ADMISSION_CONFIG['renderer_costs'].get(renderer, 1.0)
+            * ADMISSION_CONFIG['output_mode_costs'].get(output_mode, 1.0))
+    if described:
+        cost += ADMISSION_CONFIG['description_cost']
+    return cost
+
+
+def estimate_cost(fens, render_options):
+    """
+    Returns the estimated cost of rendering the FEN items of a request: its diagrams weighted by
+    the cost of the renderer and output mode, plus the description paragraphs.
+    """
+    cost = 0.0
+    for fen_item in fens:
+        cost += diagram_cost(render_options, isinstance(fen_item, dict) and bool(fen_item.get('description')))
+    return cost
+
+
+def check_request_cost(cost):
+    """
+    Raises AdmissionRejected (413) when one request costs more than ADMISSION_CONFIG['max_request_cost'].
+    """
+    if ADMISSION_CONFIG['enabled'] and cost > ADMISSION_CONFIG['max_request_cost']:
+        raise AdmissionRejected(
+            f"The request is too large to render synchronously (cost {cost:.0f}, limit "
+            f"{ADMISSION_CONFIG['max_request_cost']}); submit it to /api/jobs/ instead.",
+            413
+        )
+
+
+def check_job_cost(cost):
+    """
+    Raises AdmissionRejected (413) when one render job costs more than JOB_CONFIG['max_cost'].
+    """
+    max_cost = JOB_CONFIG['max_cost']
+    if ADMISSION_CONFIG['enabled'] and max_cost is not None and cost > max_cost:
+        raise AdmissionRejected(
+            f"The job is too large to render (cost {cost:.0f}, limit {max_cost}); split it into smaller jobs.",
+            413
+        )
+
+
+def limit_cost(fens, render_options):
+    """
+    Yields the FEN items of a stream whose size is not known in advance (PGN games, uploads), raising
+    AdmissionRejected (413) as soon as their cost passes ADMISSION_CONFIG['max_request_cost'].
+    """
+    cost = 0.0
+    for fen_item in fens:
+        cost += diagram_cost(render_options, isinstance(fen_item, dict) and bool(fen_item.get('description')))
+        check_request_cost(cost)
+        yield fen_item
+
+
+def render_deadline():
+    """
+    Returns the time.monotonic() deadline of a render starting now, or None without a render timeout.
+    """
+    if not ADMISSION_CONFIG['enabled'] or not ADMISSION_CONFIG['render_timeout']:
+        return None
+    return time.monotonic() + ADMISSION_CONFIG['render_timeout']
+
+
+class AdmissionController:
+    """
+    Bounds the renders of this process: the summed cost of the requests being rendered or waiting
+    for a render slot, and the number of renders running at the same time.
+    Every worker process has its own controller, so the limits apply per gunicorn worker.
+    """
+    def __init__(self, max_total_cost, max_concurrent, queue_timeout, retry_after):
+        self.max_total_cost = max_total_cost
+        self.max_concurrent = max_concurrent
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.cost_in_flight = 0.0
+        self.running = 0
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+
+    def _reserve(self, cost):
+        # A request costing more than the whole budget is still admitted when nothing else is in flight.
+        with self._lock:
+            if self.cost_in_flight and self.cost_in_flight + cost > self.max_total_cost:
+                raise AdmissionRejected("Too many diagrams are being rendered, retry later.", 429, self.retry_after)
+            self.cost_in_flight += cost
+
+    def _unreserve(self, cost):
+        with self._lock:
+            self.cost_in_flight -= cost
+
+    def _no_slot(self):
+        return AdmissionRejected("No render slot became available, retry later.", 503, self.retry_after)
+
+    @contextmanager
+    def _running(self):
+        with self._lock:
+            self.running += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.running -= 1
+            self._slots.release()
+
+    @contextmanager
+    def admit(self, cost):
+        """
+        Runs the block as a render of `cost`. Raises AdmissionRejected with a 429 when the cost budget
+        is spent, or with a 503 when no render slot frees up within the queue timeout.
+        """
+        self._reserve(cost)
+        try:
+            if not self._slots.acquire(timeout=self.queue_timeout):
+                raise self._no_slot()
+            with self._running():
+                yield
+        finally:
+            self._unreserve(cost)
+
+    @asynccontextmanager
+    async def admit_async(self, cost):
+        """
+        The admit() of async views: the wait for a render slot runs in the default executor,
+        so the event loop keeps serving other requests meanwhile.
+        """
+        self._reserve(cost)
+        try:
+            acquire = asyncio.get_running_loop().run_in_executor(None, self._slots.acquire, True, self.queue_timeout)
+            try:
+                acquired = await asyncio.shield(acquire)
+            except asyncio.CancelledError:
+                # The request went away while waiting: give the slot back once the wait ends.
+                acquire.add_done_callback(lambda future: future.result() and self._slots.release())
+                raise
+            if not acquired:
+                raise self._no_slot()
+            with self._running():
+                yield
+        finally:
+            self._unreserve(cost)
+
+    def info(self):
+        with self._lock:
+            return {
+                'cost_in_flight': self.cost_in_flight,
+                'running': self.running,
+                'max_total_cost': self.max_total_cost,
+                'max_concurrent': self.max_concurrent,
+            }
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller():
+    """
+    Returns the process-wide admission controller, created on first use from ADMISSION_CONFIG.
+    """
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = AdmissionController(
+                ADMISSION_CONFIG['max_total_cost'],
+                ADMISSION_CONFIG['max_concurrent'],
+                ADMISSION_CONFIG['queue_timeout'],
+                ADMISSION_CONFIG['retry_after'],
+            )
+        return _controller
+
+
+@contextmanager
+def admit(cost):
+    """
+    Admits a render of `cost` through the process-wide controller, or runs it unbounded when
+    admission control is disabled.
+    """
+    if not ADMISSION_CONFIG['enabled']:
+        yield
+        return
+    with get_admission_controller().admit(cost):
+        yield
+
+
+@asynccontextmanager
+async def admit_async(cost):
+    """
+    The admit() of async views (see AdmissionController.admit_async).
+    """
+    if not ADMISSION_CONFIG['enabled']:
+        yield
+        return
+    async with get_admission_controller().admit_async(cost):
+        yield
@@ -1,6 +1,25 @@
+import logging
+
 from django.apps import AppConfig
 
+logger = logging.getLogger(__name__)
+
 
 class DiagramConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "diagram"
+
+    def ready(self):
+        """
+        Warms up the render stack in processes serving requests (see STARTUP_CONFIG),
+        so the first PDF request is not slowed down by imports and library initialization.
+        """
+        from .startup import should_warm_up, warm_up
+
+        if not should_warm_up():
+            return
+        try:
+            warm_up()
+        except Exception:
+            # A failed warm-up only costs the first request its speed-up; the request reports the real error.
+            logger.exception("Render stack warm-up failed")
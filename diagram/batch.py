@@ -0,0 +1,163 @@
+import json
+import logging
+import re
+import tempfile
+import time
+import zipfile
+from itertools import islice
+
+from .config import BATCH_CONFIG, PARALLEL_CONFIG, PDF_CONFIG
+from .metrics import collect
+from .parallel import prepare_drawings
+from .pdf_service import RenderTimeout, create_pdf_from_fens
+from .utils import drawing_cache
+
+logger = logging.getLogger(__name__)
+
+_UNSAFE_FILENAME_CHARACTERS = re.compile(r'[^\w .-]+')
+
+
+def document_filenames(names):
+    """
+    Returns a safe, unique '.pdf' file name for each requested document name (None for unnamed documents).
+    """
+    filenames = []
+    used = set()
+    for index, name in enumerate(names):
+        stem = _UNSAFE_FILENAME_CHARACTERS.sub('_', str(name or '')).strip(' ._')[:100]
+        if stem.lower().endswith('.pdf'):
+            stem = stem[:-4]
+        stem = stem or f'document-{index + 1}'
+        filename = f'{stem}.pdf'
+        suffix = 2
+        while filename.lower() in used:
+            filename = f'{stem} ({suffix}).pdf'
+            suffix += 1
+        used.add(filename.lower())
+        filenames.append(filename)
+    return filenames
+
+
+def prewarm_drawings(documents, deadline=None):
+    """
+    Renders the distinct boards of all documents sharing board options in large batches, so the process
+    pool works on the whole batch at once and every document then finds its boards in the drawing cache.
+    Skipped for the options whose boards would not fit in the drawing cache, and in the modes without drawings.
+    Stops between batches once the time.monotonic() `deadline` has passed; the documents then report it.
+    """
+    groups = {}
+    for _filename, fens, render_options in documents:
+        if render_options.get('output_mode', 'vector') != 'vector':
+            continue
+        board_options = (
+            json.dumps(render_options.get('board_colors'), sort_keys=True),
+            render_options.get('show_turn_indicator', False),
+            render_options.get('show_coordinates'),
+            render_options.get('renderer'),
+        )
+        group = groups.setdefault(board_options, (render_options, {}))[1]
+        for fen_item in fens:
+            group.setdefault(fen_item['fen'], None)
+
+    for render_options, fen_strings in groups.values():
+        if len(fen_strings) > drawing_cache.maxsize:
+            continue
+        iterator = iter(fen_strings)
+        while True:
+            if deadline is not None and time.monotonic() > deadline:
+                return
+            chunk = list(islice(iterator, PARALLEL_CONFIG['batch_size']))
+            if not chunk:
+                break
+            prepare_drawings(
+                chunk,
+                dict(render_options.get('board_colors') or {}),
+                render_options.get('show_turn_indicator', False),
+                render_options.get('show_coordinates'),
+                render_options.get('renderer'),
+            )
+
+
+class _ZipOutput:
+    """
+    An unseekable file collecting what zipfile writes, drained after each chunk of the stream.
+    """
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class BatchZipStream:
+    """
+    Renders a batch of documents one after the other and yields a ZIP of their PDFs as it is written,
+    each document being added as soon as it is rendered. `documents` are (filename, fens, render_options)
+    tuples with validated FENs. The caches and the process pool are shared by the whole batch.
+    A document that fails to render is replaced by a '<name>.error.txt' entry, as the response has
+    already started; past the `deadline` (see create_pdf_from_fens) the remaining documents are skipped.
+    `on_close` is called once when the stream is closed, whether or not it was consumed.
+    """
+    def __init__(self, documents, deadline=None, on_close=None):
+        self.documents = documents
+        self.deadline = deadline
+        self._on_close = on_close
+        self._iterator = self._generate()
+
+    def __iter__(self):
+        return self._iterator
+
+    def close(self):
+        self._iterator.close()
+        on_close, self._on_close = self._on_close, None
+        if on_close is not None:
+            on_close()
+
+    def _generate(self):
+        output = _ZipOutput()
+        # PDFs are already compressed, so entries are stored.
+        with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_STORED) as archive:
+            prewarm_drawings(self.documents, self.deadline)
+            for filename, fens, render_options in self.documents:
+                error_filename = f'{filename[:-len(".pdf")]}.error.txt'
+                pdf_file = tempfile.SpooledTemporaryFile(max_size=PDF_CONFIG['spool_max_size'])
+                try:
+                    try:
+                        with collect():
+                            create_pdf_from_fens(fens=fens, output=pdf_file, deadline=self.deadline, **render_options)
+                    except RenderTimeout:
+                        archive.writestr(error_filename, "The batch was not rendered before its deadline.\n")
+                        break
+                    except Exception as e:
+                        logger.error(f"Error generating batch document {filename}: {str(e)}", exc_info=True)
+                        archive.writestr(error_filename, "An unexpected error occurred while generating the PDF.\n")
+                        continue
+
+                    size = pdf_file.tell()
+                    pdf_file.seek(0)
+                    with archive.open(filename, 'w', force_zip64=size > zipfile.ZIP64_LIMIT) as entry:
+                        while True:
+                            chunk = pdf_file.read(BATCH_CONFIG['chunk_size'])
+                            if not chunk:
+                                break
+                            entry.write(chunk)
+                            yield from self._drain(output)
+                finally:
+                    pdf_file.close()
+                yield from self._drain(output)
+        yield from self._drain(output)
+
+    @staticmethod
+    def _drain(output):
+        data = output.take()
+        if data:
+            yield data
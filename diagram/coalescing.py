@@ -0,0 +1,195 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: renders are only coalesced within each process.
+    fcntl = None
+
+from .config import COALESCING_CONFIG
+from .storage import default_directory, private_directory
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    """
+    A render in progress in this process and the requests waiting for it.
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiting = 0
+
+
+class RenderCoalescer:
+    """
+    Single-flight rendering: concurrent calls of `run` with the same key (see result_cache.request_key)
+    share one call of the render function, and every caller receives its bytes or its exception.
+    Within a process the callers wait for the thread running the render. With a `directory`, the renders
+    of the worker processes of the machine are coalesced too: the worker rendering a key holds an flock
+    on a lock file named after it and leaves the PDF in a result file for the workers waiting on the lock.
+    Locks and results are only shared through the local filesystem, in a directory private to the user of the
+    workers (see storage.private_directory), and the lock files need fcntl.
+    Coalescing is an optimization: a worker that waits for longer than `wait_timeout`, or loses a race
+    with the cleanup of old lock files, renders the document itself.
+    """
+    def __init__(self, directory=None, wait_timeout=70, poll_interval=0.05, result_ttl=60):
+        self.directory = directory
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        # Result files are read by the waiting workers as soon as the lock is released, then swept.
+        self.result_ttl = result_ttl
+        self._flights = {}
+        self._lock = threading.Lock()
+        if directory is not None:
+            private_directory(directory)
+
+    def run(self, key, render):
+        """
+        Returns (pdf_data, coalesced): the bytes returned by `render()`, or by an identical render
+        running in another thread or worker process, in which case `coalesced` is True.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                flight.waiting += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result, coalesced = self._run_across_processes(key, render)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result, coalesced
+
+    def _run_across_processes(self, key, render):
+        if self.directory is None or fcntl is None:
+            return render(), False
+
+        result_path = os.path.join(self.directory, f'{key}.pdf')
+        wait_start = time.time()
+        with open(os.path.join(self.directory, f'{key}.lock'), 'ab') as lock_file:
+            acquired, waited = self._acquire(lock_file)
+            if not acquired:
+                logger.warning("Waited %s s for the render of %s in another worker, rendering it here.",
+                               self.wait_timeout, key)
+                return render(), False
+            try:
+                if waited:
+                    pdf_data = self._read_result(result_path, wait_start)
+                    if pdf_data is not None:
+                        return pdf_data, True
+                pdf_data = render()
+                self._write_result(result_path, pdf_data)
+                return pdf_data, False
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _acquire(self, lock_file):
+        """
+        Takes the lock, polling until `wait_timeout`. Returns (acquired, waited).
+        """
+        deadline = time.monotonic() + self.wait_timeout
+        waited = False
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True, waited
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    return False, waited
+                waited = True
+                time.sleep(self.poll_interval)
+
+    @staticmethod
+    def _read_result(path, not_before):
+        # Only a result written while this worker was waiting belongs to the render it waited for.
+        try:
+            if os.stat(path).st_mtime < not_before:
+                return None
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_result(self, path, pdf_data):
+        try:
+            fd, partial_path = tempfile.mkstemp(dir=self.directory, suffix='.part')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(pdf_data)
+            os.replace(partial_path, path)
+            self._sweep()
+        except OSError as e:
+            logger.warning("Render result %s could not be shared with the other workers: %s", path, e)
+
+    def _sweep(self):
+        """
+        Removes the result and lock files older than `result_ttl`. A lock file is only removed while
+        this worker holds it; a worker that opened it just before then renders without coalescing.
+        """
+        expired = time.time() - self.result_ttl
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.stat(path).st_mtime >= expired:
+                    continue
+                if not name.endswith('.lock'):
+                    os.remove(path)
+                    continue
+                with open(path, 'ab') as lock_file:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue
+                    os.remove(path)
+            except FileNotFoundError:
+                continue
+
+    def info(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'waiting': sum(flight.waiting for flight in self._flights.values()),
+            }
+
+
+_coalescer = None
+_coalescer_lock = threading.Lock()
+
+
+def get_render_coalescer():
+    """
+    Returns the render coalescer configured by COALESCING_CONFIG, or None when it is disabled.
+    """
+    global _coalescer
+    if not COALESCING_CONFIG['enabled']:
+        return None
+    with _coalescer_lock:
+        if _coalescer is None:
+            directory = None
+            if COALESCING_CONFIG['across_workers'] and fcntl is not None:
+                directory = COALESCING_CONFIG['directory'] or default_directory('renders')
+            _coalescer = RenderCoalescer(
+                directory,
+                COALESCING_CONFIG['wait_timeout'],
+                COALESCING_CONFIG['poll_interval'],
+                COALESCING_CONFIG['result_ttl'],
+            )
+        return _coalescer
@@ -7,7 +7,13 @@ PDF_CONFIG = {
     'page_size': A4,  # The page size for the PDF (e.g., A4, LETTER).
     'default_diagrams_per_page': 6,  # Default number of chess diagrams to display per page.
     'page_margin': 10,  # Margin around the PDF page in points.
-    'padding_before_desc': 6
+    'padding_before_desc': 6,
+    'output_mode': 'vector',  # 'vector' embeds each diagram's paths, 'xobject' places shared Form XObjects by reference, 'draft' places board bitmaps.
+    'layout_engine': 'platypus',  # 'platypus' lays out a Table per page, 'canvas' draws the precomputed grid directly (and caches pages).
+    'stream_min_fens': 500,  # Requests with at least this many FENs are rendered into a spooled temporary file, sent once complete.
+    'spool_max_size': 8 * 1024 * 1024,  # Bytes of a spooled PDF kept in memory before spilling to disk.
+    'page_cache_bytes': 16 * 1024 * 1024,  # Total size of the rendered pages kept by both layout engines, for 'vector' output only (0 disables the page cache).
+    'invariant': True,  # Fixed creation date and document ID, so identical requests produce identical bytes.
 }
 
 # Diagram Configuration
@@ -41,9 +47,142 @@ CHESS_BOARD_CONFIG = {
     'size': 390,  # Size of the chess board SVG in pixels.
     'coordinates': False,  # Whether to display coordinates on the board.
     'coord': "#000000",
+    'renderer': 'svg',  # Default rendering engine: 'svg' (python-chess SVG + svglib) or 'native' (direct ReportLab shapes).
     'colors': {
         'light_squares': '#f0d9b5',  # Color for light squares on the board.
         'dark_squares': '#b58863',   # Color for dark squares on the board.
         'border_color': "#FFFFFF" # defines the color of the board border.
     }
-}
\ No newline at end of file
+}
+
+# Cache Configuration
+# Defines parameters for the in-process caches used while rendering diagrams.
+CACHE_CONFIG = {
+    'drawing_cache_size': 512,  # Maximum number of board drawings kept in the LRU cache (0 disables caching).
+}
+
+# Drawing Store Configuration
+# Defines the persistent store of rendered boards shared by the worker processes of a machine (see drawing_store.py).
+DRAWING_STORE_CONFIG = {
+    'enabled': False,  # Set to True to keep rendered boards across restarts and share them between workers.
+    'path': None,  # SQLite database file (None uses var/drawing_store/drawings.sqlite3 under BASE_DIR, in a 0700 directory).
+    'max_bytes': 256 * 1024 * 1024,  # Size of the stored drawings before the least recently used ones are evicted.
+    'timeout': 1.0,  # Seconds to wait for a lock held by another process before treating the store as a miss.
+    'renderers': ['svg'],  # Renderers whose boards are stored; 'native' boards render about as fast as they load.
+    'version': 1,  # Bump to ignore every stored drawing after a rendering change.
+}
+
+# Draft Configuration
+# Defines the board bitmaps of the 'draft' output mode, for fast and small proofs (see raster.py).
+DRAFT_CONFIG = {
+    'dpi': 100,  # Default resolution of the board bitmaps at their size on the page.
+    'min_dpi': 36,  # Lowest resolution accepted from a request.
+    'max_dpi': 300,  # Highest resolution accepted from a request.
+    'supersample': 4,  # Glyphs are drawn this many times larger, then scaled down for antialiasing.
+    'palette_colors': 32,  # Colors of the board bitmaps, stored indexed (at most 256).
+    'cache_size': 256,  # Number of encoded board images kept in the in-process LRU cache.
+}
+
+# Parallel Rendering Configuration
+# Defines how board drawings are prepared in a process pool for large documents.
+PARALLEL_CONFIG = {
+    'parallel_boards': False,  # Render the boards of large batches in the shared process pool instead of the requesting process.
+    'pool_size': None,  # Worker processes of the shared pool, which is created once and never resized (None uses every core).
+    'min_batch_size': 64,  # Batches with fewer boards to render than this are rendered serially.
+    'chunksize': 8,  # Number of boards sent to a worker process at once.
+    'batch_size': 256,  # Number of boards prepared together while building a document (bounds the drawings held in memory).
+    'shards': 0,  # Page ranges a large document is built in, in the process pool (0 or 1 builds it in one process).
+    'min_pages_per_shard': 8,  # Documents are only split so that each shard has at least this many pages.
+}
+
+# Render Job Configuration
+# Defines the local worker pool and storage used by the asynchronous render-job API.
+JOB_CONFIG = {
+    'max_workers': 2,  # Number of jobs rendered at the same time.
+    'storage_dir': None,  # Directory for finished PDFs, private to the server user (None uses var/jobs under BASE_DIR).
+    'ttl': 3600,  # Seconds a finished job and its PDF are kept before they expire.
+    'max_cost': 200000,  # Largest estimated cost of one job (see ADMISSION_CONFIG); larger jobs get a 413. None disables the limit.
+}
+
+# Result Cache Configuration
+# Defines the cache of finished PDFs, addressed by a hash of the canonical request.
+RESULT_CACHE_CONFIG = {
+    'backend': 'disk',  # 'disk' (local files with LRU eviction), 'django' (Django cache framework) or None to disable.
+    'cache_alias': 'default',  # Django cache used by the 'django' backend; a per-process LocMemCache is refused, its size is not bounded in bytes.
+    'timeout': 3600,  # Seconds a PDF stays in the Django cache.
+    'directory': None,  # Directory of the 'disk' backend, private to the server user (None uses var/pdf_cache under BASE_DIR).
+    'max_bytes': 512 * 1024 * 1024,  # Total size of the 'disk' backend before the least recently used PDFs are evicted.
+    'max_entry_bytes': 32 * 1024 * 1024,  # PDFs larger than this are never cached.
+    'version': 1,  # Bump to invalidate every cached PDF after a rendering change.
+}
+
+# Metrics Configuration
+# Defines the instrumentation exposed by the generate-pdf endpoint and /api/metrics/.
+METRICS_CONFIG = {
+    'server_timing': True,  # Add a Server-Timing header with stage durations and counters to generate-pdf responses.
+    'profile_limit': 40,  # Number of functions listed in the cProfile summary returned to staff users with `profile`.
+}
+
+# Preview Configuration
+# Defines the image previews of a first page or a single diagram returned by /api/preview/.
+PREVIEW_CONFIG = {
+    'cache_size': 256,  # Number of rendered preview images kept in the in-process LRU cache.
+    'default_width': 300,  # Width of a preview image in pixels when the request does not give one.
+    'max_width': 1200,  # Largest preview width accepted, in pixels.
+    'supersample': 2,  # PNG previews are drawn this many times larger, then scaled down for antialiasing.
+}
+
+# Startup Configuration
+# Defines the warm-up run by DiagramConfig.ready (see startup.warm_up).
+STARTUP_CONFIG = {
+    'warm_up': 'auto',  # True (always), False (never) or 'auto' (only in runserver and the servers below).
+    'servers': ('gunicorn', 'uwsgi', 'daphne', 'uvicorn', 'hypercorn'),  # Programs 'auto' warms up in.
+}
+
+# Ingest Configuration
+# Defines the newline-delimited uploads accepted by /api/generate-pdf/ (see ingest.py).
+INGEST_CONFIG = {
+    'max_line_length': 4096,  # Longest accepted line, in characters; longer lines are reported as invalid items.
+    'read_size': 64 * 1024,  # Bytes read from the request body (or the gzip stream) at a time.
+}
+
+# Admission Configuration
+# Defines the cost budgets and concurrency limits of the synchronous render endpoints (see admission.py).
+# The cost of a request is its number of diagrams weighted by how expensive its options are to render.
+ADMISSION_CONFIG = {
+    'enabled': True,  # Set to False to admit every request without budgets, concurrency limit or deadline.
+    'renderer_costs': {'svg': 1.0, 'native': 0.4},  # Relative cost of one board per renderer.
+    'output_mode_costs': {'vector': 1.0, 'xobject': 0.3, 'draft': 0.2},  # Multiplier per output mode ('xobject' and 'draft' do not render boards).
+    'description_cost': 0.2,  # Added per diagram for the description paragraphs when the request has any.
+    'max_request_cost': 5000,  # Largest cost of one request; larger documents must go through /api/jobs/ (413).
+    'max_total_cost': 20000,  # Largest cost rendered at the same time by this process; requests beyond it get a 429.
+    'max_concurrent': 4,  # Renders running at the same time in this process.
+    'queue_timeout': 2,  # Seconds a request waits for a render slot before getting a 503.
+    'render_timeout': 60,  # Seconds a render may run before it is cancelled (504).
+    'retry_after': 5,  # Retry-After header value of 429 and 503 responses, in seconds.
+}
+
+# Coalescing Configuration
+# Defines the single-flight rendering of identical concurrent generate-pdf requests (see coalescing.py).
+COALESCING_CONFIG = {
+    'enabled': True,  # Concurrent requests with the same request key in a process wait for one render.
+    'across_workers': False,  # Also coalesce the renders of the worker processes of the machine through lock files.
+    'directory': None,  # Directory of the lock and result files, private to the server user (None uses var/renders under BASE_DIR).
+    'wait_timeout': 70,  # Seconds a request waits for the render of another worker before rendering itself.
+    'poll_interval': 0.05,  # Seconds between attempts to take the lock of a render held by another worker.
+    'result_ttl': 60,  # Seconds a PDF shared with the waiting workers is kept before it is swept.
+}
+
+# Render Executor Configuration
+# Defines where the async generate-pdf view runs create_pdf_from_fens (see executor.py).
+EXECUTOR_CONFIG = {
+    'kind': 'thread',  # 'thread' (a thread pool, metrics are collected) or 'process' (a process pool, renders do not share the GIL).
+    'max_workers': 4,  # Renders run at the same time by the executor (None uses every core).
+}
+
+# Batch Configuration
+# Defines the multi-document ZIP endpoint /api/generate-pdf/batch/ (see batch.py).
+BATCH_CONFIG = {
+    'max_documents': 100,  # Largest number of documents in one batch.
+    'chunk_size': 64 * 1024,  # Bytes of a rendered PDF copied into the ZIP stream at a time.
+}
@@ -0,0 +1,218 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+
+import reportlab
+from django.conf import settings
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from .config import DRAWING_STORE_CONFIG
+from .storage import private_directory
+
+logger = logging.getLogger(__name__)
+
+# Largest number of keys looked up in one query (SQLite limits the parameters of a statement).
+_MAX_QUERY_KEYS = 500
+# Salt of the HMAC signing the stored pickles with SECRET_KEY.
+_SIGNATURE_SALT = 'diagram.drawing_store'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS drawings (
+    key TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    signature TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS drawings_last_used ON drawings (last_used);
+"""
+
+
+def store_key(cache_key):
+    """
+    Hashes a drawing cache key (see utils.drawing_cache_key) with the store and ReportLab versions,
+    so drawings pickled by another version are never loaded.
+    """
+    canonical = json.dumps(
+        [DRAWING_STORE_CONFIG['version'], reportlab.Version, cache_key], separators=(',', ':'), default=str
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class DrawingStore:
+    """
+    Rendered board drawings persisted in an SQLite database shared by every worker process of the machine,
+    so a board rendered once survives restarts and is not rendered again by the other workers.
+    Drawings are stored pickled and compressed, signed with an HMAC keyed on SECRET_KEY: an entry whose
+    signature does not match is never unpickled, and is deleted and reported as missing like an entry failing
+    to unpickle. Once the stored drawings exceed `max_bytes`, the least
+    recently used ones are evicted. The store is a cache: database errors, such as a lock held by another
+    process for longer than `timeout`, are logged and reported as misses.
+    The database lives in a directory only its owner can access, by default var/drawing_store under
+    BASE_DIR; entries are keyed by store_key, so the store only holds boards written by this code.
+    """
+    def __init__(self, path, max_bytes, timeout=1.0, touch_interval=60):
+        self.path = path or os.path.join(settings.BASE_DIR, 'var', 'drawing_store', 'drawings.sqlite3')
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        # Reads only record the last use of an entry once per interval, to keep them from writing.
+        self.touch_interval = touch_interval
+        self._local = threading.local()
+        self._evict_lock = threading.Lock()
+
+    def _connection(self):
+        # sqlite3 connections belong to one thread, and must not be inherited by forked processes.
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                private_directory(directory)
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(_SCHEMA)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get_many(self, cache_keys):
+        """
+        Returns a dict mapping the given drawing cache keys found in the store to their drawings.
+        """
+        keys = {store_key(cache_key): cache_key for cache_key in cache_keys}
+        found = {}
+        stale = []
+        corrupt = []
+        now = time.time()
+        try:
+            connection = self._connection()
+            key_list = list(keys)
+            for start in range(0, len(key_list), _MAX_QUERY_KEYS):
+                chunk = key_list[start:start + _MAX_QUERY_KEYS]
+                rows = connection.execute(
+                    "SELECT key, data, signature, last_used FROM drawings "
+                    f"WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                for key, data, signature, last_used in rows:
+                    drawing = self._load(data, signature)
+                    if drawing is None:
+                        corrupt.append(key)
+                        continue
+                    found[keys[key]] = drawing
+                    if now - last_used > self.touch_interval:
+                        stale.append(key)
+            if stale:
+                connection.executemany(
+                    "UPDATE drawings SET last_used = ? WHERE key = ?", [(now, key) for key in stale]
+                )
+            if corrupt:
+                logger.warning("Deleting %s corrupt entries of the drawing store %s", len(corrupt), self.path)
+                connection.executemany("DELETE FROM drawings WHERE key = ?", [(key,) for key in corrupt])
+        except sqlite3.Error as e:
+            logger.warning("Drawing store %s could not be read: %s", self.path, e)
+        return found
+
+    def get(self, cache_key):
+        return self.get_many([cache_key]).get(cache_key)
+
+    @staticmethod
+    def _sign(data):
+        return salted_hmac(_SIGNATURE_SALT, data, algorithm='sha256').hexdigest()
+
+    @classmethod
+    def _load(cls, data, signature):
+        if not constant_time_compare(cls._sign(data), signature):
+            return None
+        try:
+            return pickle.loads(zlib.decompress(data))
+        except Exception:
+            return None
+
+    def put_many(self, items):
+        """
+        Stores (drawing cache key, drawing) pairs, then evicts the least recently used drawings
+        beyond `max_bytes`.
+        """
+        now = time.time()
+        rows = []
+        for cache_key, drawing in items:
+            data = zlib.compress(pickle.dumps(drawing, protocol=pickle.HIGHEST_PROTOCOL))
+            rows.append((store_key(cache_key), data, self._sign(data), len(data), now))
+        if not rows:
+            return
+        try:
+            connection = self._connection()
+            with connection:
+                connection.execute('BEGIN IMMEDIATE')
+                connection.executemany(
+                    "INSERT OR REPLACE INTO drawings (key, data, signature, size, last_used) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    rows,
+                )
+            self._evict(connection)
+        except sqlite3.Error as e:
+            logger.warning("Drawing store %s could not be written: %s", self.path, e)
+
+    def put(self, cache_key, drawing):
+        self.put_many([(cache_key, drawing)])
+
+    def _evict(self, connection):
+        with self._evict_lock:
+            total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM drawings").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            evicted = []
+            for key, size in connection.execute("SELECT key, size FROM drawings ORDER BY last_used"):
+                if total <= self.max_bytes:
+                    break
+                evicted.append((key,))
+                total -= size
+            with connection:
+                connection.execute('BEGIN IMMEDIATE')
+                connection.executemany("DELETE FROM drawings WHERE key = ?", evicted)
+
+    def clear(self):
+        with self._connection() as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute("DELETE FROM drawings")
+
+    def info(self):
+        entries, size = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM drawings"
+        ).fetchone()
+        return {'entries': entries, 'bytes': size, 'max_bytes': self.max_bytes}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_drawing_store():
+    """
+    Returns the drawing store configured by DRAWING_STORE_CONFIG, or None when it is disabled.
+    """
+    global _store
+    if not DRAWING_STORE_CONFIG['enabled']:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = DrawingStore(
+                DRAWING_STORE_CONFIG['path'],
+                DRAWING_STORE_CONFIG['max_bytes'],
+                DRAWING_STORE_CONFIG['timeout'],
+            )
+        return _store
+
+
+def stores_renderer(renderer):
+    """
+    Whether the boards of `renderer` go through the drawing store (see DRAWING_STORE_CONFIG['renderers']).
+    """
+    return renderer in DRAWING_STORE_CONFIG['renderers']
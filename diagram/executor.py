@@ -0,0 +1,79 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from .config import EXECUTOR_CONFIG
+
+logger = logging.getLogger(__name__)
+
+EXECUTOR_KINDS = ('thread', 'process')
+
+# Rendering is safe to run from several threads at once:
+#   - the config dicts are only read once the process has started,
+#   - the drawing, page and preview caches are locked LRUs, and the drawings they hold are never modified
+#     (fen_to_drawing returns copies with their own transform),
+#   - reportlab's renderers temporarily set attributes on the shapes they draw, so shapes shared through
+#     the drawing cache and the glyph tables are drawn with utils.draw_shared_shapes, which only reads them,
+#   - every document has its own canvas, PageGrid, styles and Paragraph parsers, and Form XObjects
+#     are defined per canvas,
+#   - the process pools and the job, result cache and admission singletons are created under a lock,
+#   - metrics are held in a contextvar, which the thread executor copies into the rendering thread,
+#   - reportlab registers the standard fonts lazily in a global dict; two threads registering the same
+#     font build equivalent objects, and the startup warm-up registers them before any request.
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_render_executor():
+    """
+    Returns the process-wide render executor, created on first use from EXECUTOR_CONFIG.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            kind = EXECUTOR_CONFIG['kind']
+            if kind not in EXECUTOR_KINDS:
+                raise ValueError(f"Unknown executor kind '{kind}', expected one of {', '.join(EXECUTOR_KINDS)}.")
+            if kind == 'process':
+                _executor = ProcessPoolExecutor(max_workers=EXECUTOR_CONFIG['max_workers'])
+            else:
+                _executor = ThreadPoolExecutor(max_workers=EXECUTOR_CONFIG['max_workers'],
+                                               thread_name_prefix='render')
+        return _executor
+
+
+def shutdown_render_executor():
+    """
+    Shuts the render executor down; the next render creates a new one.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+
+
+def render_pdf(fens, render_options, deadline=None):
+    """
+    Renders a PDF and returns its bytes. Defined at module level so process executors can pickle it.
+    """
+    from .pdf_service import create_pdf_from_fens
+    return create_pdf_from_fens(fens=fens, deadline=deadline, **render_options)
+
+
+async def run_render(fens, render_options, deadline=None):
+    """
+    Runs render_pdf in the render executor without blocking the event loop and returns the PDF bytes.
+    With a thread executor the render runs in a copy of the current context, so its metrics are added
+    to the ones being collected; a process executor records them in the worker process instead.
+    """
+    loop = asyncio.get_running_loop()
+    executor = get_render_executor()
+    call = functools.partial(render_pdf, fens, render_options, deadline)
+    if isinstance(executor, ThreadPoolExecutor):
+        call = functools.partial(contextvars.copy_context().run, call)
+    return await loop.run_in_executor(executor, call)
@@ -0,0 +1,133 @@
+import csv
+import gzip
+import io
+import json
+import logging
+import zlib
+
+from .config import INGEST_CONFIG
+from .validation import InvalidFenItem, iter_validated_fens
+
+logger = logging.getLogger(__name__)
+
+# Media types of the newline-delimited uploads: one FEN, or one {"fen", "description"} JSON object, per line.
+INGEST_CONTENT_TYPES = ('text/plain', 'application/x-ndjson', 'application/jsonl')
+CONTENT_ENCODINGS = ('identity', 'gzip')
+# Formats of FEN files (see iter_file_items): 'plain' and 'ndjson' files are read alike, line by line.
+FILE_FORMATS = ('plain', 'ndjson', 'csv')
+# Raised while reading a truncated or corrupt gzip upload.
+CORRUPT_UPLOAD_ERRORS = (gzip.BadGzipFile, EOFError, zlib.error)
+
+
+class UnsupportedEncoding(ValueError):
+    """
+    Raised when an upload uses a Content-Encoding other than CONTENT_ENCODINGS.
+    """
+
+
+class _RawStream(io.RawIOBase):
+    """
+    Adapts a file-like object that only has read(), such as a Django request, to the io stack.
+    """
+    def __init__(self, stream):
+        super().__init__()
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def open_upload(stream, content_encoding=None):
+    """
+    Returns a text stream reading the upload `stream` as UTF-8, decompressing it on the fly when
+    `content_encoding` is 'gzip'. Raises UnsupportedEncoding for any other encoding.
+    """
+    encoding = (content_encoding or 'identity').strip().lower()
+    if encoding not in CONTENT_ENCODINGS:
+        raise UnsupportedEncoding(f"Content-Encoding must be one of: {', '.join(CONTENT_ENCODINGS)}.")
+    binary = io.BufferedReader(_RawStream(stream), INGEST_CONFIG['read_size'])
+    if encoding == 'gzip':
+        binary = io.BufferedReader(gzip.GzipFile(fileobj=binary, mode='rb'), INGEST_CONFIG['read_size'])
+    return io.TextIOWrapper(binary, encoding='utf-8-sig', errors='replace')
+
+
+def _parse_line(line):
+    if not line.startswith('{'):
+        return line
+    try:
+        item = json.loads(line)
+    except ValueError as e:
+        return InvalidFenItem(f"Line is not valid JSON: {e}.")
+    if not isinstance(item, dict):
+        return InvalidFenItem("Expected a FEN string or an object with a 'fen' string.")
+    return item
+
+
+def iter_upload_items(handle):
+    """
+    Yields the FEN items of a newline-delimited text stream, one per non-blank line: a raw FEN string,
+    or a {"fen", "description"} JSON object when the line starts with '{'. Lines are read one at a time;
+    lines longer than INGEST_CONFIG['max_line_length'] are skipped and yielded as InvalidFenItem.
+    """
+    max_length = INGEST_CONFIG['max_line_length']
+    while True:
+        line = handle.readline(max_length + 1)
+        if not line:
+            return
+        if len(line) > max_length and not line.endswith('\n'):
+            # Drop the rest of the line without holding it.
+            while line and not line.endswith('\n'):
+                line = handle.readline(max_length)
+            yield InvalidFenItem(f"Line is longer than {max_length} characters.")
+            continue
+        line = line.strip()
+        if line:
+            yield _parse_line(line)
+
+
+def iter_csv_items(handle):
+    """
+    Yields the FEN items of a CSV text stream, one per non-blank row, as {'fen', 'description'} dicts.
+    A first row naming a 'fen' column is a header locating the 'fen' and 'description' columns;
+    without it the FEN is in the first column and the description in the second.
+    """
+    fen_column, description_column = 0, 1
+    for row_number, row in enumerate(csv.reader(handle)):
+        if not any(cell.strip() for cell in row):
+            continue
+        if row_number == 0:
+            header = [cell.strip().lower() for cell in row]
+            if 'fen' in header:
+                fen_column = header.index('fen')
+                description_column = header.index('description') if 'description' in header else None
+                continue
+        fen = row[fen_column].strip() if fen_column < len(row) else ''
+        description = None
+        if description_column is not None and description_column < len(row):
+            description = row[description_column].strip() or None
+        yield {'fen': fen, 'description': description}
+
+
+def iter_file_items(handle, file_format):
+    """
+    Yields the FEN items of a text stream in one of FILE_FORMATS, reading it as they are consumed.
+    """
+    if file_format not in FILE_FORMATS:
+        raise ValueError(f"Unknown file format '{file_format}', expected one of {', '.join(FILE_FORMATS)}.")
+    if file_format == 'csv':
+        return iter_csv_items(handle)
+    return iter_upload_items(handle)
+
+
+def iter_upload_fens(handle):
+    """
+    Yields the validated {'fen', 'description'} items of a newline-delimited upload as it is read
+    (see iter_upload_items and validation.iter_validated_fens). Memory does not depend on the upload size;
+    invalid lines are reported by index (among the non-blank lines) in the final FenValidationError.
+    """
+    return iter_validated_fens(iter_upload_items(handle))
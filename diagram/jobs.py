@@ -0,0 +1,179 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from .config import JOB_CONFIG
+from .storage import default_directory, private_directory
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+FINISHED = 'finished'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+PENDING_STATUSES = (QUEUED, RUNNING)
+
+
+class RenderJob:
+    """
+    State of one asynchronous render job.
+    """
+    def __init__(self, job_id, path):
+        self.id = job_id
+        self.path = path
+        self.status = QUEUED
+        self.pages_done = 0
+        self.total_pages = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.cancel_requested = False
+        self.future = None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'pages_done': self.pages_done,
+            'total_pages': self.total_pages,
+            'error': self.error,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobManager:
+    """
+    Runs render jobs on a local thread pool and keeps finished PDFs on local disk.
+    Jobs live in this process only: every worker process has its own manager, so clients
+    must reach the same process for status and download (fine for a single-machine setup).
+    """
+    def __init__(self, storage_dir=None, max_workers=JOB_CONFIG['max_workers'], ttl=JOB_CONFIG['ttl']):
+        self.storage_dir = private_directory(storage_dir or default_directory('jobs'))
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='render-job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fens, render_options):
+        self.purge_expired()
+        job_id = uuid.uuid4().hex
+        job = RenderJob(job_id, os.path.join(self.storage_dir, f'{job_id}.pdf'))
+        job.total_pages = -(-len(fens) // render_options.get('diagrams_per_page', 1))
+        with self._lock:
+            self._jobs[job_id] = job
+        job.future = self._executor.submit(self._run, job, fens, render_options)
+        return job
+
+    def get(self, job_id):
+        """
+        Returns the job `job_id`, or None when it is unknown or expired. Expired jobs are only
+        dropped by purge_expired, which runs when a job is submitted.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None and self._expired(job, time.time() - self.ttl):
+            return None
+        return job
+
+    def cancel(self, job_id):
+        """
+        Cancels a queued or running job. Running jobs stop at the next page boundary.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status not in PENDING_STATUSES:
+                return job
+            job.cancel_requested = True
+            if job.future.cancel():
+                job.status = CANCELLED
+                job.finished_at = time.time()
+            return job
+
+    def delete(self, job_id):
+        """
+        Forgets a job that is no longer pending and removes its PDF.
+        """
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job is not None:
+            self._remove_file(job.path)
+        return job
+
+    def purge_expired(self):
+        """
+        Drops jobs that finished more than `ttl` seconds ago, along with leftover files from
+        earlier processes. Runs on every submit, so reads never list the storage directory.
+        """
+        expiry = time.time() - self.ttl
+        with self._lock:
+            expired = [job for job in self._jobs.values() if self._expired(job, expiry)]
+            for job in expired:
+                del self._jobs[job.id]
+            known_paths = {path for job in self._jobs.values() for path in (job.path, job.path + '.part')}
+        for job in expired:
+            self._remove_file(job.path)
+        for name in os.listdir(self.storage_dir):
+            path = os.path.join(self.storage_dir, name)
+            try:
+                if path not in known_paths and os.path.getmtime(path) < expiry:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _run(self, job, fens, render_options):
+        from .pdf_service import RenderCancelled, create_pdf_from_fens
+
+        job.status = RUNNING
+
+        def on_progress(pages_done, total_pages):
+            job.pages_done = pages_done
+            if job.cancel_requested:
+                raise RenderCancelled()
+
+        partial_path = job.path + '.part'
+        try:
+            with open(partial_path, 'wb') as output:
+                create_pdf_from_fens(fens=fens, output=output, progress_callback=on_progress, **render_options)
+            os.replace(partial_path, job.path)
+            job.status = FINISHED
+        except RenderCancelled:
+            job.status = CANCELLED
+        except Exception as e:
+            logger.error(f"Render job {job.id} failed: {str(e)}", exc_info=True)
+            job.error = "An unexpected error occurred while generating the PDF."
+            job.status = FAILED
+        finally:
+            self._remove_file(partial_path)
+            job.finished_at = time.time()
+
+    @staticmethod
+    def _expired(job, expiry):
+        return job.finished_at is not None and job.finished_at < expiry
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+_job_manager = None
+_job_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    """
+    Returns the process-wide job manager, created on first use from JOB_CONFIG.
+    """
+    global _job_manager
+    with _job_manager_lock:
+        if _job_manager is None:
+            _job_manager = JobManager(JOB_CONFIG['storage_dir'], JOB_CONFIG['max_workers'], JOB_CONFIG['ttl'])
+        return _job_manager
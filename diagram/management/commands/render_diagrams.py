@@ -0,0 +1,247 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...config import CHESS_BOARD_CONFIG, PARALLEL_CONFIG, PDF_CONFIG
+from ...ingest import FILE_FORMATS, iter_file_items, open_upload
+from ...metrics import collect
+
+# Input extensions of the 'auto' format; other files are read as plain FENs (or NDJSON, line by line).
+_FORMAT_EXTENSIONS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+# Invalid items listed in the error of a document.
+_REPORTED_ERRORS = 3
+
+
+def input_format(source, file_format):
+    """
+    Returns the format of an input: `file_format`, or with 'auto' the one of its extension.
+    """
+    if file_format != 'auto':
+        return file_format
+    name = source[:-3] if source.endswith('.gz') else source
+    return _FORMAT_EXTENSIONS.get(os.path.splitext(name)[1].lower(), 'plain')
+
+
+def render_document(source, output_path, file_format, render_options):
+    """
+    Renders the FENs of `source` (a file path, or '-' for stdin) into the PDF `output_path` and returns
+    a summary dict with its counters and stage timings, or its error. The input is read as the PDF is
+    built, unless the document is built in shards, which need the whole list of FENs.
+    The PDF is written to a temporary file first, so a failed document leaves no partial output. Any
+    error is recorded in the summary, so the other documents are still rendered.
+    Defined at module level so worker processes can pickle it.
+    """
+    from ...pdf_service import RenderTimeout, create_pdf_from_fens
+    from ...validation import FenValidationError, iter_validated_fens
+
+    summary = {'source': source, 'output': output_path, 'error': None, 'counters': {}, 'timings': {}}
+    partial_path = f'{output_path}.part'
+    start = time.perf_counter()
+    try:
+        with ExitStack() as stack:
+            if source == '-':
+                binary = sys.stdin.buffer
+            else:
+                binary = stack.enter_context(open(source, 'rb'))
+            handle = open_upload(binary, 'gzip' if source.endswith('.gz') else None)
+            fens = iter_validated_fens(iter_file_items(handle, file_format))
+            if (render_options.get('shards') or 0) > 1:
+                fens = list(fens)
+            metrics = stack.enter_context(collect())
+            with open(partial_path, 'wb') as output:
+                create_pdf_from_fens(fens, output=output, **render_options)
+        if not metrics.counters.get('diagrams'):
+            raise ValueError("The input contains no FEN.")
+        os.replace(partial_path, output_path)
+        summary['counters'] = metrics.counters
+        summary['timings'] = metrics.timings
+    except FenValidationError as e:
+        details = '; '.join(f"item {error['index']}: {error['error']}" for error in e.errors[:_REPORTED_ERRORS])
+        summary['error'] = f"{e} {details}"
+    except (OSError, ValueError, RenderTimeout) as e:
+        summary['error'] = str(e)
+    except Exception as e:
+        summary['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    summary['seconds'] = time.perf_counter() - start
+    return summary
+
+
+def _json_argument(value):
+    try:
+        return json.loads(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f"not valid JSON: {e}")
+
+
+class Command(BaseCommand):
+    help = (
+        "Renders FEN files (or stdin) into PDF documents without going through HTTP, one document per input. "
+        "Inputs are plain FENs or NDJSON objects, one per line, or CSV rows of a FEN and a description, "
+        "optionally gzip-compressed (.gz), and are read as the documents are built."
+    )
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('inputs', nargs='*', default=['-'],
+                            help="FEN files to render, '-' for stdin (default).")
+        parser.add_argument('--format', dest='file_format', choices=('auto',) + FILE_FORMATS, default='auto',
+                            help="Input format; 'auto' picks it from the extension (.csv, .ndjson, .jsonl).")
+        parser.add_argument('-o', '--output',
+                            help="PDF file of a single input; required when reading from stdin.")
+        parser.add_argument('--output-dir',
+                            help="Directory of the PDFs, named after their inputs (default: next to each input).")
+        parser.add_argument('--jobs', type=int, default=1,
+                            help="Documents rendered at the same time, each in a worker process (default 1).")
+
+        options = parser.add_argument_group("create_pdf_from_fens options")
+        options.add_argument('--diagrams-per-page', type=int, default=PDF_CONFIG['default_diagrams_per_page'])
+        options.add_argument('--padding', type=_json_argument,
+                             help="Cell padding as JSON, e.g. '{\"top\": 5, \"bottom\": 5}'.")
+        options.add_argument('--board-colors', type=_json_argument,
+                             help="Board colors as JSON, e.g. '{\"light_squares\": \"#eeeeee\"}'.")
+        options.add_argument('--columns-for-diagrams-per-page', type=_json_argument,
+                             help="Grid layout thresholds as JSON.")
+        options.add_argument('--title')
+        options.add_argument('--show-turn-indicator', action='store_true')
+        options.add_argument('--show-page-numbers', action='store_true')
+        options.add_argument('--show-coordinates', action=argparse.BooleanOptionalAction,
+                             default=CHESS_BOARD_CONFIG['coordinates'])
+        options.add_argument('--renderer', default=CHESS_BOARD_CONFIG['renderer'])
+        options.add_argument('--output-mode', default=PDF_CONFIG['output_mode'])
+        options.add_argument('--layout-engine', default=PDF_CONFIG['layout_engine'])
+        options.add_argument('--draft-dpi', type=float, help="Bitmap resolution of the 'draft' output mode.")
+        options.add_argument('--parallel-boards', action=argparse.BooleanOptionalAction,
+                             help="Render the boards of each job in a process pool (default: PARALLEL_CONFIG, "
+                                  "or off with several --jobs).")
+        options.add_argument('--pool-size', type=int,
+                             help="Worker processes of the process pool of each job (default: PARALLEL_CONFIG).")
+        options.add_argument('--shards', type=int, default=PARALLEL_CONFIG['shards'],
+                             help="Page-range shards of each document; reads the whole input first.")
+        options.add_argument('--first-page-number', type=int, default=1)
+
+    def handle(self, *args, **options):
+        render_options = self._render_options(options)
+        documents = self._documents(options)
+        jobs = max(1, options['jobs'])
+        if options['parallel_boards'] is None and jobs > 1 and len(documents) > 1:
+            # The documents already keep the cores busy.
+            render_options['parallel_boards'] = False
+
+        start = time.perf_counter()
+        summaries = []
+        if jobs == 1 or len(documents) == 1:
+            for source, output_path, file_format in documents:
+                summaries.append(render_document(source, output_path, file_format, render_options))
+                self._report(summaries[-1])
+        else:
+            # stdin belongs to this process, so it is rendered here while the workers render the files.
+            local = [document for document in documents if document[0] == '-']
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                futures = [
+                    executor.submit(render_document, source, output_path, file_format, render_options)
+                    for source, output_path, file_format in documents if source != '-'
+                ]
+                for source, output_path, file_format in local:
+                    summaries.append(render_document(source, output_path, file_format, render_options))
+                    self._report(summaries[-1])
+                for future in as_completed(futures):
+                    summaries.append(future.result())
+                    self._report(summaries[-1])
+
+        failed = [summary for summary in summaries if summary['error']]
+        diagrams = sum(summary['counters'].get('diagrams', 0) for summary in summaries)
+        self.stdout.write(
+            f"{len(summaries) - len(failed)} of {len(summaries)} documents, {diagrams} diagrams "
+            f"in {time.perf_counter() - start:.2f} s"
+        )
+        if failed:
+            raise CommandError(f"{len(failed)} of {len(summaries)} documents failed.")
+
+    def _render_options(self, options):
+        from ...views import InvalidRenderRequest, parse_render_options
+
+        # Validated like the payloads of the API.
+        payload = {
+            'diagrams_per_page': options['diagrams_per_page'],
+            'padding': options['padding'],
+            'board_colors': options['board_colors'],
+            'columns_for_diagrams_per_page': options['columns_for_diagrams_per_page'],
+            'title': options['title'],
+            'show_turn_indicator': options['show_turn_indicator'],
+            'show_page_numbers': options['show_page_numbers'],
+            'show_coordinates': options['show_coordinates'],
+            'renderer': options['renderer'],
+            'output_mode': options['output_mode'],
+            'layout_engine': options['layout_engine'],
+        }
+        if options['draft_dpi'] is not None:
+            payload['draft_dpi'] = options['draft_dpi']
+        try:
+            render_options = parse_render_options(payload)
+        except InvalidRenderRequest as e:
+            raise CommandError(str(e))
+        render_options['shards'] = options['shards']
+        render_options['first_page_number'] = options['first_page_number']
+        if options['parallel_boards'] is not None:
+            render_options['parallel_boards'] = options['parallel_boards']
+        if options['pool_size'] is not None:
+            if options['pool_size'] < 1:
+                raise CommandError("--pool-size must be at least 1.")
+            render_options['pool_size'] = options['pool_size']
+        return render_options
+
+    def _documents(self, options):
+        """
+        Returns the (source, output path, format) of every document.
+        """
+        inputs = options['inputs']
+        if options['output'] and len(inputs) > 1:
+            raise CommandError("--output takes a single input; use --output-dir for several.")
+        if inputs.count('-') > 1:
+            raise CommandError("stdin can only be read once.")
+
+        documents = []
+        for source in inputs:
+            if options['output']:
+                output_path = options['output']
+            elif source == '-':
+                raise CommandError("--output is required when reading from stdin.")
+            else:
+                name = os.path.basename(source[:-3] if source.endswith('.gz') else source)
+                directory = options['output_dir'] or os.path.dirname(source)
+                output_path = os.path.join(directory, os.path.splitext(name)[0] + '.pdf')
+            if source != '-' and not os.path.isfile(source):
+                raise CommandError(f"{source} is not a file.")
+            documents.append((source, output_path, input_format(source, options['file_format'])))
+
+        output_paths = [output_path for _source, output_path, _format in documents]
+        if len(set(output_paths)) < len(output_paths):
+            raise CommandError("Several inputs would be rendered to the same PDF; use --output-dir.")
+        if options['output_dir']:
+            os.makedirs(options['output_dir'], exist_ok=True)
+        return documents
+
+    def _report(self, summary):
+        source = 'stdin' if summary['source'] == '-' else summary['source']
+        if summary['error']:
+            self.stderr.write(self.style.ERROR(f"{source}: {summary['error']}"))
+            return
+        counters = summary['counters']
+        stages = ', '.join(
+            f"{stage} {seconds:.2f} s"
+            for stage, seconds in sorted(summary['timings'].items(), key=lambda item: -item[1])
+        )
+        self.stdout.write(
+            f"{source} -> {summary['output']}: {counters.get('diagrams', 0)} diagrams, "
+            f"{counters.get('pages', 0)} pages, {counters.get('bytes_out', 0) / 1024:.0f} KB "
+            f"in {summary['seconds']:.2f} s ({stages})"
+        )
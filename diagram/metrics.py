@@ -0,0 +1,191 @@
+import contextvars
+import cProfile
+import io
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+from .config import METRICS_CONFIG
+
+# Descriptions of the counters, in the order they are reported.
+COUNTERS = {
+    'documents': "PDF documents rendered.",
+    'diagrams': "Diagrams placed in rendered documents.",
+    'pages': "Pages of rendered documents.",
+    'bytes_out': "Bytes of rendered PDF documents.",
+    'boards_rendered': "Board drawings rendered (drawing cache and drawing store misses).",
+    'drawing_cache_hits': "Board drawings served from the drawing cache.",
+    'drawing_store_hits': "Board drawings loaded from the persistent drawing store.",
+    'page_cache_hits': "Pages served from the page cache.",
+    'result_cache_hits': "Requests answered from the PDF result cache.",
+    'result_cache_misses': "Requests not found in the PDF result cache.",
+    'renders_coalesced': "Requests answered by an identical render in progress (renders saved).",
+    'admission_rejected': "Requests refused by admission control (413, 429 or 503).",
+    'render_timeouts': "Renders cancelled at their deadline (504).",
+}
+
+_current = contextvars.ContextVar('diagram_render_metrics', default=None)
+
+
+class RenderMetrics:
+    """
+    Stage timings (in seconds) and counters of one request or document.
+    Not thread-safe: an instance belongs to the thread handling the request.
+    """
+    def __init__(self):
+        self.timings = {}
+        self.counters = {}
+
+    def add_time(self, stage, seconds):
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def incr(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def server_timing(self):
+        """
+        Formats the metrics as a Server-Timing header value: stages as durations in milliseconds,
+        counters as descriptions.
+        """
+        entries = [f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in self.timings.items()]
+        entries += [f'{name};desc="{value}"' for name, value in self.counters.items()]
+        return ', '.join(entries)
+
+
+class MetricsRegistry:
+    """
+    Process-wide totals of every collected RenderMetrics.
+    Each worker process has its own registry, so a scraper sees the totals of the worker it reached.
+    """
+    def __init__(self):
+        self.stage_seconds = {}
+        self.stage_count = {}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self._lock = threading.Lock()
+
+    def record(self, metrics):
+        with self._lock:
+            for stage, seconds in metrics.timings.items():
+                self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+                self.stage_count[stage] = self.stage_count.get(stage, 0) + 1
+            for name, value in metrics.counters.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self.stage_seconds.clear()
+            self.stage_count.clear()
+            self.counters = dict.fromkeys(COUNTERS, 0)
+
+    def to_prometheus(self, gauges=None):
+        """
+        Returns the totals in the Prometheus text exposition format.
+        `gauges` maps extra metric names to (description, value) pairs.
+        """
+        with self._lock:
+            stage_seconds = dict(self.stage_seconds)
+            stage_count = dict(self.stage_count)
+            counters = dict(self.counters)
+
+        lines = [
+            '# HELP diagram_stage_seconds_total Time spent in each rendering stage.',
+            '# TYPE diagram_stage_seconds_total counter',
+        ]
+        lines += [f'diagram_stage_seconds_total{{stage="{stage}"}} {seconds:.6f}'
+                  for stage, seconds in sorted(stage_seconds.items())]
+        lines += [
+            '# HELP diagram_stage_calls_total Number of times each rendering stage ran.',
+            '# TYPE diagram_stage_calls_total counter',
+        ]
+        lines += [f'diagram_stage_calls_total{{stage="{stage}"}} {count}'
+                  for stage, count in sorted(stage_count.items())]
+        for name, value in counters.items():
+            lines += [
+                f'# HELP diagram_{name}_total {COUNTERS.get(name, name)}',
+                f'# TYPE diagram_{name}_total counter',
+                f'diagram_{name}_total {value}',
+            ]
+        for name, (description, value) in (gauges or {}).items():
+            lines += [
+                f'# HELP diagram_{name} {description}',
+                f'# TYPE diagram_{name} gauge',
+                f'diagram_{name} {value}',
+            ]
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def current_metrics():
+    """
+    Returns the RenderMetrics being collected in this context, or None.
+    """
+    return _current.get()
+
+
+@contextmanager
+def collect():
+    """
+    Collects the metrics of the code run in the block and yields the RenderMetrics.
+    Nested blocks share the outermost collector, which adds its totals to the registry on exit.
+    """
+    metrics = _current.get()
+    if metrics is not None:
+        yield metrics
+        return
+    metrics = RenderMetrics()
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+        registry.record(metrics)
+
+
+def prometheus_text():
+    """
+    Returns the registry totals, the drawing cache, the admission and the coalescing state in the
+    Prometheus text format.
+    """
+    from .admission import get_admission_controller
+    from .coalescing import get_render_coalescer
+    from .utils import drawing_cache
+    cache_info = drawing_cache.info()
+    admission_info = get_admission_controller().info()
+    gauges = {
+        'drawing_cache_entries': ("Board drawings held in the drawing cache.", cache_info['size']),
+        'drawing_cache_capacity': ("Maximum number of board drawings in the drawing cache.", cache_info['maxsize']),
+        'admission_cost_in_flight': ("Cost of the requests being rendered or waiting for a render slot.",
+                                     admission_info['cost_in_flight']),
+        'admission_renders_running': ("Renders running in this process.", admission_info['running']),
+    }
+    coalescer = get_render_coalescer()
+    if coalescer is not None:
+        coalescing_info = coalescer.info()
+        gauges['coalescing_renders_in_flight'] = ("Coalesced renders in progress in this process.",
+                                                  coalescing_info['in_flight'])
+        gauges['coalescing_requests_waiting'] = ("Requests waiting for an identical render in progress.",
+                                                 coalescing_info['waiting'])
+    return registry.to_prometheus(gauges)
+
+
+def profile_call(function, *args, **kwargs):
+    """
+    Runs `function` under cProfile and returns the pstats summary, sorted by cumulative time.
+    """
+    profiler = cProfile.Profile()
+    profiler.runcall(function, *args, **kwargs)
+    summary = io.StringIO()
+    stats = pstats.Stats(profiler, stream=summary)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(METRICS_CONFIG['profile_limit'])
+    return summary.getvalue()
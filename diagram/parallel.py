@@ -0,0 +1,139 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .config import CHESS_BOARD_CONFIG, PARALLEL_CONFIG
+from .drawing_store import get_drawing_store, stores_renderer
+from .metrics import current_metrics
+from .utils import RENDERERS, drawing_cache, normalize_board_request, share_drawing
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_size = None
+_pool_lock = threading.Lock()
+
+
+def process_pool_size(pool_size=None):
+    """
+    Returns the number of worker processes of the shared pool: its size once it is started, otherwise
+    `pool_size`, PARALLEL_CONFIG['pool_size'] or every core, in that order.
+    """
+    if _pool_size is not None:
+        return _pool_size
+    return pool_size or PARALLEL_CONFIG['pool_size'] or os.cpu_count() or 1
+
+
+def get_process_pool(pool_size=None):
+    """
+    Returns the shared process pool, creating it with process_pool_size(pool_size) workers on first use.
+    The pool is never resized: it is kept between requests so workers keep their imports and
+    drawing caches warm, and callers bound the work they submit to its size instead.
+    """
+    global _pool, _pool_size
+    with _pool_lock:
+        if _pool is None:
+            workers = process_pool_size(pool_size)
+            _pool = ProcessPoolExecutor(max_workers=workers)
+            _pool_size = workers
+            logger.info("Started a diagram process pool with %s workers", workers)
+        return _pool
+
+
+def shutdown_process_pool():
+    global _pool, _pool_size
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = None
+        _pool_size = None
+
+
+def _render_board(task):
+    """
+    Renders one board in a worker process. Must stay a module-level function to be picklable.
+    """
+    fen_string, board_colors, show_turn_indicator, show_coordinates, renderer = task
+    board, colors_config, _key = normalize_board_request(
+        fen_string, board_colors, show_turn_indicator, show_coordinates, renderer
+    )
+    return RENDERERS[renderer](board, colors_config, show_turn_indicator, show_coordinates)
+
+
+def prepare_drawings(
+    fen_strings,
+    board_colors=None,
+    show_turn_indicator=False,
+    show_coordinates=CHESS_BOARD_CONFIG['coordinates'],
+    renderer=CHESS_BOARD_CONFIG['renderer'],
+    parallel=PARALLEL_CONFIG['parallel_boards'],
+    pool_size=None,
+    min_batch_size=PARALLEL_CONFIG['min_batch_size'],
+):
+    """
+    Renders the drawings for a list of FEN strings and returns them in input order.
+    Boards already in the drawing cache or the drawing store are reused and identical boards are rendered once.
+    With `parallel` and at least `min_batch_size` boards left to render, they are rendered in the
+    shared process pool, otherwise serially in this process; `pool_size` only sizes the pool when
+    this call starts it (see process_pool_size).
+    Like fen_to_drawing, every returned Drawing is an independent copy, and renders and cache hits
+    are counted in the metrics being collected.
+    """
+    keys = []
+    drawings_by_key = {}
+    pending = {}
+    for fen_string in fen_strings:
+        _board, _colors, key = normalize_board_request(
+            fen_string, board_colors, show_turn_indicator, show_coordinates, renderer
+        )
+        keys.append(key)
+        if key in drawings_by_key or key in pending:
+            continue
+        drawing = drawing_cache.get(key)
+        if drawing is None:
+            pending[key] = fen_string
+        else:
+            drawings_by_key[key] = drawing
+
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.incr('drawing_cache_hits', len(drawings_by_key))
+
+    store = get_drawing_store() if pending and stores_renderer(renderer) else None
+    if store is not None:
+        stored = store.get_many(pending)
+        for key, drawing in stored.items():
+            drawing = share_drawing(drawing)
+            drawings_by_key[key] = drawing
+            drawing_cache.put(key, drawing)
+            del pending[key]
+        if metrics is not None:
+            metrics.incr('drawing_store_hits', len(stored))
+
+    if metrics is not None:
+        metrics.incr('boards_rendered', len(pending))
+
+    if pending:
+        start = time.perf_counter()
+        tasks = [
+            (fen_string, board_colors, show_turn_indicator, show_coordinates, renderer)
+            for fen_string in pending.values()
+        ]
+        if parallel and len(tasks) >= min_batch_size:
+            pool = get_process_pool(pool_size)
+            drawings = pool.map(_render_board, tasks, chunksize=PARALLEL_CONFIG['chunksize'])
+        else:
+            drawings = map(_render_board, tasks)
+        rendered = list(zip(pending, drawings))
+        for key, drawing in rendered:
+            drawing = share_drawing(drawing)
+            drawings_by_key[key] = drawing
+            drawing_cache.put(key, drawing)
+        if metrics is not None:
+            metrics.add_time('render', time.perf_counter() - start)
+        if store is not None:
+            store.put_many(rendered)
+
+    return [drawings_by_key[key].copy() for key in keys]
@@ -0,0 +1,254 @@
+import hashlib
+import re
+import zlib
+from io import BytesIO
+
+from reportlab.lib.rl_accel import asciiBase85Decode
+
+# Reads and joins the PDFs written by ReportLab: a classic cross-reference table, no object streams,
+# direct stream lengths and escaped parentheses in strings. It is not a general PDF parser.
+
+_OBJECT_HEADER = re.compile(rb'\s*(\d+)\s+(\d+)\s+obj\b')
+# Strings are matched too, so that the references are only rewritten outside of them.
+_REFERENCE = re.compile(rb'\((?:[^()\\]|\\.)*\)|(\d+)\s+(\d+)\s+R\b', re.S)
+_STREAM_KEYWORD = re.compile(rb'\bstream(?:\r\n|\n)')
+_LENGTH = re.compile(rb'/Length\s+(\d+)(\s+\d+\s+R)?')
+_XREF_SECTION = re.compile(rb'(\d+)\s+(\d+)\s*$')
+_VERSION = re.compile(rb'%PDF-(\d+)\.(\d+)')
+
+
+class PdfMergeError(ValueError):
+    """
+    Raised when a document does not have the structure of a PDF written by ReportLab.
+    """
+
+
+class PdfFile:
+    """
+    The objects of a PDF written by ReportLab. Each object is kept as the bytes before its stream data
+    (the dictionary and the 'stream' keyword, or the whole object), the stream data (None for objects
+    without a stream) and the bytes after it.
+    """
+    def __init__(self, data):
+        offsets, xref_offset = self._read_xref(data)
+        trailer = data[xref_offset:]
+        self.root = self._trailer_reference(trailer, b'Root')
+        self.info = self._trailer_reference(trailer, b'Info')
+        # Leading bytes up to the first object: the version line and the binary marker comment.
+        self.header = data[:min(offsets.values())] if offsets else data[:xref_offset]
+        version = _VERSION.match(self.header)
+        if version is None:
+            raise PdfMergeError("The document does not start with a PDF version.")
+        self.version = (int(version.group(1)), int(version.group(2)))
+
+        self.objects = {}
+        # An object ends where the next one (or the cross-reference table) starts.
+        starts = sorted(offsets.values())
+        ends = dict(zip(starts, starts[1:] + [xref_offset]))
+        for number, offset in offsets.items():
+            self.objects[number] = self._read_object(data[offset:ends[offset]], number)
+
+    @staticmethod
+    def _read_xref(data):
+        start = data.rfind(b'startxref')
+        if start < 0:
+            raise PdfMergeError("The document has no startxref.")
+        xref_offset = int(data[start + len(b'startxref'):].split()[0])
+        lines = data[xref_offset:start].splitlines()
+        if not lines or lines[0].strip() != b'xref':
+            raise PdfMergeError("The document has no cross-reference table (object streams are not supported).")
+
+        offsets = {}
+        number = 0
+        for line in lines[1:]:
+            line = line.strip()
+            if line.startswith(b'trailer'):
+                break
+            section = _XREF_SECTION.match(line)
+            if section:
+                number = int(section.group(1))
+                continue
+            offset, _generation, kind = line.split()
+            if kind == b'n':
+                offsets[number] = int(offset)
+            number += 1
+        return offsets, xref_offset
+
+    @staticmethod
+    def _trailer_reference(trailer, key):
+        match = re.search(rb'/' + key + rb'\s+(\d+)\s+\d+\s+R', trailer)
+        return int(match.group(1)) if match else None
+
+    @staticmethod
+    def _read_object(span, number):
+        header = _OBJECT_HEADER.match(span)
+        end = span.rfind(b'endobj')
+        if header is None or int(header.group(1)) != number or end < 0:
+            raise PdfMergeError(f"Object {number} is not at its cross-reference offset.")
+        body = span[header.end():end]
+        if not body.rstrip().endswith(b'endstream'):
+            return body, None, b''
+
+        keyword = _STREAM_KEYWORD.search(body)
+        length = _LENGTH.search(body)
+        if keyword is None or length is None or length.group(2):
+            raise PdfMergeError(f"The stream of object {number} has no direct length.")
+        data_start = keyword.end()
+        data_end = data_start + int(length.group(1))
+        if not body[data_end:].strip().startswith(b'endstream'):
+            raise PdfMergeError(f"The stream of object {number} does not match its length.")
+        return body[:data_start], body[data_start:data_end], body[data_end:]
+
+    def page_numbers(self):
+        """
+        Returns the object numbers of the pages, in document order.
+        """
+        pages = []
+
+        def visit(number):
+            prefix = self.objects[number][0]
+            kids = re.search(rb'/Kids\s*\[([^\]]*)\]', prefix)
+            if kids is None:
+                pages.append(number)
+                return
+            for match in re.finditer(rb'(\d+)\s+\d+\s+R', kids.group(1)):
+                visit(int(match.group(1)))
+
+        catalog = self.objects[self.root][0]
+        visit(int(re.search(rb'/Pages\s+(\d+)\s+\d+\s+R', catalog).group(1)))
+        return pages
+
+    def page_tree_numbers(self):
+        """
+        Returns the object numbers of the page tree nodes (not the pages themselves).
+        """
+        return [number for number, (prefix, data, _suffix) in self.objects.items()
+                if data is None and re.search(rb'/Type\s*/Pages\b', prefix)]
+
+    def page_contents(self):
+        """
+        Returns the decoded content streams of every page, in document order.
+        """
+        contents = []
+        for number in self.page_numbers():
+            match = re.search(rb'/Contents\s*(\[[^\]]*\]|\d+\s+\d+\s+R)', self.objects[number][0])
+            streams = re.findall(rb'(\d+)\s+\d+\s+R', match.group(1)) if match else []
+            contents.append(b''.join(self.decoded_stream(int(stream)) for stream in streams))
+        return contents
+
+    def decoded_stream(self, number):
+        """
+        Returns the data of a stream object with its ASCII85Decode and FlateDecode filters undone.
+        """
+        prefix, data, _suffix = self.objects[number]
+        filters = re.search(rb'/Filter\s*(\[[^\]]*\]|/\w+)', prefix)
+        for name in re.findall(rb'/(\w+)', filters.group(1)) if filters else []:
+            if name == b'ASCII85Decode':
+                data = asciiBase85Decode(data)
+            elif name == b'FlateDecode':
+                data = zlib.decompress(data)
+            else:
+                raise PdfMergeError(f"Unsupported stream filter {name.decode()}.")
+        return data
+
+
+def merge_pdfs(pdfs, output=None):
+    """
+    Joins PDF documents written by ReportLab into one document holding their pages in order.
+    The catalog and the document information of the first document are kept. Objects that are identical
+    once renumbered, such as the fonts and the Form XObjects every document defines, are written once.
+    Returns the PDF bytes, or writes the PDF to the file-like `output` and returns None when it is given.
+    """
+    files = [pdf if isinstance(pdf, PdfFile) else PdfFile(pdf) for pdf in pdfs]
+    if not files:
+        raise PdfMergeError("There is no document to merge.")
+
+    # The catalog, the page tree root and the document information come first.
+    catalog, page_tree, info = 1, 2, 3
+    # Every page tree node is replaced by the single page tree root.
+    numbers = {(index, number): page_tree for index, pdf in enumerate(files) for number in pdf.page_tree_numbers()}
+    bodies = {}
+    by_content = {}
+    resolving = set()
+    next_number = info + 1
+
+    def allocate():
+        nonlocal next_number
+        next_number += 1
+        return next_number - 1
+
+    def body_of(index, number):
+        if number not in files[index].objects:
+            raise PdfMergeError(f"Document {index} references the missing object {number}.")
+        prefix, data, suffix = files[index].objects[number]
+
+        def replace(match):
+            if not match.group(1):
+                return match.group(0)
+            return b'%d 0 R' % resolve(index, int(match.group(1)))
+
+        return _REFERENCE.sub(replace, prefix) + (data or b'') + suffix
+
+    def resolve(index, number, shared=True):
+        key = (index, number)
+        if key in numbers:
+            return numbers[key]
+        if key in resolving:
+            # A reference cycle: number the object now, without deduplicating it.
+            numbers[key] = allocate()
+            return numbers[key]
+
+        resolving.add(key)
+        body = body_of(index, number)
+        resolving.discard(key)
+        if key not in numbers:
+            if shared:
+                digest = hashlib.sha256(body).digest()
+                if digest not in by_content:
+                    by_content[digest] = allocate()
+                numbers[key] = by_content[digest]
+            else:
+                numbers[key] = allocate()
+        bodies.setdefault(numbers[key], body)
+        return numbers[key]
+
+    # Pages are never shared, even when two of them draw the same content.
+    kids = [resolve(index, number, shared=False) for index, pdf in enumerate(files) for number in pdf.page_numbers()]
+    bodies[catalog] = body_of(0, files[0].root)
+    bodies[info] = body_of(0, files[0].info) if files[0].info is not None else b'\n<<\n>>\n'
+    bodies[page_tree] = b'\n<<\n/Count %d /Kids [ %s ] /Type /Pages\n>>\n' % (
+        len(kids), b' '.join(b'%d 0 R' % kid for kid in kids)
+    )
+
+    buffer = BytesIO() if output is None else output
+    digest = hashlib.md5()
+    written = 0
+
+    def write(chunk):
+        nonlocal written
+        buffer.write(chunk)
+        digest.update(chunk)
+        written += len(chunk)
+
+    # The pages of a shard may need a later version than those of the first one (transparency needs 1.4).
+    write(max(files, key=lambda pdf: pdf.version).header)
+    size = max(bodies) + 1
+    offsets = [0] * size
+    for number in sorted(bodies):
+        offsets[number] = written
+        write(b'%d 0 obj' % number + bodies[number] + b'endobj\n')
+
+    xref_offset = written
+    lines = [b'xref', b'0 %d' % size, b'0000000000 65535 f ']
+    lines += [b'%010d 00000 n ' % offset for offset in offsets[1:]]
+    identifier = digest.hexdigest().encode('ascii')
+    lines += [
+        b'trailer', b'<<', b'/ID ', b'[<%s><%s>]' % (identifier, identifier),
+        b'/Info %d 0 R' % info, b'/Root %d 0 R' % catalog, b'/Size %d' % size, b'>>',
+        b'startxref', b'%d' % xref_offset, b'%%EOF', b'',
+    ]
+    buffer.write(b'\n'.join(lines))
+
+    if output is not None:
+        return None
+    return buffer.getvalue()
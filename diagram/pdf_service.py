@@ -1,16 +1,384 @@
+import hashlib
+import json
 import logging
+import re
+import time
+from collections.abc import Sequence
+from concurrent.futures import as_completed
 from io import BytesIO
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, PageBreak, Paragraph
+from itertools import islice
+from reportlab.platypus import Flowable, SimpleDocTemplate, Table, TableStyle, PageBreak, Paragraph
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4
-from .config import PDF_CONFIG, DIAGRAM_CONFIG, TABLE_CONFIG, CHESS_BOARD_CONFIG
-from .utils import fen_to_drawing
+from reportlab.lib.units import inch
+from reportlab.pdfbase.pdfdoc import PDF_VERSION_DEFAULT
+from reportlab.pdfgen.canvas import Canvas
+from .config import PDF_CONFIG, DIAGRAM_CONFIG, TABLE_CONFIG, CHESS_BOARD_CONFIG, PARALLEL_CONFIG, DRAFT_CONFIG
+from .metrics import collect
+from .parallel import get_process_pool, prepare_drawings, process_pool_size
+from .pdf_merge import merge_pdfs
+from .raster import DraftBoardFlowable
+from .utils import DrawingCache
+from .xobjects import FormBoardFlowable
 
 logger = logging.getLogger(__name__)
 
 from reportlab.platypus import Spacer
 
+# Ways of embedding the boards in the PDF, see PDF_CONFIG['output_mode'].
+OUTPUT_MODES = ('vector', 'xobject', 'draft')
+
+# Ways of laying out the pages, see PDF_CONFIG['layout_engine'].
+LAYOUT_ENGINES = ('canvas', 'platypus')
+
+# Padding of the frame SimpleDocTemplate places inside the page margins, reproduced by the canvas engine.
+FRAME_PADDING = 6
+
+
+class RenderCancelled(Exception):
+    """
+    Raised from a progress callback to abort the document being built.
+    """
+
+
+class RenderTimeout(RenderCancelled):
+    """
+    Raised when the document being built passes its `deadline`.
+    """
+
+
+def _fen_of(fen_item):
+    # Support both dict objects with 'fen' and raw FEN strings
+    return fen_item.get('fen') if isinstance(fen_item, dict) else fen_item
+
+
+def _chunked(iterable, size):
+    """
+    Yields lists of `size` consecutive items (the last one may be shorter) without materializing the input.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class _LazyStory(list):
+    """
+    A platypus story that pulls its flowables from an iterator as the document is built.
+    doc.build only works at the front of the list, so keeping a couple of flowables ahead
+    (for keepWithNext handling) is enough and the rest of the document is never materialized.
+    """
+    def __init__(self, flowables, lookahead=2):
+        super().__init__()
+        self._source = iter(flowables)
+        self._lookahead = lookahead
+
+    def __len__(self):
+        while self._source is not None and list.__len__(self) < self._lookahead:
+            try:
+                self.append(next(self._source))
+            except StopIteration:
+                self._source = None
+        return list.__len__(self)
+
+    def __bool__(self):
+        return len(self) > 0
+
+
+class PageCache(DrawingCache):
+    """
+    The LRU cache of captured page contents (see _capture_page_content), bounded by their total size:
+    `maxsize` is a number of bytes, as a page of many diagrams weighs hundreds of kilobytes.
+    Entries are (content, fonts, pdf_version, size) tuples; `size` is the one of the page table of the
+    platypus engine, and None for the canvas engine.
+    """
+    def __init__(self, maxsize):
+        super().__init__(maxsize)
+        self.bytes = 0
+
+    @staticmethod
+    def entry_size(page_content):
+        content, fonts, _pdf_version, _size = page_content
+        return len(content) + sum(len(internal) + len(name) for internal, name in fonts.items())
+
+    def put(self, key, page_content):
+        size = self.entry_size(page_content)
+        if size > self.maxsize:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= self.entry_size(previous)
+            self._entries[key] = page_content
+            self.bytes += size
+            self._evict()
+
+    def _evict(self):
+        while self._entries and self.bytes > max(self.maxsize, 0):
+            _key, evicted = self._entries.popitem(last=False)
+            self.bytes -= self.entry_size(evicted)
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        info = super().info()
+        with self._lock:
+            info['bytes'] = self.bytes
+        return info
+
+
+# Rendered page grids of both layout engines, keyed by a hash of the page inputs (see _capture_page_content).
+page_cache = PageCache(PDF_CONFIG['page_cache_bytes'])
+
+# Font references and the operators using page resources other than fonts in a content stream.
+_FONT_REFERENCE = re.compile(r'/F\d+\b')
+_OTHER_RESOURCES = re.compile(r'/\S+ (?:gs|Do|sh|cs|CS)\b')
+
+
+def _start_page_capture(canv):
+    """
+    Returns the start of the content captured by _capture_page_content: the position of the next content
+    stream operator and the PDF version of the document so far. The version is reset to the default one,
+    so the capture records the version the page content requires (ReportLab raises it to 1.4 on any use
+    of transparency, even when no graphics state ends up in the content).
+    """
+    doc_version = canv._doc._pdfVersion
+    canv._doc._pdfVersion = PDF_VERSION_DEFAULT
+    return len(canv._code), doc_version
+
+
+def _capture_page_content(canv, start, size=None):
+    """
+    Returns the content stream operators drawn on the canvas page since `start` (see _start_page_capture),
+    with the fonts they use, the PDF version they require and the `size` of what they draw, or None when
+    they use other page resources (graphics states, XObjects...) that cannot be replayed.
+    """
+    code_start, doc_version = start
+    pdf_version = canv._doc._pdfVersion
+    canv._doc._pdfVersion = max(doc_version, pdf_version)
+    content = '\n'.join(canv._code[code_start:])
+    if _OTHER_RESOURCES.search(content):
+        return None
+    font_names = set(_FONT_REFERENCE.findall(content))
+    fonts = {internal: name for name, internal in canv._doc.fontMapping.items() if internal in font_names}
+    return content, fonts, pdf_version, size
+
+
+def _replay_page_content(canv, page_content):
+    """
+    Appends captured page content to the current canvas page, renaming its fonts to the ones of this document
+    and raising the PDF version of the document to the one the content requires, as drawing it would.
+    """
+    content, fonts, pdf_version, _size = page_content
+    renames = {internal: canv._doc.getInternalFontName(name) for internal, name in fonts.items()}
+    if any(internal != renamed for internal, renamed in renames.items()):
+        content = _FONT_REFERENCE.sub(lambda match: renames.get(match.group(0), match.group(0)), content)
+    canv._code.append(content)
+    canv._doc._pdfVersion = max(canv._doc._pdfVersion, pdf_version)
+
+
+class _CapturedTable(Flowable):
+    """
+    A page table of the platypus engine that puts the content it draws into the page cache under `key`.
+    It draws the table the way the frame would, so its operators are those of the table alone.
+    """
+    def __init__(self, table, key):
+        super().__init__()
+        self.table = table
+        self.key = key
+        self.hAlign = table.hAlign
+
+    def wrap(self, availWidth, availHeight):
+        self.width, self.height = self.table.wrap(availWidth, availHeight)
+        return self.width, self.height
+
+    def split(self, availWidth, availHeight):
+        # A table too tall for its page is split and drawn without the cache.
+        return self.table.split(availWidth, availHeight)
+
+    def draw(self):
+        start = _start_page_capture(self.canv)
+        self.table.canv = self.canv
+        try:
+            self.table.draw()
+        finally:
+            del self.table.canv
+        content = _capture_page_content(self.canv, start, (self.width, self.height))
+        if content is not None:
+            page_cache.put(self.key, content)
+
+
+class _CachedTable(Flowable):
+    """
+    A page table of the platypus engine replayed from the page cache (see _CapturedTable).
+    """
+    def __init__(self, page_content):
+        super().__init__()
+        self.page_content = page_content
+        self.width, self.height = page_content[3]
+        # The default alignment of the tables of PageGrid.page_table.
+        self.hAlign = 'CENTER'
+
+    def wrap(self, availWidth, availHeight):
+        return self.width, self.height
+
+    def draw(self):
+        _replay_page_content(self.canv, self.page_content)
+
+
+class PageGrid:
+    """
+    The page geometry shared by the layout engines and the previews: the frame of a SimpleDocTemplate
+    with its default margins, the grid columns and rows, the cell paddings and the title block.
+    """
+    def __init__(
+        self,
+        diagrams_per_page=PDF_CONFIG['default_diagrams_per_page'],
+        padding=None,
+        columns_for_diagrams_per_page=None,
+        title=None,
+        page_size=PDF_CONFIG['page_size'],
+        margin=inch
+    ):
+        self.page_size = page_size
+        self.left_margin = self.bottom_margin = margin
+        self.width = page_size[0] - 2 * margin
+        self.height = page_size[1] - 2 * margin
+        self.diagrams_per_page = diagrams_per_page
+
+        # Use provided layout or fallback to config
+        layout_thresholds = columns_for_diagrams_per_page or DIAGRAM_CONFIG['grid_layout_thresholds']
+
+        # Define grid layout based on diagrams_per_page
+        if diagrams_per_page <= layout_thresholds.get('single_column', 1):
+            self.cols = 1
+        elif diagrams_per_page <= layout_thresholds.get('two_column_max', 8):
+            self.cols = 2
+        else:
+            self.cols = 3
+        self.rows = (diagrams_per_page + self.cols - 1) // self.cols  # A formula to avoid calling math.ceil
+
+        # Use provided padding or fallback to config
+        table_padding = padding or TABLE_CONFIG['padding']
+        self.top_padding = table_padding.get('top', 5)
+        self.bottom_padding = table_padding.get('bottom', 5)
+        self.left_padding = table_padding.get('left', 0)
+        self.right_padding = table_padding.get('right', 0)
+        self.padding_before_desc = PDF_CONFIG.get('padding_before_desc')
+
+        self.col_width = self.width / self.cols
+        self.cell_width = self.col_width - self.left_padding - self.right_padding
+        self.frame_top = self.bottom_margin + self.height - FRAME_PADDING
+
+        styles = getSampleStyleSheet()
+        self.description_style = ParagraphStyle(
+            name='CenteredNormal',
+            fontName='Times-Roman',
+            parent=styles['Normal'],
+            alignment=1  # 1 = TA_CENTER
+        )
+        self.title_paragraph = None
+        self.title_height = 0
+        if title:
+            centered_h1 = ParagraphStyle(
+                name='CenteredH1',
+                fontName='Times-Roman',
+                fontSize=20,
+                parent=styles['h1'],
+                alignment=1  # 1 = TA_CENTER
+            )
+            self.title_paragraph = Paragraph(title, centered_h1)
+            # Measure at the width of the frame the title is drawn in.
+            _w, self.title_height = self.title_paragraph.wrap(self.width - 2 * FRAME_PADDING, self.height)
+
+    def description_paragraph(self, description):
+        """
+        Returns the Paragraph of a description, wrapped to the cell width.
+        """
+        paragraph = Paragraph(description, self.description_style)
+        # Use wrap(), not wrapOn(), for measurement as the canvas is not available yet. Both engines lay the
+        # text out in the cell inside its paddings, narrower than the column the heights were once measured at.
+        paragraph.wrap(self.cell_width, self.height)
+        return paragraph
+
+    def content_top(self, is_first_page):
+        """
+        Returns the y coordinate of the top of the diagram grid; the title, its space after and
+        the spacer below it (half its height) come first on the first page.
+        """
+        if is_first_page and self.title_paragraph is not None:
+            return self.frame_top - self.title_height * 1.5 - self.title_paragraph.getSpaceAfter()
+        return self.frame_top
+
+    def cell_sizes(self, max_desc_height, is_first_page):
+        """
+        Returns the diagram size and the row height of a page whose tallest description is `max_desc_height`.
+        """
+        available_page_height = self.height
+        if is_first_page and self.title_paragraph is not None:
+            # On inclut l'espace après le titre dans la hauteur totale du titre
+            available_page_height -= self.title_height * 1.5
+
+        available_height_for_content_per_row = available_page_height / self.rows
+        diagram_height_max = available_height_for_content_per_row - max_desc_height - self.padding_before_desc - self.top_padding - self.bottom_padding -6
+
+        diagram_size = min(DIAGRAM_CONFIG['default_size'], self.width / self.cols - 20, diagram_height_max)  # Ensure diagrams fit within page width
+
+        content_height = diagram_size + max_desc_height + self.padding_before_desc
+        row_height = content_height + self.top_padding + self.bottom_padding
+        return diagram_size, row_height
+
+    def cell_flowables(self, board, paragraph):
+        """
+        Returns the flowables of a cell of the platypus engine: its board, if any, then its description.
+        """
+        flowables = [board] if board is not None else []
+        if paragraph is not None:
+            flowables += [Spacer(1, self.padding_before_desc), paragraph]
+        return flowables
+
+    def page_table(self, cells, row_height):
+        """
+        Returns the Table the platypus engine lays a page out with, from the flowables of its cells
+        (see cell_flowables); every row has the same height.
+        """
+        rows = [cells[start:start + self.cols] for start in range(0, len(cells), self.cols)]
+        table = Table(rows, colWidths=[self.col_width] * self.cols, rowHeights=[row_height] * len(rows))
+        table.setStyle(TableStyle([
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+            ('ALIGN', (0, 0), (-1, -1), TABLE_CONFIG['alignment']['horizontal']),
+            ('LEFTPADDING', (0, 0), (-1, -1), self.left_padding),
+            ('RIGHTPADDING', (0, 0), (-1, -1), self.right_padding),
+            ('TOPPADDING', (0, 0), (-1, -1), self.top_padding),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), self.bottom_padding),
+        ]))
+        return table
+
+    def cell_positions(self, index, top, diagram_size, row_height, description_height=0):
+        """
+        Returns the bottom-left corners of the diagram and of the description of the cell at `index`,
+        placed the way the platypus Table places them (top aligned, centered diagram).
+        """
+        row, col = divmod(index, self.cols)
+        cell_x = self.left_margin + col * self.col_width
+        y = top - row * row_height - self.top_padding - diagram_size
+        board_x = cell_x + (self.col_width + self.left_padding - self.right_padding - diagram_size) / 2
+        description_y = y - self.padding_before_desc - description_height
+        return (board_x, y), (cell_x + self.left_padding, description_y)
+
+
 def create_pdf_from_fens(
     fens,
     diagrams_per_page=PDF_CONFIG['default_diagrams_per_page'],
@@ -20,153 +388,218 @@ def create_pdf_from_fens(
     title=None,
     show_turn_indicator=False,
     show_page_numbers=False,
-    show_coordinates=CHESS_BOARD_CONFIG['coordinates']
+    show_coordinates=CHESS_BOARD_CONFIG['coordinates'],
+    renderer=CHESS_BOARD_CONFIG['renderer'],
+    output_mode=PDF_CONFIG['output_mode'],
+    layout_engine=PDF_CONFIG['layout_engine'],
+    draft_dpi=DRAFT_CONFIG['dpi'],
+    parallel_boards=PARALLEL_CONFIG['parallel_boards'],
+    pool_size=None,
+    output=None,
+    progress_callback=None,
+    deadline=None,
+    shards=None,
+    first_page_number=1
 ):
     """
     Creates a PDF document with a grid layout of chess diagrams from a list of FEN objects.
+    `renderer` selects the board rendering engine (see utils.RENDERERS).
+    `output_mode` selects how boards are embedded (see OUTPUT_MODES); in 'xobject' mode the empty
+    boards and piece glyphs are shared Form XObjects and `renderer` is not used; in 'draft' mode each
+    distinct board is placed as one shared bitmap of `draft_dpi` at the largest diagram size (see raster.py).
+    `layout_engine` selects how pages are laid out (see LAYOUT_ENGINES): 'canvas' computes the grid
+    positions up front and draws straight onto a canvas, 'platypus' builds a Table per page.
+    Both produce the same page layout, computed by PageGrid.
+    `parallel_boards` prepares the drawings of large batches in the shared process pool instead of this
+    process, and `pool_size` sizes that pool if this build starts it (see parallel.prepare_drawings).
+    `fens` may be any iterable: pages are laid out and rendered as the document is built, so only the
+    drawings of the current batch of pages are kept in memory.
+    With vector output, the grid of each page (its page table with platypus) is kept in the page cache,
+    so re-rendering an edited document only draws the pages whose diagrams or descriptions changed.
+    Returns the PDF bytes, or writes the PDF to the file-like `output` and returns None when it is given.
+    `progress_callback(pages_done, total_pages)` is called after each page; `total_pages` is None when
+    `fens` has no length. The callback may raise RenderCancelled to stop the build.
+    `deadline` is a time.monotonic() value: the build checks it before each batch of drawings and each
+    page, and raises RenderTimeout once it has passed.
+    With `shards` (PARALLEL_CONFIG['shards'] when None) above 1, a document of at least
+    PARALLEL_CONFIG['min_pages_per_shard'] pages per shard is split into page ranges built in the process
+    pool and joined with pdf_merge.merge_pdfs (see _create_sharded_pdf); `fens` must then be a sequence,
+    like the NormalizedFens of validation.validate_fens. Pages are numbered from `first_page_number`.
+    Stage timings and counters are added to the metrics being collected (see metrics.collect).
     """
-    buffer = BytesIO()
+    if output_mode not in OUTPUT_MODES:
+        raise ValueError(f"Unknown output mode '{output_mode}', expected one of {', '.join(OUTPUT_MODES)}.")
+    if layout_engine not in LAYOUT_ENGINES:
+        raise ValueError(
+            f"Unknown layout engine '{layout_engine}', expected one of {', '.join(LAYOUT_ENGINES)}."
+        )
+
+    if shards is None:
+        shards = PARALLEL_CONFIG['shards']
+    shard_count = _shard_count(fens, diagrams_per_page, shards, pool_size)
+    if shard_count > 1:
+        options = dict(
+            diagrams_per_page=diagrams_per_page,
+            padding=padding,
+            board_colors=board_colors,
+            columns_for_diagrams_per_page=columns_for_diagrams_per_page,
+            title=title,
+            show_turn_indicator=show_turn_indicator,
+            show_page_numbers=show_page_numbers,
+            show_coordinates=show_coordinates,
+            renderer=renderer,
+            output_mode=output_mode,
+            layout_engine=layout_engine,
+            draft_dpi=draft_dpi,
+            deadline=deadline,
+        )
+        return _create_sharded_pdf(fens, shard_count, options, first_page_number, pool_size, output,
+                                   progress_callback)
+
+    buffer = BytesIO() if output is None else output
     doc = SimpleDocTemplate(
         buffer,
         pagesize=PDF_CONFIG['page_size'],
+        invariant=PDF_CONFIG['invariant'],
     )
-    page_width = doc.width
-    page_height = doc.height
+    grid = PageGrid(diagrams_per_page, padding, columns_for_diagrams_per_page, title)
 
     story = []
-    styles = getSampleStyleSheet()
-    h_title = 0
-
-    if title:
-        centered_h1 = ParagraphStyle(
-            name='CenteredH1',
-            fontName='Times-Roman',
-            fontSize=20,
-            parent=styles['h1'],
-            alignment=1  # 1 = TA_CENTER
-        )
-        t = Paragraph(title, centered_h1)
-        _w, h_title = t.wrap(page_width, page_height)
-        story.append(t)
+    if grid.title_paragraph is not None:
+        story.append(grid.title_paragraph)
         # Ajoute un espace après le titre pour une meilleure aération
-        story.append(Spacer(1, h_title * 0.5))
-        h_title *= 1.5 # On inclut l'espace dans la hauteur totale du titre
-
-    # Use provided layout or fallback to config
-    layout_thresholds = columns_for_diagrams_per_page or DIAGRAM_CONFIG['grid_layout_thresholds']
-
-    # Define grid layout based on diagrams_per_page
-    if diagrams_per_page <= layout_thresholds.get('single_column', 1):
-        cols = 1
-    elif diagrams_per_page <= layout_thresholds.get('two_column_max', 8):
-        cols = 2
-    else:
-        cols = 3
-
-    # Group FEN objects into pages
-    fen_groups = [fens[i:i + diagrams_per_page] for i in range(0, len(fens), diagrams_per_page)]
-
-    # Use provided padding or fallback to config
-    table_padding = padding or TABLE_CONFIG['padding']
-    top_padding = table_padding.get('top', 5)
-    bottom_padding = table_padding.get('bottom', 5)
-
-    is_first_page = True
-
-    for group in fen_groups:
-        col_width = page_width / cols
-        max_desc_height = 0
-        centered_normal = ParagraphStyle(
-            name='CenteredNormal',
-            fontName='Times-Roman',
-            parent=styles['Normal'],
-            alignment=1  # 1 = TA_CENTER
-        )
-        # Determine the maximum description height for the current group
-        for fen_item in group:
-            # Support both dict objects with 'description' and raw FEN strings
-            if isinstance(fen_item, dict):
-                description = fen_item.get('description')
-            else:
-                description = None
-            if description:
-                p = Paragraph(description, centered_normal)
-                # Use wrap(), not wrapOn(), for measurement as the canvas is not available yet.
-                _w, h = p.wrap(col_width, page_height)
-                max_desc_height = max(max_desc_height, h)
-        
-        available_page_height = page_height
-        if is_first_page and title:
-            available_page_height -= h_title
-            is_first_page = False
-
-        number_of_rows = (diagrams_per_page + cols - 1) // cols  # A formula to avoid calling math.ceil
-        available_height_for_content_per_row = available_page_height / number_of_rows
-        diagram_height_max = available_height_for_content_per_row - max_desc_height - PDF_CONFIG.get('padding_before_desc') - top_padding - bottom_padding -6
-
-        diagram_size = min(DIAGRAM_CONFIG['default_size'], page_width / cols - 20, diagram_height_max)  # Ensure diagrams fit within page width
-
-        table_data = []
-        row_data = []
-        
-        for i, fen_item in enumerate(group):
-            # Support both dict objects with 'fen' and raw FEN strings
-            if isinstance(fen_item, dict):
-                fen = fen_item.get('fen')
-                description = fen_item.get('description')
-            else:
-                fen = fen_item
-                description = None
-
-            # Prepare board_colors, merging the new border_color if provided
-            current_board_colors = dict(board_colors or {})
-            drawing = fen_to_drawing(fen, current_board_colors, show_turn_indicator, show_coordinates)
-
-            item_story = []
-            if drawing:
-                scale = diagram_size / drawing.width
-                drawing.scale(scale, scale)
-                drawing.width = diagram_size
-                drawing.height = diagram_size
-                item_story.append(drawing)
-            
-            if description:
-                item_story.append(Spacer(1, PDF_CONFIG.get('padding_before_desc')))
-                item_story.append(Paragraph(description, centered_normal))
-
-            row_data.append(item_story)
-
-            if len(row_data) == cols or i == len(group) - 1:
-                table_data.append(row_data)
-                row_data = []
-
-        if table_data:
-            content_height = diagram_size + max_desc_height + PDF_CONFIG.get('padding_before_desc')
-            row_height = content_height + top_padding + bottom_padding
-            
-            # Ensure all rows in the table have a consistent height
-            num_rows = len(table_data)
-            table = Table(table_data, colWidths=[col_width]*cols, rowHeights=[row_height]*num_rows)
-            
-            table.setStyle(TableStyle([
-                ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-                ('ALIGN', (0, 0), (-1, -1), TABLE_CONFIG['alignment']['horizontal']),
-                ('LEFTPADDING', (0, 0), (-1, -1), table_padding.get('left', 0)),
-                ('RIGHTPADDING', (0, 0), (-1, -1), table_padding.get('right', 0)),
-                ('TOPPADDING', (0, 0), (-1, -1), table_padding.get('top', 5)),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), table_padding.get('bottom', 5)),
-            ]))
-            story.append(table)
-            story.append(PageBreak())
-
-    if story:
-        # Remove the last PageBreak
-        story.pop()
+        story.append(Spacer(1, grid.title_height * 0.5))
+
+    # Drawings are prepared a batch of pages at a time, large enough to keep the process pool busy
+    # while bounding the number of drawings held in memory.
+    pages_per_batch = max(1, PARALLEL_CONFIG['batch_size'] // diagrams_per_page)
+
+    use_page_cache = output_mode == 'vector' and page_cache.maxsize > 0
+    page_key_options = json.dumps(
+        [layout_engine, diagrams_per_page, padding, board_colors, columns_for_diagrams_per_page,
+         show_turn_indicator, show_coordinates, renderer, PDF_CONFIG['page_size']],
+        sort_keys=True, default=str
+    )
+
+    def check_deadline():
+        if deadline is not None and time.monotonic() > deadline:
+            raise RenderTimeout("The document was not rendered before its deadline.")
+
+    def page_key(group, is_first_page):
+        # The title only moves the grid down on the first page.
+        key = json.dumps([page_key_options, title if is_first_page else None, group], sort_keys=True, default=str)
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def iter_page_layouts():
+        """
+        Yields the page cache key, the cached content, the cells, diagram size and row height of each page.
+        A cell is a (fen, drawing, paragraph) tuple; drawings are None in 'xobject' mode and paragraphs
+        are already wrapped to the cell width. Pages found in the page cache come with their content
+        and no cells, and their boards are not prepared.
+        """
+        page_index = 0
+        # Group FEN objects into pages
+        for batch in _chunked(_chunked(fens, diagrams_per_page), pages_per_batch):
+            check_deadline()
+            keys = [None] * len(batch)
+            cached = [None] * len(batch)
+            if use_page_cache:
+                for i, group in enumerate(batch):
+                    keys[i] = page_key(group, page_index + i == 0)
+                    cached[i] = page_cache.get(keys[i])
+
+            drawings = None
+            if output_mode == 'vector':
+                with metrics.timer('drawings'):
+                    drawings = iter(prepare_drawings(
+                        [_fen_of(fen_item) for group, content in zip(batch, cached) if content is None
+                         for fen_item in group],
+                        dict(board_colors or {}),
+                        show_turn_indicator,
+                        show_coordinates,
+                        renderer,
+                        parallel=parallel_boards,
+                        pool_size=pool_size
+                    ))
+
+            for key, content, group in zip(keys, cached, batch):
+                check_deadline()
+                is_first_page = page_index == 0
+                page_index += 1
+                metrics.incr('diagrams', len(group))
+                if content is not None:
+                    metrics.incr('page_cache_hits')
+                    yield key, content, None, None, None
+                    continue
+
+                layout_start = time.perf_counter()
+                cells = []
+                max_desc_height = 0
+                # Measure each description once and keep the maximum height for the current group
+                for fen_item in group:
+                    # Support both dict objects with 'fen' and raw FEN strings
+                    if isinstance(fen_item, dict):
+                        fen = fen_item.get('fen')
+                        description = fen_item.get('description')
+                    else:
+                        fen = fen_item
+                        description = None
+
+                    paragraph = None
+                    if description:
+                        paragraph = grid.description_paragraph(description)
+                        max_desc_height = max(max_desc_height, paragraph.height)
+                    cells.append((fen, next(drawings) if drawings is not None else None, paragraph))
+
+                diagram_size, row_height = grid.cell_sizes(max_desc_height, is_first_page)
+                metrics.add_time('layout', time.perf_counter() - layout_start)
+                yield key, None, cells, diagram_size, row_height
+
+    # Every draft bitmap has the pixel size of the largest diagram, so identical boards share one image.
+    draft_pixels = max(1, round(grid.cell_sizes(0, False)[0] * draft_dpi / 72))
+
+    def board_flowable(fen, drawing, diagram_size):
+        if output_mode == 'draft':
+            return DraftBoardFlowable(
+                fen, diagram_size, draft_pixels, dict(board_colors or {}), show_turn_indicator, show_coordinates
+            )
+        if output_mode == 'xobject':
+            return FormBoardFlowable(
+                fen, diagram_size, dict(board_colors or {}), show_turn_indicator, show_coordinates
+            )
+        if drawing:
+            scale = diagram_size / drawing.width
+            drawing.scale(scale, scale)
+            drawing.width = diagram_size
+            drawing.height = diagram_size
+            return drawing
+        return None
+
+    def iter_page_tables():
+        for key, content, cells, diagram_size, row_height in iter_page_layouts():
+            if content is not None:
+                yield _CachedTable(content)
+                continue
+            layout_start = time.perf_counter()
+            table = grid.page_table(
+                [grid.cell_flowables(board_flowable(fen, drawing, diagram_size), paragraph)
+                 for fen, drawing, paragraph in cells],
+                row_height
+            )
+            metrics.add_time('layout', time.perf_counter() - layout_start)
+            yield table if key is None else _CapturedTable(table, key)
+
+    def iter_story():
+        yield from story
+        for page_index, table in enumerate(iter_page_tables()):
+            if page_index:
+                yield PageBreak()
+            yield table
 
     def draw_page_number(canvas, doc):
         canvas.saveState()
         canvas.setFont('Times-Roman', 10)
-        page_number_text = f"Page {doc.page}"
+        page_number_text = f"Page {canvas.getPageNumber() + first_page_number - 1}"
         canvas.drawCentredString(
             A4[0] / 2,
             20,
@@ -174,11 +607,169 @@ def create_pdf_from_fens(
         )
         canvas.restoreState()
 
-    if show_page_numbers:
-        doc.build(story, onFirstPage=draw_page_number, onLaterPages=draw_page_number)
-    else:
-        doc.build(story)
+    total_pages = None
+    if progress_callback is not None:
+        total_pages = -(-len(fens) // diagrams_per_page) if hasattr(fens, '__len__') else None
+        doc.afterPage = lambda: progress_callback(doc.page, total_pages)
+
+    def draw_canvas_document():
+        """
+        Draws every page straight onto a canvas at the positions platypus would give the title
+        and the cells of the page tables. Returns the number of pages.
+        """
+        canv = Canvas(buffer, pagesize=PDF_CONFIG['page_size'], invariant=PDF_CONFIG['invariant'])
+        if show_page_numbers:
+            draw_page_number(canv, doc)
+
+        if grid.title_paragraph is not None:
+            grid.title_paragraph.drawOn(canv, grid.left_margin + FRAME_PADDING, grid.frame_top - grid.title_height)
+
+        pages = 0
+        for page_index, (key, content, cells, diagram_size, row_height) in enumerate(iter_page_layouts()):
+            if page_index:
+                canv.showPage()
+                pages += 1
+                if progress_callback is not None:
+                    progress_callback(pages, total_pages)
+                if show_page_numbers:
+                    draw_page_number(canv, doc)
+
+            if content is not None:
+                _replay_page_content(canv, content)
+                continue
+
+            # Page numbers and the title are drawn outside the cached content, which only holds the grid.
+            content_start = _start_page_capture(canv)
+            top = grid.content_top(page_index == 0)
+            for index, (fen, drawing, paragraph) in enumerate(cells):
+                board_position, description_position = grid.cell_positions(
+                    index, top, diagram_size, row_height, paragraph.height if paragraph is not None else 0
+                )
+                board = board_flowable(fen, drawing, diagram_size)
+                if board is not None:
+                    board.drawOn(canv, *board_position)
+                if paragraph is not None:
+                    if board is None:
+                        # Without a board the description moves up to the top of the cell.
+                        description_position = (description_position[0], description_position[1] + diagram_size)
+                    paragraph.drawOn(canv, *description_position)
+
+            if key is not None:
+                content = _capture_page_content(canv, content_start)
+                if content is not None:
+                    page_cache.put(key, content)
+
+        canv.showPage()
+        pages += 1
+        if progress_callback is not None:
+            progress_callback(pages, total_pages)
+        canv.save()
+        return pages
+
+    def prepared_seconds():
+        return metrics.timings.get('drawings', 0.0) + metrics.timings.get('layout', 0.0)
+
+    with collect() as metrics:
+        start_offset = buffer.tell()
+        prepared_before = prepared_seconds()
+        build_start = time.perf_counter()
+        if layout_engine == 'canvas':
+            pages = draw_canvas_document()
+        else:
+            lazy_story = _LazyStory(iter_story())
+            if show_page_numbers:
+                doc.build(lazy_story, onFirstPage=draw_page_number, onLaterPages=draw_page_number)
+            else:
+                doc.build(lazy_story)
+            pages = doc.page
+        # Drawings and layouts are prepared lazily while the document is drawn, the rest is reported as 'build'.
+        metrics.add_time('build', time.perf_counter() - build_start - (prepared_seconds() - prepared_before))
+        metrics.incr('documents')
+        metrics.incr('pages', pages)
+        metrics.incr('bytes_out', buffer.tell() - start_offset)
+
+    if output is not None:
+        return None
+    pdf_data = buffer.getvalue()
+    buffer.close()
+    return pdf_data
+
+
+def _shard_count(fens, diagrams_per_page, shards, pool_size=None):
+    """
+    Returns the number of page-range shards to build a document in: `shards`, lowered so that every
+    shard has at least PARALLEL_CONFIG['min_pages_per_shard'] pages and at most one shard runs per worker
+    of the process pool, or 1 to build it in one process.
+    """
+    if not shards or shards <= 1 or not isinstance(fens, Sequence):
+        return 1
+    total_pages = -(-len(fens) // diagrams_per_page)
+    min_pages = max(1, PARALLEL_CONFIG['min_pages_per_shard'])
+    return max(1, min(shards, process_pool_size(pool_size), total_pages // min_pages))
+
+
+def _build_shard(task):
+    """
+    Builds the pages of one shard in a worker process and returns its PDF bytes and counters.
+    Must stay a module-level function to be picklable.
+    """
+    fens, options = task
+    with collect() as metrics:
+        pdf_data = create_pdf_from_fens(fens, **options)
+    return pdf_data, metrics.counters
+
+
+def _create_sharded_pdf(fens, shard_count, options, first_page_number, pool_size, output, progress_callback):
+    """
+    Splits the pages of a document into `shard_count` consecutive page ranges, builds each range as a PDF
+    in the shared process pool and joins them in page order. The first shard alone gets the title and
+    every shard numbers its pages from its first page, so the pages are those of a single-process build.
+    Each shard prepares its drawings in its worker, with the drawing and page caches of that worker.
+    `progress_callback` is called as shards finish; the deadline is checked by the shards themselves.
+    """
+    diagrams_per_page = options['diagrams_per_page']
+    total_pages = -(-len(fens) // diagrams_per_page)
+    bounds = [total_pages * index // shard_count for index in range(shard_count + 1)]
+    tasks = []
+    for index, (first_page, end_page) in enumerate(zip(bounds, bounds[1:])):
+        shard_options = dict(
+            options,
+            title=options['title'] if index == 0 else None,
+            first_page_number=first_page_number + first_page,
+            parallel_boards=False,
+            shards=0,
+        )
+        tasks.append((list(fens[first_page * diagrams_per_page:end_page * diagrams_per_page]), shard_options))
+
+    with collect() as metrics:
+        pool = get_process_pool(pool_size)
+        futures = {pool.submit(_build_shard, task): end - start for task, start, end in zip(tasks, bounds, bounds[1:])}
+        results = {}
+        try:
+            with metrics.timer('shards'):
+                pages_done = 0
+                for future in as_completed(futures):
+                    pdf_data, counters = future.result()
+                    results[future] = pdf_data
+                    for name, value in counters.items():
+                        if name not in ('documents', 'bytes_out'):
+                            metrics.incr(name, value)
+                    pages_done += futures[future]
+                    if progress_callback is not None:
+                        progress_callback(pages_done, total_pages)
+        finally:
+            for future in futures:
+                future.cancel()
+
+        buffer = BytesIO() if output is None else output
+        start_offset = buffer.tell()
+        with metrics.timer('merge'):
+            merge_pdfs([results[future] for future in futures], buffer)
+        metrics.incr('documents')
+        metrics.incr('bytes_out', buffer.tell() - start_offset)
 
+    if output is not None:
+        return None
     pdf_data = buffer.getvalue()
     buffer.close()
     return pdf_data
@@ -0,0 +1,80 @@
+import logging
+from xml.sax.saxutils import escape
+
+import chess
+import chess.pgn
+
+logger = logging.getLogger(__name__)
+
+
+def _game_heading(headers):
+    """
+    Returns "White - Black, Event Year" from the PGN headers, leaving out unknown ('?') values.
+    """
+    players = ' - '.join(headers.get(color, '?') for color in ('White', 'Black'))
+    parts = [players] if players != '? - ?' else []
+    event = headers.get('Event', '?')
+    if event not in ('', '?'):
+        parts.append(event)
+    year = headers.get('Date', '?')[:4]
+    if year.isdigit():
+        parts.append(year)
+    return ', '.join(parts)
+
+
+def _describe(heading, move_text, comment):
+    description = f"{heading}: {move_text}" if heading else move_text
+    if comment:
+        description = f"{description} {comment}"
+    # Descriptions are rendered as Paragraph markup.
+    return escape(description)
+
+
+def iter_pgn_diagrams(handle, every_ply=None, after_moves=(), comments=False):
+    """
+    Yields {'fen', 'description'} items for the selected positions of every game in a PGN text stream.
+    Games are read one at a time and their moves applied to a single board, so memory stays bounded
+    by the largest game whatever the size of the file.
+    A position is selected when any selector matches it:
+      - `every_ply`: every Nth half-move of the game,
+      - `after_moves`: once the given move numbers are complete (after Black's move),
+      - `comments`: the move leading to it has a comment.
+    Without any selector the final position of each game is yielded.
+    Descriptions are built from the game headers, the move and its comment.
+    """
+    after_moves = set(after_moves or ())
+    select_final = not (every_ply or after_moves or comments)
+
+    game_count = 0
+    while True:
+        game = chess.pgn.read_game(handle)
+        if game is None:
+            break
+        game_count += 1
+        if game.errors:
+            logger.warning("PGN game %s has errors: %s", game_count, game.errors[0])
+
+        heading = _game_heading(game.headers)
+        board = game.board()
+        ply = 0
+        move_text = None
+        for node in game.mainline():
+            move_number = board.fullmove_number
+            dots = '.' if board.turn == chess.WHITE else '...'
+            move_text = f"{move_number}{dots} {board.san(node.move)}"
+            board.push(node.move)
+            ply += 1
+
+            comment = node.comment.strip()
+            selected = (
+                (every_ply and ply % every_ply == 0)
+                or (board.turn == chess.WHITE and board.fullmove_number - 1 in after_moves)
+                or (comments and comment)
+            )
+            if selected:
+                yield {'fen': board.fen(), 'description': _describe(heading, move_text, comment)}
+
+        if select_final:
+            result = game.headers.get('Result', '*')
+            final_text = ' '.join(part for part in (move_text, result) if part and part != '*')
+            yield {'fen': board.fen(), 'description': _describe(heading, final_text or "Initial position", None)}
@@ -0,0 +1,135 @@
+import io
+import logging
+import math
+from itertools import islice
+
+from reportlab.graphics.shapes import Drawing, Group, String
+from reportlab.lib.utils import simpleSplit
+
+from .config import CHESS_BOARD_CONFIG, PDF_CONFIG, PREVIEW_CONFIG
+from .parallel import prepare_drawings
+from .pdf_service import FRAME_PADDING, PageGrid
+from .raster import rasterize_drawing
+from .utils import DrawingCache, shared_shapes_to_svg
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+# Rendered preview images, keyed by the hash of the preview request.
+preview_cache = DrawingCache(PREVIEW_CONFIG['cache_size'])
+
+
+def _fen_and_description(fen_item):
+    # Support both dict objects with 'fen' and raw FEN strings
+    if isinstance(fen_item, dict):
+        return fen_item.get('fen'), fen_item.get('description')
+    return fen_item, None
+
+
+def _add_text(drawing, paragraph, x, y):
+    """
+    Adds the text of a wrapped Paragraph as centered String lines, its bottom-left corner at (x, y).
+    """
+    style = paragraph.style
+    width = paragraph.width
+    lines = simpleSplit(paragraph.getPlainText(), style.fontName, style.fontSize, width)
+    baseline = y + paragraph.height - style.fontSize
+    for line in lines:
+        drawing.add(String(x + width / 2, baseline, line, fontName=style.fontName,
+                           fontSize=style.fontSize, textAnchor='middle'))
+        baseline -= style.leading
+
+
+def page_preview_drawing(
+    fens,
+    diagrams_per_page=PDF_CONFIG['default_diagrams_per_page'],
+    padding=None,
+    board_colors=None,
+    columns_for_diagrams_per_page=None,
+    title=None,
+    show_turn_indicator=False,
+    show_page_numbers=False,
+    show_coordinates=CHESS_BOARD_CONFIG['coordinates'],
+    renderer=CHESS_BOARD_CONFIG['renderer'],
+    output_mode=None,
+    layout_engine=None,
+    draft_dpi=None
+):
+    """
+    Returns a Drawing of the first page of the document create_pdf_from_fens would build, laid out
+    with the same PageGrid. Descriptions are drawn as plain text lines; `output_mode`, `layout_engine`
+    and `draft_dpi` do not change the page and are accepted so render options can be passed as is.
+    """
+    grid = PageGrid(diagrams_per_page, padding, columns_for_diagrams_per_page, title)
+    page = Drawing(*grid.page_size)
+    items = [_fen_and_description(fen_item) for fen_item in islice(fens, diagrams_per_page)]
+    drawings = prepare_drawings(
+        [fen for fen, _description in items],
+        dict(board_colors or {}),
+        show_turn_indicator,
+        show_coordinates,
+        renderer
+    )
+
+    if grid.title_paragraph is not None:
+        _add_text(page, grid.title_paragraph, grid.left_margin + FRAME_PADDING, grid.frame_top - grid.title_height)
+
+    paragraphs = [grid.description_paragraph(description) if description else None for _fen, description in items]
+    max_desc_height = max([paragraph.height for paragraph in paragraphs if paragraph is not None], default=0)
+    diagram_size, row_height = grid.cell_sizes(max_desc_height, True)
+    top = grid.content_top(True)
+    for index, (drawing, paragraph) in enumerate(zip(drawings, paragraphs)):
+        (board_x, board_y), description_position = grid.cell_positions(
+            index, top, diagram_size, row_height, paragraph.height if paragraph is not None else 0
+        )
+        scale = diagram_size / drawing.width
+        page.add(Group(*drawing.contents, transform=(scale, 0, 0, scale, board_x, board_y)))
+        if paragraph is not None:
+            _add_text(page, paragraph, *description_position)
+
+    if show_page_numbers:
+        page.add(String(grid.page_size[0] / 2, 20, "Page 1", fontName='Times-Roman', fontSize=10,
+                        textAnchor='middle'))
+    return page
+
+
+def diagram_preview_drawing(
+    fen,
+    board_colors=None,
+    show_turn_indicator=False,
+    show_coordinates=CHESS_BOARD_CONFIG['coordinates'],
+    renderer=CHESS_BOARD_CONFIG['renderer']
+):
+    """
+    Returns the Drawing of a single board, as placed in the PDF. The turn indicator is drawn right of
+    the board, in the margin of its PDF cell, so the drawing is widened to keep it in the image.
+    """
+    drawing = prepare_drawings([fen], dict(board_colors or {}), show_turn_indicator, show_coordinates, renderer)[0]
+    _x1, _y1, x2, y2 = drawing.getBounds()
+    if x2 <= drawing.width and y2 <= drawing.height:
+        return drawing
+    preview = Drawing(max(drawing.width, math.ceil(x2 + 1)), max(drawing.height, math.ceil(y2 + 1)))
+    preview.add(Group(*drawing.contents))
+    return preview
+
+
+def render_preview(drawing, width, image_format):
+    """
+    Scales a Drawing to `width` points (pixels at 72 dpi) and returns it as PNG or SVG bytes.
+    PNGs are rasterized with Pillow, like the boards of the 'draft' output mode. The shapes may be
+    shared with the drawing cache, so SVGs are written with utils.shared_shapes_to_svg.
+    """
+    if image_format == 'png':
+        image = rasterize_drawing(drawing, width, PREVIEW_CONFIG['supersample'])
+        output = io.BytesIO()
+        image.save(output, format='PNG')
+        return output.getvalue()
+
+    scale = width / drawing.width
+    image = Drawing(width, drawing.height * scale)
+    image.add(Group(*drawing.contents, transform=(scale, 0, 0, scale, 0, 0)))
+    return shared_shapes_to_svg(image).encode('utf-8')
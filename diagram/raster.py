@@ -0,0 +1,428 @@
+import functools
+import hashlib
+import math
+import os
+import zlib
+
+import chess
+import chess.svg
+import reportlab
+from PIL import Image, ImageChops, ImageDraw, ImageFont
+from reportlab.graphics.shapes import (
+    Circle, Ellipse, Group, Line, Path, Polygon, PolyLine, Rect, String, Wedge, mmult,
+)
+from reportlab.lib import colors
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.pdfdoc import PDFArray, PDFImageXObject, PDFName, PDFStream
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import Flowable
+
+from .config import CHESS_BOARD_CONFIG, DRAFT_CONFIG
+from .utils import (
+    COORDINATE_GLYPHS,
+    COORDINATE_MARGIN,
+    COORDINATE_OFFSET,
+    COORDINATE_SCALE,
+    PIECE_GLYPHS,
+    SQUARE_SIZE,
+    DrawingCache,
+    _color_converter,
+)
+
+# Rasterizes boards with Pillow for the 'draft' output mode and the PNG previews. ReportLab's own bitmap
+# renderer needs an optional backend (rl_renderPM or rlPyCairo), so the shapes are filled here instead.
+
+# Line segments a Bezier curve is flattened into.
+_CURVE_SEGMENTS = 12
+
+# Pillow anchors of the String text anchors, on the baseline.
+_TEXT_ANCHORS = {'start': 'ls', 'middle': 'ms', 'end': 'rs', 'numeric': 'rs'}
+
+# The Bitstream Vera faces shipped with ReportLab, the last resort for the standard PDF fonts.
+_REPORTLAB_FONTS = os.path.join(os.path.dirname(reportlab.__file__), 'fonts')
+
+# TrueType faces standing in for the standard PDF fonts, tried in order. Bare file names are looked up
+# by Pillow in the system font directories; the Liberation faces have the metrics of the PDF fonts.
+_FONT_FILES = {
+    'Times-Roman': ('LiberationSerif-Regular.ttf', 'DejaVuSerif.ttf', 'Vera.ttf'),
+    'Times-Bold': ('LiberationSerif-Bold.ttf', 'DejaVuSerif-Bold.ttf', 'VeraBd.ttf'),
+    'Times-Italic': ('LiberationSerif-Italic.ttf', 'DejaVuSerif-Italic.ttf', 'VeraIt.ttf'),
+    'Times-BoldItalic': ('LiberationSerif-BoldItalic.ttf', 'DejaVuSerif-BoldItalic.ttf', 'VeraBI.ttf'),
+    'Helvetica': ('LiberationSans-Regular.ttf', 'DejaVuSans.ttf', 'Vera.ttf'),
+    'Helvetica-Bold': ('LiberationSans-Bold.ttf', 'DejaVuSans-Bold.ttf', 'VeraBd.ttf'),
+    'Helvetica-Oblique': ('LiberationSans-Italic.ttf', 'DejaVuSans-Oblique.ttf', 'VeraIt.ttf'),
+    'Helvetica-BoldOblique': ('LiberationSans-BoldItalic.ttf', 'DejaVuSans-BoldOblique.ttf', 'VeraBI.ttf'),
+    'Courier': ('LiberationMono-Regular.ttf', 'DejaVuSansMono.ttf', 'Vera.ttf'),
+    'Courier-Bold': ('LiberationMono-Bold.ttf', 'DejaVuSansMono-Bold.ttf', 'VeraBd.ttf'),
+}
+
+# Encoded board images (see encode_board_image), keyed by their image name (see board_image_name).
+board_image_cache = DrawingCache(DRAFT_CONFIG['cache_size'])
+
+
+def _rgb(color):
+    return tuple(round(channel * 255) for channel in (color.red, color.green, color.blue))
+
+
+def _scale_of(transform):
+    a, b, c, d, _e, _f = transform
+    return math.sqrt(abs(a * d - b * c))
+
+
+def _transform_point(transform, x, y):
+    a, b, c, d, e, f = transform
+    return a * x + c * y + e, b * x + d * y + f
+
+
+def _subpaths(path, transform):
+    """
+    Returns the subpaths of a Path as (points, closed) pairs in pixel coordinates, curves flattened.
+    """
+    subpaths = []
+    points = []
+    closed = False
+    coordinates = iter(path.points)
+    for operator in path.operators:
+        if operator == 0:  # moveTo
+            if len(points) > 1:
+                subpaths.append((points, closed))
+            points = [_transform_point(transform, next(coordinates), next(coordinates))]
+            closed = False
+        elif operator == 1:  # lineTo
+            points.append(_transform_point(transform, next(coordinates), next(coordinates)))
+        elif operator == 2:  # curveTo
+            controls = [_transform_point(transform, next(coordinates), next(coordinates)) for _ in range(3)]
+            (x0, y0), (x1, y1), (x2, y2), (x3, y3) = points[-1], *controls
+            for step in range(1, _CURVE_SEGMENTS + 1):
+                t = step / _CURVE_SEGMENTS
+                u = 1 - t
+                points.append((
+                    u ** 3 * x0 + 3 * u * u * t * x1 + 3 * u * t * t * x2 + t ** 3 * x3,
+                    u ** 3 * y0 + 3 * u * u * t * y1 + 3 * u * t * t * y2 + t ** 3 * y3,
+                ))
+        elif operator == 3:  # closePath
+            closed = True
+    if len(points) > 1:
+        subpaths.append((points, closed))
+    return subpaths
+
+
+def _ellipse_points(cx, cy, rx, ry, transform):
+    segments = 4 * _CURVE_SEGMENTS
+    return [
+        _transform_point(transform, cx + rx * math.cos(2 * math.pi * step / segments),
+                         cy + ry * math.sin(2 * math.pi * step / segments))
+        for step in range(segments)
+    ]
+
+
+@functools.lru_cache(maxsize=64)
+def _font(font_name, size):
+    """
+    Returns the Pillow font of a String: the file of a TrueType font registered with ReportLab, a face of
+    _FONT_FILES standing in for a standard PDF font, or Pillow's bundled face when none of them is found.
+    """
+    try:
+        font = pdfmetrics.getFont(font_name)
+    except KeyError:
+        font = None
+    if isinstance(font, TTFont):
+        candidates = (font.face.filename,)
+    else:
+        candidates = _FONT_FILES.get(font_name, _FONT_FILES['Helvetica'])
+    for candidate in candidates:
+        for path in (candidate, os.path.join(_REPORTLAB_FONTS, candidate)):
+            try:
+                return ImageFont.truetype(path, size)
+            except OSError:
+                continue
+    return ImageFont.load_default(size)
+
+
+def _string_font(node, scale):
+    """
+    Returns the font of a String at `scale`, resized so the text is as wide as ReportLab measures it
+    with the metrics of the PDF font: the lines of the preview break and align like those of the PDF.
+    """
+    size = max(1, round(node.fontSize * scale))
+    font = _font(node.fontName, size)
+    width = font.getlength(node.text)
+    if width > 0:
+        fitted = max(1, round(size * pdfmetrics.stringWidth(node.text, node.fontName, node.fontSize) * scale / width))
+        if fitted != size:
+            font = _font(node.fontName, fitted)
+    return font
+
+
+def _fill_polygons(image, polygons, color):
+    """
+    Fills polygons combined with the even-odd rule, through a mask only as large as their bounds.
+    """
+    polygons = [points for points in polygons if len(points) >= 3]
+    if not polygons:
+        return
+    left = max(0, math.floor(min(x for points in polygons for x, _y in points)))
+    top = max(0, math.floor(min(y for points in polygons for _x, y in points)))
+    right = min(image.width, math.ceil(max(x for points in polygons for x, _y in points)) + 1)
+    bottom = min(image.height, math.ceil(max(y for points in polygons for _x, y in points)) + 1)
+    if left >= right or top >= bottom:
+        return
+    mask = Image.new('1', (right - left, bottom - top))
+    for points in polygons:
+        subpath_mask = Image.new('1', mask.size)
+        ImageDraw.Draw(subpath_mask).polygon([(x - left, y - top) for x, y in points], fill=1)
+        mask = ImageChops.logical_xor(mask, subpath_mask)
+    image.paste(_rgb(color) + (255,), (left, top, right, bottom), mask)
+
+
+def _draw_node(image, node, transform):
+    """
+    Draws a Group of shapes (Paths, Rects, Circles, Ellipses, Wedges, Polygons, PolyLines, Lines and Strings)
+    onto an RGBA image. Subpaths are combined with the even-odd rule and strokes are drawn with round joins.
+    Raises TypeError on any other node, rather than leaving it out of the image.
+    """
+    if isinstance(node, Group):
+        transform = mmult(transform, node.transform)
+        for child in node.contents:
+            _draw_node(image, child, transform)
+        return
+    if isinstance(node, Wedge):
+        node = node.asPolygon()
+
+    properties = node.getProperties()
+    fill_color = properties.get('fillColor')
+    stroke_color = properties.get('strokeColor')
+    stroke_width = (properties.get('strokeWidth') or 0) * _scale_of(transform)
+    draw = ImageDraw.Draw(image)
+
+    if isinstance(node, String):
+        if fill_color is not None:
+            x, y = _transform_point(transform, node.x, node.y)
+            draw.text((x, y), node.text, fill=_rgb(fill_color) + (255,),
+                      font=_string_font(node, _scale_of(transform)),
+                      anchor=_TEXT_ANCHORS.get(node.textAnchor, 'ls'))
+        return
+    if isinstance(node, Circle):
+        cx, cy = _transform_point(transform, node.cx, node.cy)
+        radius = node.r * _scale_of(transform)
+        draw.ellipse(
+            [cx - radius, cy - radius, cx + radius, cy + radius],
+            fill=_rgb(fill_color) if fill_color is not None else None,
+            outline=_rgb(stroke_color) if stroke_color is not None and stroke_width else None,
+            width=max(1, round(stroke_width)),
+        )
+        return
+    if isinstance(node, Rect):
+        corners = [(node.x, node.y), (node.x + node.width, node.y),
+                   (node.x + node.width, node.y + node.height), (node.x, node.y + node.height)]
+        subpaths = [([_transform_point(transform, x, y) for x, y in corners], True)]
+    elif isinstance(node, Ellipse):
+        subpaths = [(_ellipse_points(node.cx, node.cy, node.rx, node.ry, transform), True)]
+    elif isinstance(node, (Polygon, PolyLine)):
+        points = [_transform_point(transform, x, y) for x, y in zip(node.points[::2], node.points[1::2])]
+        subpaths = [(points, isinstance(node, Polygon))]
+    elif isinstance(node, Line):
+        subpaths = [([_transform_point(transform, node.x1, node.y1),
+                      _transform_point(transform, node.x2, node.y2)], False)]
+    elif isinstance(node, Path):
+        subpaths = _subpaths(node, transform)
+    else:
+        raise TypeError(f"Cannot rasterize {type(node).__name__} nodes.")
+
+    if fill_color is not None:
+        _fill_polygons(image, [points for points, _closed in subpaths], fill_color)
+    if stroke_color is not None and stroke_width:
+        for points, closed in subpaths:
+            draw.line(points + points[:1] if closed else points, fill=_rgb(stroke_color) + (255,),
+                      width=max(1, round(stroke_width)), joint='curve')
+
+
+@functools.lru_cache(maxsize=256)
+def glyph_sprite(kind, name, pixels):
+    """
+    Returns a piece ('piece', symbol) or coordinate ('coordinate', label) glyph as a `pixels` wide
+    RGBA image, drawn DRAFT_CONFIG['supersample'] times larger and scaled down for antialiasing.
+    """
+    glyph = (PIECE_GLYPHS if kind == 'piece' else COORDINATE_GLYPHS)[name]
+    supersample = DRAFT_CONFIG['supersample']
+    scale = pixels * supersample / SQUARE_SIZE
+    image = Image.new('RGBA', (pixels * supersample, pixels * supersample), (0, 0, 0, 0))
+    # Glyphs are stored in SVG coordinates, whose y axis points down like the image rows.
+    _draw_node(image, glyph, (scale, 0, 0, scale, 0, 0))
+    return image.resize((pixels, pixels), Image.LANCZOS)
+
+
+def rasterize_board(board, colors_config, show_coordinates, pixels):
+    """
+    Returns an RGB image, `pixels` wide, of the board the native renderer draws (without the
+    turn indicator, which lies outside the board).
+    """
+    margin = COORDINATE_MARGIN if show_coordinates else 0
+    unit = pixels / (8 * SQUARE_SIZE + 2 * margin)
+
+    def pixel(value):
+        return round(value * unit)
+
+    light_color = _rgb(_color_converter.convertColor(colors_config.get('light_squares')))
+    dark_color = _rgb(_color_converter.convertColor(colors_config.get('dark_squares')))
+    image = Image.new('RGB', (pixels, pixels), light_color)
+    draw = ImageDraw.Draw(image)
+
+    if show_coordinates:
+        border_color = colors_config.get('border_color') or chess.svg.DEFAULT_COLORS['margin']
+        draw.rectangle([0, 0, pixels - 1, pixels - 1], fill=_rgb(_color_converter.convertColor(border_color)))
+        glyph_pixels = max(1, pixel(SQUARE_SIZE * COORDINATE_SCALE))
+        edge = 8 * SQUARE_SIZE + margin
+        for file_index, file_name in enumerate(chess.FILE_NAMES):
+            sprite = glyph_sprite('coordinate', file_name, glyph_pixels)
+            x = pixel(file_index * SQUARE_SIZE + margin + COORDINATE_OFFSET)
+            image.paste(sprite, (x, pixel(1)), sprite)
+            image.paste(sprite, (x, pixel(edge)), sprite)
+        for rank_index, rank_name in enumerate(chess.RANK_NAMES):
+            sprite = glyph_sprite('coordinate', rank_name, glyph_pixels)
+            y = pixel((7 - rank_index) * SQUARE_SIZE + margin + COORDINATE_OFFSET)
+            image.paste(sprite, (0, y), sprite)
+            image.paste(sprite, (pixel(edge), y), sprite)
+
+    pieces = board.piece_map()
+    for square in chess.SQUARES:
+        x0 = pixel(chess.square_file(square) * SQUARE_SIZE + margin)
+        y0 = pixel((7 - chess.square_rank(square)) * SQUARE_SIZE + margin)
+        x1 = pixel((chess.square_file(square) + 1) * SQUARE_SIZE + margin)
+        y1 = pixel((8 - chess.square_rank(square)) * SQUARE_SIZE + margin)
+        is_light = bool(chess.BB_LIGHT_SQUARES & chess.BB_SQUARES[square])
+        draw.rectangle([x0, y0, x1 - 1, y1 - 1], fill=light_color if is_light else dark_color)
+        piece = pieces.get(square)
+        if piece is not None:
+            sprite = glyph_sprite('piece', piece.symbol(), x1 - x0)
+            image.paste(sprite, (x0, y0), sprite)
+
+    if not show_coordinates:
+        # The 1 point outline of the vector boards.
+        draw.rectangle([0, 0, pixels - 1, pixels - 1], outline=dark_color,
+                       width=max(1, round(pixels / CHESS_BOARD_CONFIG['size'])))
+    return image
+
+
+def rasterize_drawing(drawing, pixels, supersample=1):
+    """
+    Returns an RGB image, `pixels` wide on a white background, of a Drawing; drawn `supersample` times
+    larger and scaled down for antialiasing.
+    """
+    scale = pixels * supersample / drawing.width
+    size = (pixels * supersample, max(1, round(drawing.height * scale)))
+    image = Image.new('RGBA', size, (255, 255, 255, 255))
+    # Drawings have their y axis pointing up, unlike the image rows.
+    for node in drawing.contents:
+        _draw_node(image, node, (scale, 0, 0, -scale, 0, size[1]))
+    image = image.convert('RGB')
+    if supersample > 1:
+        image = image.resize((pixels, max(1, round(size[1] / supersample))), Image.LANCZOS)
+    return image
+
+
+def board_image_name(board, colors_config, show_coordinates, pixels):
+    """
+    Returns the image XObject name of a board bitmap; identical boards share the name, and so the image.
+    """
+    key = repr((board.board_fen(), bool(show_coordinates), tuple(sorted(colors_config.items())), pixels))
+    return 'DiagramDraft' + hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+def encode_board_image(image):
+    """
+    Reduces an RGB image to DRAFT_CONFIG['palette_colors'] colors and returns its (size, palette, data):
+    one byte per pixel, compressed with zlib. Boards are flat squares and a few glyph colors, so the palette
+    loses little and the data compresses several times better than the RGB data of canvas.drawImage.
+    """
+    paletted = image.quantize(
+        DRAFT_CONFIG['palette_colors'], method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE
+    )
+    color_count = max(index for _count, index in paletted.getcolors(256)) + 1
+    return image.size, bytes(paletted.getpalette()[:3 * color_count]), zlib.compress(paletted.tobytes())
+
+
+class PaletteImageXObject(PDFImageXObject):
+    """
+    An image XObject of an image encoded by encode_board_image, in an Indexed color space.
+    """
+    def __init__(self, name, size, palette, data):
+        super().__init__(name)
+        self.width, self.height = size
+        self.bitsPerComponent = 8
+        self.palette = palette
+        self.streamContent = data
+        self._filters = ('FlateDecode',)
+
+    def format(self, document):
+        stream = PDFStream(content=self.streamContent)
+        dictionary = stream.dictionary
+        dictionary['Type'] = PDFName('XObject')
+        dictionary['Subtype'] = PDFName('Image')
+        dictionary['Width'] = self.width
+        dictionary['Height'] = self.height
+        dictionary['BitsPerComponent'] = self.bitsPerComponent
+        dictionary['ColorSpace'] = PDFArray([
+            PDFName('Indexed'), PDFName('DeviceRGB'), len(self.palette) // 3 - 1,
+            b'<%s>' % self.palette.hex().encode('ascii'),
+        ])
+        dictionary['Filter'] = PDFArray([PDFName(name) for name in self._filters])
+        return stream.format(document)
+
+
+def _define_board_image(canv, name, board, colors_config, show_coordinates, pixels):
+    encoded = board_image_cache.get(name)
+    if encoded is None:
+        encoded = encode_board_image(rasterize_board(board, colors_config, show_coordinates, pixels))
+        board_image_cache.put(name, encoded)
+    # Registered like canvas.drawImage does, under a name known before the image is rasterized. The object
+    # is new in every document, since registering it marks it with its name there.
+    image_object = PaletteImageXObject(name, *encoded)
+    canv._setXObjects(image_object)
+    canv._doc.Reference(image_object, canv._doc.getXObjectName(name))
+    canv._doc.addForm(name, image_object)
+
+
+class DraftBoardFlowable(Flowable):
+    """
+    A chess diagram placed as a `pixels` wide bitmap, for fast and small proofs.
+    Each distinct board is rasterized once per document and every diagram showing it places the same
+    image XObject. The geometry is the one of the native renderer, the turn indicator stays vector.
+    """
+    def __init__(self, fen_string, size, pixels, board_colors=None, show_turn_indicator=False,
+                 show_coordinates=CHESS_BOARD_CONFIG['coordinates']):
+        super().__init__()
+        self.board = chess.Board(fen_string)
+        self.size = size
+        self.pixels = pixels
+        self.colors_config = {**CHESS_BOARD_CONFIG['colors'], **(board_colors or {})}
+        self.show_turn_indicator = show_turn_indicator
+        self.show_coordinates = show_coordinates
+        self.width = self.height = size
+
+    def wrap(self, availWidth, availHeight):
+        return self.size, self.size
+
+    def draw(self):
+        canv = self.canv
+        name = board_image_name(self.board, self.colors_config, self.show_coordinates, self.pixels)
+        if not canv.hasForm(name):
+            _define_board_image(canv, name, self.board, self.colors_config, self.show_coordinates, self.pixels)
+
+        canv.saveState()
+        # Images are drawn in the unit square.
+        canv.scale(self.size, self.size)
+        canv.doForm(name)
+        canv.restoreState()
+        canv._currentPageHasImages = 1
+
+        if self.show_turn_indicator and self.board.turn == chess.BLACK:
+            # Same black circle as the one added to vector drawings, at the scale of the diagram
+            board_size = CHESS_BOARD_CONFIG['size']
+            canv.saveState()
+            canv.scale(self.size / board_size, self.size / board_size)
+            canv.setFillColor(colors.black)
+            canv.setStrokeColor(colors.white)
+            canv.setLineWidth(1)
+            canv.circle(board_size + 15, board_size - 10, 10, stroke=1, fill=1)
+            canv.restoreState()
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+from .config import RESULT_CACHE_CONFIG
+from .storage import default_directory, private_directory
+
+logger = logging.getLogger(__name__)
+
+
+def request_key(fens, render_options):
+    """
+    Hashes a canonicalized render request. Rendering is deterministic (see PDF_CONFIG['invariant']),
+    so the key identifies the PDF bytes and doubles as its ETag.
+    """
+    canonical = json.dumps(
+        {'version': RESULT_CACHE_CONFIG['version'], 'fens': list(fens), 'options': render_options},
+        sort_keys=True,
+        separators=(',', ':'),
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class DjangoResultCache:
+    """
+    Stores PDFs in a cache of the Django cache framework. The cache must bound its own size, so the
+    per-process LocMemCache, which only counts entries, is refused.
+    """
+    def __init__(self, alias, timeout, max_entry_bytes):
+        from django.core.cache import caches
+        from django.core.cache.backends.locmem import LocMemCache
+        self.cache = caches[alias]
+        if isinstance(self.cache, LocMemCache):
+            raise ValueError(
+                f"The Django cache '{alias}' is a LocMemCache, which does not bound the size of the PDFs it keeps; "
+                "use the 'disk' result cache backend or a shared cache backend."
+            )
+        self.timeout = timeout
+        self.max_entry_bytes = max_entry_bytes
+
+    def get(self, key):
+        return self.cache.get(f'diagram-pdf:{key}')
+
+    def set(self, key, pdf_data):
+        if len(pdf_data) <= self.max_entry_bytes:
+            self.cache.set(f'diagram-pdf:{key}', pdf_data, self.timeout)
+
+    def set_file(self, key, pdf_file, size):
+        if size <= self.max_entry_bytes:
+            self.set(key, pdf_file.read())
+
+
+class DiskResultCache:
+    """
+    Stores PDFs as files in a local directory, evicting the least recently used ones
+    once their total size exceeds `max_bytes`. The directory must be private to this user
+    (see storage.private_directory), as its files are served under their request hash.
+    """
+    def __init__(self, directory, max_bytes, max_entry_bytes):
+        self.directory = private_directory(directory or default_directory('pdf_cache'))
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.pdf')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                pdf_data = f.read()
+            # The modification time records the last use, for LRU eviction.
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return pdf_data
+
+    def set(self, key, pdf_data):
+        if len(pdf_data) > self.max_entry_bytes:
+            return
+        self._store(key, lambda f: f.write(pdf_data))
+
+    def set_file(self, key, pdf_file, size):
+        if size > self.max_entry_bytes:
+            return
+        self._store(key, lambda f: shutil.copyfileobj(pdf_file, f))
+
+    def _store(self, key, write):
+        # Write to a temporary file first so readers never see a partial PDF.
+        fd, partial_path = tempfile.mkstemp(dir=self.directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(partial_path, self._path(key))
+        except BaseException:
+            os.remove(partial_path)
+            raise
+        self._evict()
+
+    def clear(self):
+        with self._lock:
+            for name in os.listdir(self.directory):
+                if name.endswith('.pdf'):
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except FileNotFoundError:
+                        pass
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.directory):
+                if not name.endswith('.pdf'):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _mtime, size, _path in entries)
+            for _mtime, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """
+    Returns the configured PDF result cache, or None when RESULT_CACHE_CONFIG['backend'] is None.
+    """
+    global _result_cache
+    backend = RESULT_CACHE_CONFIG['backend']
+    if backend is None:
+        return None
+    with _result_cache_lock:
+        if _result_cache is None:
+            if backend == 'django':
+                _result_cache = DjangoResultCache(
+                    RESULT_CACHE_CONFIG['cache_alias'],
+                    RESULT_CACHE_CONFIG['timeout'],
+                    RESULT_CACHE_CONFIG['max_entry_bytes'],
+                )
+            elif backend == 'disk':
+                _result_cache = DiskResultCache(
+                    RESULT_CACHE_CONFIG['directory'],
+                    RESULT_CACHE_CONFIG['max_bytes'],
+                    RESULT_CACHE_CONFIG['max_entry_bytes'],
+                )
+            else:
+                raise ValueError(f"Unknown result cache backend '{backend}', expected 'django', 'disk' or None.")
+        return _result_cache
@@ -0,0 +1,85 @@
+import logging
+import os
+import sys
+import time
+from io import BytesIO
+
+from .config import CHESS_BOARD_CONFIG, PDF_CONFIG, STARTUP_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Starting position, kept here so deciding whether to warm up does not import python-chess.
+_WARM_UP_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+
+def _program_name(argv):
+    """
+    Returns the name of the program of `argv`, also for packages run with `python -m` (their __main__.py).
+    """
+    path = argv[0] if argv else ''
+    name = os.path.basename(path)
+    if name == '__main__.py':
+        name = os.path.basename(os.path.dirname(path))
+    return os.path.splitext(name)[0]
+
+
+def should_warm_up(argv=None, environ=None):
+    """
+    Returns whether this process should warm up the render stack, following STARTUP_CONFIG['warm_up']:
+    True always, False never, 'auto' only in processes serving requests. With 'auto', those are the
+    servers of STARTUP_CONFIG['servers'] and runserver, but not the autoreloader parent of runserver
+    (only its child, started with RUN_MAIN=true, serves requests). Management commands, shells, Celery
+    workers and any other program importing the project are skipped.
+    """
+    setting = STARTUP_CONFIG['warm_up']
+    if setting != 'auto':
+        return bool(setting)
+    argv = sys.argv if argv is None else argv
+    environ = os.environ if environ is None else environ
+    if _program_name(argv) in STARTUP_CONFIG['servers']:
+        return True
+    if len(argv) < 2 or argv[1] != 'runserver':
+        return False
+    return '--noreload' in argv or environ.get('RUN_MAIN') == 'true'
+
+
+def warm_up():
+    """
+    Imports the render stack (reportlab, svglib, python-chess and the modules using them) and draws a
+    throwaway page with a title, a board and a description, so the first request does not pay for the
+    imports, the font loading and the first-use initialization of the libraries.
+    The page is drawn straight onto a canvas rather than through create_pdf_from_fens, so the metrics
+    registry only counts real requests. The rendered board stays in the drawing cache.
+    Returns the time taken in seconds.
+    """
+    start = time.perf_counter()
+
+    from reportlab.pdfgen.canvas import Canvas
+
+    from . import pgn, preview  # noqa: F401 (loaded so the first PGN or preview request does not import them)
+    from .validation import validate_fens
+    from .pdf_service import FRAME_PADDING, PageGrid
+    from .utils import fen_to_drawing
+
+    validate_fens([_WARM_UP_FEN])
+    grid = PageGrid(1, title="Warm-up")
+    paragraph = grid.description_paragraph("1. e4")
+    diagram_size, row_height = grid.cell_sizes(paragraph.height, True)
+    (board_x, board_y), (description_x, description_y) = grid.cell_positions(
+        0, grid.content_top(True), diagram_size, row_height, paragraph.height
+    )
+    drawing = fen_to_drawing(_WARM_UP_FEN, renderer=CHESS_BOARD_CONFIG['renderer'])
+    scale = diagram_size / drawing.width
+    drawing.scale(scale, scale)
+    drawing.width = drawing.height = diagram_size
+
+    canv = Canvas(BytesIO(), pagesize=PDF_CONFIG['page_size'], invariant=PDF_CONFIG['invariant'])
+    grid.title_paragraph.drawOn(canv, grid.left_margin + FRAME_PADDING, grid.frame_top - grid.title_height)
+    drawing.drawOn(canv, board_x, board_y)
+    paragraph.drawOn(canv, description_x, description_y)
+    canv.showPage()
+    canv.save()
+
+    elapsed = time.perf_counter() - start
+    logger.info("Render stack warmed up in %.0f ms", elapsed * 1000)
+    return elapsed
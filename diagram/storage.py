@@ -0,0 +1,26 @@
+import os
+
+from django.conf import settings
+
+
+def default_directory(name):
+    """
+    Returns the directory `name` under var/ in BASE_DIR, where local files are kept by default.
+    """
+    return os.path.join(settings.BASE_DIR, 'var', name)
+
+
+def private_directory(path):
+    """
+    Creates the directory `path` with mode 0700 when it does not exist, and returns it.
+    Raises PermissionError when it belongs to another user or other users can write to it, as the
+    files read back from it are served as if this process had written them.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if hasattr(os, 'getuid'):
+        stat = os.stat(path)
+        if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+            raise PermissionError(
+                f"{path} must be owned by the user running the server and not writable by other users."
+            )
+    return path
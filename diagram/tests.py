@@ -1,3 +1,1333 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import hashlib
+import io
+import json
+import math
+import os
+import pickle
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import CommandError, call_command
+from django.test import Client, SimpleTestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+from reportlab.graphics.shapes import Drawing, Ellipse, Group, Line, PolyLine, Polygon, mmult
+from reportlab.graphics.shapes import Image as ImageShape
+from reportlab.lib import colors
+from reportlab.platypus import Flowable, Paragraph
+
+from .admission import AdmissionController, AdmissionRejected, estimate_cost, get_admission_controller
+from .batch import BatchZipStream
+from .coalescing import RenderCoalescer, get_render_coalescer
+from .config import PREVIEW_CONFIG
+from .drawing_store import DrawingStore, store_key
+from .executor import get_render_executor, render_pdf, shutdown_render_executor
+from .jobs import CANCELLED, FINISHED, JobManager
+from .metrics import collect, registry
+from .parallel import get_process_pool, prepare_drawings, process_pool_size, shutdown_process_pool
+from .pdf_merge import PdfFile, merge_pdfs
+from .pdf_service import PageCache, RenderTimeout, _create_sharded_pdf, create_pdf_from_fens, page_cache
+from .pgn import iter_pgn_diagrams
+from .preview import PREVIEW_FORMATS, diagram_preview_drawing, page_preview_drawing, render_preview
+from .raster import rasterize_drawing
+from .result_cache import DiskResultCache, DjangoResultCache, get_result_cache
+from .startup import should_warm_up, warm_up
+from .utils import COORDINATE_MARGIN, SQUARE_SIZE, drawing_cache, fen_to_drawing
+from .xobjects import FormBoardFlowable
+from .validation import FenValidationError, validate_fens
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+BLACK_TO_MOVE_FEN = "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1"
+
+
+_result_cache_directory = tempfile.TemporaryDirectory()
+_result_cache_config = mock.patch.dict(
+    'diagram.result_cache.RESULT_CACHE_CONFIG', {'backend': 'disk', 'directory': _result_cache_directory.name}
+)
+
+
+def setUpModule():
+    # Finished PDFs are cached in a temporary directory instead of var/pdf_cache.
+    _result_cache_config.start()
+    mock.patch('diagram.result_cache._result_cache', None).start()
+
+
+def tearDownModule():
+    mock.patch.stopall()
+    _result_cache_directory.cleanup()
+
+
+def flatten_shapes(node, transform=(1, 0, 0, 1, 0, 0)):
+    """Lists the leaf shapes of a drawing with their bounds in drawing coordinates and their colors."""
+    if getattr(node, 'transform', None) is not None:
+        transform = mmult(transform, node.transform)
+    if isinstance(node, Group):
+        return [shape for child in node.contents for shape in flatten_shapes(child, transform)]
+    x1, y1, x2, y2 = node.getBounds()
+    corners = [
+        (transform[0] * x + transform[2] * y + transform[4], transform[1] * x + transform[3] * y + transform[5])
+        for x, y in ((x1, y1), (x2, y2))
+    ]
+    return [(type(node).__name__, tuple(round(v, 2) for corner in corners for v in corner),
+             str(node.fillColor), str(node.strokeColor), node.strokeWidth)]
+
+
+class DrawingCacheTests(SimpleTestCase):
+    def setUp(self):
+        drawing_cache.clear()
+
+    def test_identical_boards_hit_the_cache(self):
+        fen_to_drawing(START_FEN)
+        # Move counters and castling rights do not change the drawing.
+        fen_to_drawing("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w - - 5 40")
+        self.assertEqual(drawing_cache.info()['misses'], 1)
+        self.assertEqual(drawing_cache.info()['hits'], 1)
+
+    def test_style_and_turn_indicator_are_part_of_the_key(self):
+        fen_to_drawing(BLACK_TO_MOVE_FEN)
+        fen_to_drawing(BLACK_TO_MOVE_FEN, show_turn_indicator=True)
+        fen_to_drawing(BLACK_TO_MOVE_FEN, board_colors={'light_squares': '#ffffff'})
+        fen_to_drawing(BLACK_TO_MOVE_FEN, show_coordinates=True)
+        self.assertEqual(drawing_cache.info()['misses'], 4)
+
+    def test_returned_drawings_are_independent(self):
+        first = fen_to_drawing(START_FEN)
+        first.scale(0.5, 0.5)
+        first.width = first.height = 10
+        second = fen_to_drawing(START_FEN)
+        self.assertEqual(second.transform, (1, 0, 0, 1, 0, 0))
+        self.assertNotEqual(second.width, 10)
+
+    def test_cache_is_bounded(self):
+        maxsize = drawing_cache.maxsize
+        self.addCleanup(drawing_cache.resize, maxsize)
+        drawing_cache.resize(1)
+        fen_to_drawing(START_FEN)
+        fen_to_drawing(BLACK_TO_MOVE_FEN)
+        fen_to_drawing(START_FEN)
+        self.assertEqual(drawing_cache.info()['size'], 1)
+        self.assertEqual(drawing_cache.info()['misses'], 3)
+
+
+class NativeRendererTests(SimpleTestCase):
+    def test_native_renderer_matches_svg_renderer(self):
+        options = [
+            {},
+            {'show_coordinates': True},
+            {'show_turn_indicator': True, 'board_colors': {'light_squares': 'red', 'border_color': '#00ff00'}},
+            {'show_turn_indicator': True, 'show_coordinates': True, 'board_colors': {'border_color': '#00ff00'}},
+        ]
+        for fen in (START_FEN, BLACK_TO_MOVE_FEN):
+            for kwargs in options:
+                with self.subTest(fen=fen, **kwargs):
+                    svg_drawing = fen_to_drawing(fen, renderer='svg', **kwargs)
+                    native_drawing = fen_to_drawing(fen, renderer='native', **kwargs)
+                    self.assertEqual((native_drawing.width, native_drawing.height),
+                                     (svg_drawing.width, svg_drawing.height))
+                    self.assertEqual(sorted(flatten_shapes(native_drawing)), sorted(flatten_shapes(svg_drawing)))
+
+    def test_unknown_renderer_is_rejected(self):
+        with self.assertRaises(ValueError):
+            fen_to_drawing(START_FEN, renderer='bitmap')
+
+
+def record_placements(**kwargs):
+    """Renders a PDF and lists where each board and description lands, in page coordinates."""
+    placements = []
+    draw_on = Flowable.drawOn
+
+    def recording_draw_on(flowable, canvas, x, y, _sW=0):
+        if isinstance(flowable, (Drawing, FormBoardFlowable, Paragraph)):
+            a, b, c, d, e, f = canvas._currentMatrix
+            text = flowable.getPlainText() if isinstance(flowable, Paragraph) else None
+            placements.append((canvas.getPageNumber(), type(flowable).__name__, text,
+                               round(a * x + c * y + e, 2), round(b * x + d * y + f, 2),
+                               round(flowable.width, 2), round(flowable.height, 2)))
+        return draw_on(flowable, canvas, x, y, _sW)
+
+    with mock.patch.object(Flowable, 'drawOn', recording_draw_on):
+        pdf_data = create_pdf_from_fens(**kwargs)
+    return pdf_data, placements
+
+
+class LayoutEngineTests(SimpleTestCase):
+    def setUp(self):
+        page_cache.clear()
+
+    fens = [
+        {'fen': START_FEN, 'description': 'Start'},
+        BLACK_TO_MOVE_FEN,
+        {'fen': BLACK_TO_MOVE_FEN, 'description': 'A description long enough to wrap over several lines '
+                                                  'in the narrow columns of a three column layout.'},
+    ] * 5
+
+    def assert_same_layout(self, **kwargs):
+        canvas_pdf, canvas_placements = record_placements(fens=self.fens, layout_engine='canvas', **kwargs)
+        platypus_pdf, platypus_placements = record_placements(fens=self.fens, layout_engine='platypus', **kwargs)
+        self.assertTrue(canvas_pdf.startswith(b'%PDF'))
+        # Every board, the ten descriptions and the title.
+        self.assertEqual(len(canvas_placements), len(self.fens) + 10 + bool(kwargs.get('title')))
+        self.assertEqual(canvas_placements, platypus_placements)
+        self.assertEqual(canvas_pdf.count(b'/Type /Page\n'), platypus_pdf.count(b'/Type /Page\n'))
+
+    def test_grid_layouts_match_platypus(self):
+        for diagrams_per_page in (1, 4, 9):
+            with self.subTest(diagrams_per_page=diagrams_per_page):
+                self.assert_same_layout(diagrams_per_page=diagrams_per_page)
+
+    def test_title_padding_and_xobjects_match_platypus(self):
+        self.assert_same_layout(
+            diagrams_per_page=6, title='Exercises', show_page_numbers=True,
+            padding={'left': 4, 'right': 8, 'top': 10, 'bottom': 2}
+        )
+        self.assert_same_layout(diagrams_per_page=4, output_mode='xobject', show_coordinates=True)
+
+    def test_progress_is_reported_per_page(self):
+        pages = []
+        create_pdf_from_fens(self.fens, diagrams_per_page=6, layout_engine='canvas',
+                             progress_callback=lambda done, total: pages.append((done, total)))
+        self.assertEqual(pages, [(1, 3), (2, 3), (3, 3)])
+
+    def test_unknown_layout_engine_is_rejected(self):
+        with self.assertRaises(ValueError):
+            create_pdf_from_fens([START_FEN], layout_engine='html')
+
+
+class PageCacheTests(SimpleTestCase):
+    fens = [{'fen': START_FEN, 'description': f'Diagram {i}'} for i in range(6)]
+
+    def setUp(self):
+        page_cache.clear()
+
+    def render(self, fens, layout_engine='canvas', **kwargs):
+        with collect() as metrics:
+            pdf_data = create_pdf_from_fens(fens, diagrams_per_page=2, title='Cached pages',
+                                            show_page_numbers=True, layout_engine=layout_engine, **kwargs)
+        return pdf_data, metrics.counters.get('page_cache_hits', 0)
+
+    def test_only_changed_pages_are_rendered(self):
+        first, hits = self.render(self.fens)
+        self.assertEqual(hits, 0)
+        again, hits = self.render(self.fens)
+        self.assertEqual((again, hits), (first, 3))
+
+        edited = list(self.fens)
+        edited[3] = {'fen': BLACK_TO_MOVE_FEN, 'description': 'Edited'}
+        with mock.patch('diagram.pdf_service.prepare_drawings', wraps=prepare_drawings) as prepare:
+            incremental, hits = self.render(edited)
+        self.assertEqual(hits, 2)
+        self.assertEqual(len(prepare.call_args.args[0]), 2)
+        page_cache.clear()
+        self.assertEqual(incremental, self.render(edited)[0])
+
+    def test_pages_are_evicted_by_size(self):
+        cache = PageCache(100)
+        cache.put('first', ('x' * 40, {}, (1, 3), None))
+        cache.put('second', ('x' * 40, {'F1': 'Helvetica'}, (1, 3), None))
+        self.assertEqual(cache.info()['bytes'], 91)
+        cache.put('third', ('x' * 40, {}, (1, 3), None))
+        self.assertIsNone(cache.get('first'))
+        self.assertEqual(cache.info()['size'], 2)
+        # A page larger than the whole cache is not kept.
+        cache.put('large', ('x' * 101, {}, (1, 3), None))
+        self.assertIsNone(cache.get('large'))
+        self.assertEqual(cache.info()['bytes'], 91)
+
+        self.render(self.fens)
+        sizes = [PageCache.entry_size(content) for content in page_cache._entries.values()]
+        self.assertEqual(page_cache.info()['bytes'], sum(sizes))
+        self.addCleanup(page_cache.resize, page_cache.maxsize)
+        page_cache.resize(sum(sizes) - 1)
+        self.assertEqual(page_cache.info()['size'], len(sizes) - 1)
+        self.assertLessEqual(page_cache.info()['bytes'], page_cache.maxsize)
+
+    def test_cached_pages_give_the_same_bytes(self):
+        # Without a title or page numbers, only the boards raise the PDF version (for their fill opacity).
+        fens = [START_FEN, BLACK_TO_MOVE_FEN] * 2
+        for layout_engine in ('canvas', 'platypus'):
+            with self.subTest(layout_engine=layout_engine):
+                cold = create_pdf_from_fens(fens, diagrams_per_page=2, layout_engine=layout_engine)
+                with collect() as metrics:
+                    warm = create_pdf_from_fens(fens, diagrams_per_page=2, layout_engine=layout_engine)
+                self.assertEqual(metrics.counters['page_cache_hits'], 2)
+                self.assertEqual(warm, cold)
+                with mock.patch.object(page_cache, 'maxsize', 0):
+                    self.assertEqual(create_pdf_from_fens(fens, diagrams_per_page=2, layout_engine=layout_engine),
+                                     cold)
+
+    def test_platypus_pages_are_cached(self):
+        first, _hits = self.render(self.fens, layout_engine='platypus')
+        edited = list(self.fens)
+        edited[3] = {'fen': BLACK_TO_MOVE_FEN, 'description': 'Edited'}
+        with mock.patch('diagram.pdf_service.prepare_drawings', wraps=prepare_drawings) as prepare:
+            incremental, hits = self.render(edited, layout_engine='platypus')
+        self.assertEqual(hits, 2)
+        self.assertEqual(len(prepare.call_args.args[0]), 2)
+        page_cache.clear()
+        self.assertEqual(incremental, self.render(edited, layout_engine='platypus')[0])
+        self.assertEqual(self.render(self.fens, layout_engine='platypus')[0], first)
+
+    def test_title_page_is_cached_separately(self):
+        self.render(self.fens)
+        # The first page moves to the second position: without the title offset it is a different page.
+        _pdf_data, hits = self.render(self.fens[2:] + self.fens[:2])
+        self.assertEqual(hits, 1)
+
+
+class XObjectOutputTests(SimpleTestCase):
+    def test_boards_and_pieces_are_defined_once(self):
+        pdf_data = create_pdf_from_fens([START_FEN] * 8 + [BLACK_TO_MOVE_FEN] * 4, diagrams_per_page=4,
+                                        output_mode='xobject')
+        self.assertTrue(pdf_data.startswith(b'%PDF'))
+        # One empty board and the twelve piece glyphs, however many diagrams use them.
+        self.assertEqual(pdf_data.count(b'/Subtype /Form'), 13)
+
+    def test_unknown_output_mode_is_rejected(self):
+        with self.assertRaises(ValueError):
+            create_pdf_from_fens([START_FEN], output_mode='bitmap')
+
+
+class ParallelPreparationTests(SimpleTestCase):
+    def setUp(self):
+        drawing_cache.clear()
+
+    def test_pool_keeps_input_order_and_renders_each_board_once(self):
+        self.addCleanup(shutdown_process_pool)
+        empty_fen = "8/8/8/8/8/8/8/K6k w - - 0 1"
+        fens = [empty_fen, START_FEN, empty_fen, BLACK_TO_MOVE_FEN]
+        parallel = prepare_drawings(fens, parallel=True, pool_size=2, min_batch_size=1)
+        self.assertEqual(drawing_cache.info()['size'], 3)
+        drawing_cache.clear()
+        serial = prepare_drawings(fens, parallel=False)
+        self.assertEqual([flatten_shapes(d) for d in parallel], [flatten_shapes(d) for d in serial])
+        self.assertIsNot(parallel[0], parallel[2])
+
+    def test_pool_is_sized_once_from_its_first_caller(self):
+        self.addCleanup(shutdown_process_pool)
+        with mock.patch.dict('diagram.parallel.PARALLEL_CONFIG', {'pool_size': None}):
+            self.assertEqual(process_pool_size(), os.cpu_count())
+            self.assertEqual(process_pool_size(3), 3)
+            get_process_pool(2)
+            self.assertEqual(process_pool_size(3), 2)
+
+
+class GeneratePdfApiTests(SimpleTestCase):
+    def setUp(self):
+        get_result_cache().clear()
+
+    def test_stream_option_returns_a_spooled_file_response(self):
+        response = self.client.post(
+            reverse('generate-pdf'),
+            {'fens': [START_FEN, BLACK_TO_MOVE_FEN], 'diagrams_per_page': 2, 'stream': True},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="chess_diagrams.pdf"')
+        content = b''.join(response.streaming_content)
+        self.assertTrue(content.startswith(b'%PDF'))
+        self.assertEqual(int(response['Content-Length']), len(content))
+
+    def test_board_colors_must_be_strings(self):
+        for board_colors in (['#ffffff'], {'light_squares': ['#ffffff']}, {'dark_squares': {'r': 1}}):
+            with self.subTest(board_colors=board_colors):
+                response = self.client.post(
+                    reverse('generate-pdf'),
+                    {'fens': [START_FEN], 'board_colors': board_colors},
+                    content_type='application/json'
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('board_colors', response.json()['error'])
+
+
+class RenderJobApiTests(SimpleTestCase):
+    def setUp(self):
+        storage = tempfile.TemporaryDirectory()
+        self.addCleanup(storage.cleanup)
+        self.manager = JobManager(storage.name, max_workers=1, ttl=60)
+        patcher = mock.patch('diagram.jobs._job_manager', self.manager)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_job_lifecycle(self):
+        response = self.client.post(
+            reverse('render-jobs'),
+            {'fens': [START_FEN] * 3, 'diagrams_per_page': 1},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()['id']
+        self.manager.get(job_id).future.result(timeout=60)
+
+        job = self.client.get(reverse('render-job', args=[job_id])).json()
+        self.assertEqual(job['status'], FINISHED)
+        self.assertEqual((job['pages_done'], job['total_pages']), (3, 3))
+
+        download = self.client.get(job['download_url'])
+        self.assertEqual(download.status_code, 200)
+        self.assertTrue(b''.join(download.streaming_content).startswith(b'%PDF'))
+
+        self.assertEqual(self.client.delete(reverse('render-job', args=[job_id])).status_code, 204)
+        self.assertEqual(self.client.get(reverse('render-job', args=[job_id])).status_code, 404)
+
+    def test_queued_job_can_be_cancelled(self):
+        running = self.manager.submit([START_FEN] * 20, {'diagrams_per_page': 1})
+        queued = self.manager.submit([START_FEN], {'diagrams_per_page': 1})
+        response = self.client.delete(reverse('render-job', args=[queued.id]))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status'], CANCELLED)
+        self.assertEqual(self.client.get(reverse('render-job-download', args=[queued.id])).status_code, 409)
+        running.future.result(timeout=60)
+
+    def test_jobs_over_the_cost_limit_are_refused(self):
+        with mock.patch.dict('diagram.admission.JOB_CONFIG', {'max_cost': 2}):
+            response = self.client.post(
+                reverse('render-jobs'), {'fens': [START_FEN] * 3}, content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(self.manager._jobs)
+
+    def test_expired_jobs_are_swept_on_submit_not_on_read(self):
+        job = self.manager.submit([START_FEN], {'diagrams_per_page': 1})
+        job.future.result(timeout=60)
+        job.finished_at -= 120
+        with mock.patch('diagram.jobs.os.listdir') as listdir:
+            self.assertIsNone(self.manager.get(job.id))
+            listdir.assert_not_called()
+        self.assertTrue(os.path.exists(job.path))
+
+        self.manager.submit([START_FEN], {'diagrams_per_page': 1}).future.result(timeout=60)
+        self.assertNotIn(job.id, self.manager._jobs)
+        self.assertFalse(os.path.exists(job.path))
+
+
+class ResultCacheTests(SimpleTestCase):
+    payload = {'fens': [START_FEN, BLACK_TO_MOVE_FEN], 'diagrams_per_page': 2, 'title': 'Cached'}
+
+    def setUp(self):
+        get_result_cache().clear()
+
+    def post(self, payload, **headers):
+        return self.client.post(reverse('generate-pdf'), payload, content_type='application/json', headers=headers)
+
+    def test_identical_requests_produce_identical_bytes(self):
+        self.assertEqual(create_pdf_from_fens([START_FEN], title='Same'), create_pdf_from_fens([START_FEN], title='Same'))
+
+    def test_cached_pdf_and_etag(self):
+        first = self.post(self.payload)
+        with mock.patch('diagram.pdf_service.create_pdf_from_fens') as render:
+            second = self.post(self.payload)
+            render.assert_not_called()
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first['ETag'], second['ETag'])
+
+        not_modified = self.post(self.payload, if_none_match=first['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        changed = self.post({**self.payload, 'title': 'Other'}, if_none_match=first['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], first['ETag'])
+
+    def test_local_memory_django_cache_is_refused(self):
+        with self.assertRaisesMessage(ValueError, 'LocMemCache'):
+            DjangoResultCache('default', timeout=60, max_entry_bytes=1024)
+
+    def test_disk_cache_evicts_least_recently_used(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        disk_cache = DiskResultCache(directory.name, max_bytes=25, max_entry_bytes=20)
+        disk_cache.set('a', b'x' * 10)
+        disk_cache.set('b', b'y' * 10)
+        os.utime(os.path.join(directory.name, 'a.pdf'), (0, 0))
+        disk_cache.get('a')  # Touching an entry makes it the most recently used.
+        os.utime(os.path.join(directory.name, 'b.pdf'), (1, 1))
+        disk_cache.set('c', b'z' * 10)
+        disk_cache.set('too-big', b'!' * 21)
+        self.assertEqual(disk_cache.get('a'), b'x' * 10)
+        self.assertIsNone(disk_cache.get('b'))
+        self.assertEqual(disk_cache.get('c'), b'z' * 10)
+        self.assertIsNone(disk_cache.get('too-big'))
+
+
+class PrivateDirectoryTests(SimpleTestCase):
+    def setUp(self):
+        base_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(base_dir.cleanup)
+        self.base_dir = base_dir.name
+
+    def test_default_directories_are_private_and_under_base_dir(self):
+        with override_settings(BASE_DIR=self.base_dir):
+            disk_cache = DiskResultCache(None, max_bytes=1024, max_entry_bytes=1024)
+            manager = JobManager(None, max_workers=1, ttl=60)
+            self.addCleanup(manager._executor.shutdown)
+        for directory, name in ((disk_cache.directory, 'pdf_cache'), (manager.storage_dir, 'jobs')):
+            self.assertEqual(directory, os.path.join(self.base_dir, 'var', name))
+            self.assertEqual(os.stat(directory).st_mode & 0o777, 0o700)
+
+    def test_shared_directories_are_refused(self):
+        shared = os.path.join(self.base_dir, 'shared')
+        os.mkdir(shared)
+        os.chmod(shared, 0o777)
+        with self.assertRaises(PermissionError):
+            DiskResultCache(shared, max_bytes=1024, max_entry_bytes=1024)
+        os.chmod(shared, 0o700)
+        with mock.patch('diagram.storage.os.getuid', return_value=os.getuid() + 1), \
+                self.assertRaises(PermissionError):
+            RenderCoalescer(shared)
+
+
+class FenValidationTests(SimpleTestCase):
+    def test_positions_are_normalized_and_deduplicated(self):
+        fens = validate_fens([
+            START_FEN,
+            {'fen': START_FEN, 'description': 'Start'},
+            # Same position with extra whitespace around the fields.
+            "  rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1 ",
+            BLACK_TO_MOVE_FEN,
+        ])
+        self.assertEqual(len(fens), 4)
+        self.assertEqual(fens.positions, [START_FEN, BLACK_TO_MOVE_FEN])
+        self.assertEqual(list(fens.position_indexes), [0, 0, 0, 1])
+        self.assertEqual(list(fens)[1], {'fen': START_FEN, 'description': 'Start'})
+
+    def test_every_invalid_item_is_reported(self):
+        with self.assertRaises(FenValidationError) as raised:
+            validate_fens([START_FEN, "not a fen", {'description': 'missing'}, "not a fen"])
+        self.assertEqual(raised.exception.error_count, 3)
+        self.assertEqual([error['index'] for error in raised.exception.errors], [1, 2, 3])
+
+    def test_api_rejects_invalid_fens_before_rendering(self):
+        with mock.patch('diagram.pdf_service.create_pdf_from_fens') as render:
+            response = self.client.post(
+                reverse('generate-pdf'),
+                {'fens': [START_FEN, "8/8/8/8/8/8/8/9 w - - 0 1"]},
+                content_type='application/json'
+            )
+            render.assert_not_called()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['invalid_fens'][0]['index'], 1)
+
+
+class MetricsTests(SimpleTestCase):
+    def setUp(self):
+        get_result_cache().clear()
+        drawing_cache.clear()
+        page_cache.clear()
+        registry.reset()
+
+    def test_render_stages_and_counters_are_collected(self):
+        with collect() as metrics:
+            pdf_data = create_pdf_from_fens([START_FEN, START_FEN, BLACK_TO_MOVE_FEN], diagrams_per_page=2)
+        self.assertEqual(set(metrics.timings), {'drawings', 'render', 'layout', 'build'})
+        self.assertEqual(metrics.counters, {
+            'diagrams': 3, 'boards_rendered': 2, 'drawing_cache_hits': 0,
+            'documents': 1, 'pages': 2, 'bytes_out': len(pdf_data),
+        })
+        self.assertEqual(registry.counters['diagrams'], 3)
+
+    def test_server_timing_header_and_metrics_endpoint(self):
+        response = self.client.post(
+            reverse('generate-pdf'), {'fens': [START_FEN], 'diagrams_per_page': 1}, content_type='application/json'
+        )
+        server_timing = response['Server-Timing']
+        for entry in ('validate;dur=', 'drawings;dur=', 'build;dur=', 'total;dur=', 'pages;desc="1"'):
+            self.assertIn(entry, server_timing)
+
+        metrics = self.client.get(reverse('metrics'))
+        self.assertTrue(metrics['Content-Type'].startswith('text/plain'))
+        self.assertIn(b'diagram_documents_total 1\n', metrics.content)
+        self.assertIn(b'diagram_stage_seconds_total{stage="build"}', metrics.content)
+
+    def test_profile_is_restricted_to_staff(self):
+        payload = {'fens': [START_FEN], 'profile': True}
+        response = self.client.post(reverse('generate-pdf'), payload, content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+        staff = mock.Mock(is_staff=True, is_authenticated=True)
+        with mock.patch('rest_framework.request.Request.user', new_callable=mock.PropertyMock, return_value=staff):
+            response = self.client.post(reverse('generate-pdf'), payload, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'create_pdf_from_fens', response.content)
+
+    def test_false_profile_values_do_not_profile(self):
+        for value in ('false', 'False', '0', 0, False):
+            payload = {'fens': [START_FEN], 'profile': value}
+            response = self.client.post(reverse('generate-pdf'), payload, content_type='application/json')
+            self.assertEqual(response.status_code, 200, value)
+            self.assertEqual(response['Content-Type'], 'application/pdf')
+
+
+SAMPLE_PGN = """[Event "Club Championship"]
+[Date "2024.05.12"]
+[White "Alice"]
+[Black "Bob"]
+[Result "1-0"]
+
+1. e4 e5 2. Nf3 {Developing with tempo.} Nc6 3. Bb5 a6 4. Ba4 Nf6 1-0
+
+[Event "?"]
+[White "Carol"]
+[Black "Dave"]
+[Result "*"]
+
+1. d4 d5 2. c4 *
+"""
+
+
+class PgnIngestionTests(SimpleTestCase):
+    def diagrams(self, **selectors):
+        return list(iter_pgn_diagrams(io.StringIO(SAMPLE_PGN), **selectors))
+
+    def test_final_positions_by_default(self):
+        diagrams = self.diagrams()
+        self.assertEqual(len(diagrams), 2)
+        self.assertEqual(diagrams[0]['description'], "Alice - Bob, Club Championship, 2024: 4... Nf6 1-0")
+        self.assertEqual(diagrams[1]['description'], "Carol - Dave: 2. c4")
+        self.assertEqual(diagrams[1]['fen'], "rnbqkbnr/ppp1pppp/8/3p4/2PP4/8/PP2PPPP/RNBQKBNR b KQkq - 0 2")
+
+    def test_selectors(self):
+        self.assertEqual(len(self.diagrams(every_ply=2)), 4 + 1)
+        after_second = self.diagrams(after_moves=[2])
+        self.assertEqual([d['description'].split(': ')[1] for d in after_second], ["2... Nc6"])
+        commented = self.diagrams(comments=True)
+        self.assertEqual(commented[0]['description'],
+                         "Alice - Bob, Club Championship, 2024: 2. Nf3 Developing with tempo.")
+
+    def test_pgn_endpoint_streams_a_pdf(self):
+        response = self.client.post(
+            reverse('generate-pdf-pgn'), {'pgn': SAMPLE_PGN, 'every_ply': 2, 'diagrams_per_page': 4},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+        upload = io.BytesIO(SAMPLE_PGN.encode('utf-8'))
+        upload.name = 'games.pgn'
+        response = self.client.post(reverse('generate-pdf-pgn'), {'pgn': upload, 'comments': 'true'})
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.post(reverse('generate-pdf-pgn'), {'pgn': SAMPLE_PGN, 'after_moves': [40]},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class PreviewApiTests(SimpleTestCase):
+    payload = {
+        'fens': [{'fen': START_FEN, 'description': 'Start'}, BLACK_TO_MOVE_FEN, "not a fen"],
+        'diagrams_per_page': 2,
+        'title': 'Preview',
+        'format': 'svg',
+    }
+
+    def post(self, **fields):
+        return self.client.post(reverse('preview'), {**self.payload, **fields}, content_type='application/json')
+
+    def test_first_page_preview_only_renders_the_first_page(self):
+        response = self.post(width=200)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertIn(b'Start', response.content)
+        with mock.patch('diagram.preview.render_preview') as render:
+            self.assertEqual(self.post(width=200).content, response.content)
+            render.assert_not_called()
+
+    def test_png_is_the_default_format(self):
+        payload = {key: value for key, value in self.payload.items() if key != 'format'}
+        response = self.client.post(reverse('preview'), {**payload, 'width': 120}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        image = Image.open(io.BytesIO(response.content))
+        self.assertEqual(image.format, 'PNG')
+        self.assertEqual(image.width, 120)
+
+    def test_diagram_preview_and_validation(self):
+        self.assertEqual(self.post(preview='diagram', index=1).status_code, 200)
+        self.assertEqual(self.post(preview='diagram', index=2).status_code, 400)
+        self.assertEqual(self.post(preview='diagram', index=3).status_code, 400)
+        self.assertEqual(self.post(format='gif').status_code, 400)
+
+    def test_diagram_preview_keeps_the_turn_indicator(self):
+        drawing = diagram_preview_drawing(BLACK_TO_MOVE_FEN, show_turn_indicator=True)
+        _x1, _y1, x2, y2 = drawing.getBounds()
+        self.assertLessEqual(x2, drawing.width)
+        self.assertLessEqual(y2, drawing.height)
+        self.assertGreater(drawing.width, diagram_preview_drawing(BLACK_TO_MOVE_FEN).width)
+
+    def test_preview_latency(self):
+        # The boards come from the drawing cache, so this times the layout and the image encoding.
+        fens = [{'fen': START_FEN, 'description': 'Start'}, BLACK_TO_MOVE_FEN] * 3
+        drawing_cache.clear()
+        page_preview_drawing(fens, show_turn_indicator=True)
+        for image_format in PREVIEW_FORMATS:
+            for build in (
+                lambda: page_preview_drawing(fens, show_turn_indicator=True),
+                lambda: diagram_preview_drawing(BLACK_TO_MOVE_FEN, show_turn_indicator=True),
+            ):
+                elapsed = []
+                for _ in range(3):
+                    start = time.perf_counter()
+                    render_preview(build(), PREVIEW_CONFIG['default_width'], image_format)
+                    elapsed.append(time.perf_counter() - start)
+                self.assertLess(min(elapsed), 0.1, image_format)
+
+
+class StartupTests(SimpleTestCase):
+    def test_auto_warm_up_only_in_serving_processes(self):
+        with mock.patch.dict('diagram.startup.STARTUP_CONFIG', {'warm_up': 'auto'}):
+            self.assertTrue(should_warm_up(['/usr/local/bin/gunicorn', 'app.wsgi'], {}))
+            self.assertTrue(should_warm_up(['/venv/lib/python3.11/site-packages/uvicorn/__main__.py'], {}))
+            self.assertTrue(should_warm_up(['manage.py', 'runserver'], {'RUN_MAIN': 'true'}))
+            self.assertTrue(should_warm_up(['manage.py', 'runserver', '--noreload'], {}))
+            self.assertFalse(should_warm_up(['manage.py', 'runserver'], {}))
+            self.assertFalse(should_warm_up(['manage.py', 'test'], {}))
+            self.assertFalse(should_warm_up(['manage.py', 'migrate'], {}))
+            self.assertFalse(should_warm_up(['/venv/bin/celery', '-A', 'app', 'worker'], {}))
+            self.assertFalse(should_warm_up(['-c'], {}))
+            self.assertFalse(should_warm_up([], {}))
+
+    def test_explicit_setting_overrides_detection(self):
+        with mock.patch.dict('diagram.startup.STARTUP_CONFIG', {'warm_up': False}):
+            self.assertFalse(should_warm_up(['gunicorn'], {}))
+        with mock.patch.dict('diagram.startup.STARTUP_CONFIG', {'warm_up': True}):
+            self.assertTrue(should_warm_up(['manage.py', 'migrate'], {}))
+
+    def test_warm_up_renders_without_recording_metrics(self):
+        registry.reset()
+        drawing_cache.clear()
+        self.assertGreater(warm_up(), 0)
+        self.assertEqual(registry.counters['documents'], 0)
+        self.assertEqual(drawing_cache.info()['size'], 1)
+
+
+class BulkUploadTests(SimpleTestCase):
+    def post_upload(self, body, content_type='text/plain', query='', **extra):
+        url = reverse('generate-pdf') + query
+        return self.client.post(url, body, content_type=content_type, **extra)
+
+    def test_text_and_ndjson_lines(self):
+        body = '\n'.join([
+            START_FEN,
+            '',
+            json.dumps({'fen': BLACK_TO_MOVE_FEN, 'description': "1. e4"}),
+        ])
+        with mock.patch('diagram.pdf_service.create_pdf_from_fens', wraps=create_pdf_from_fens) as create:
+            response = self.post_upload(body, 'application/x-ndjson', '?diagrams_per_page=2&show_coordinates=true')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+        kwargs = create.call_args.kwargs
+        self.assertEqual(kwargs['diagrams_per_page'], 2)
+        self.assertTrue(kwargs['show_coordinates'])
+
+    def test_gzip_upload(self):
+        body = gzip.compress(('\n'.join([START_FEN] * 20) + '\n').encode('utf-8'))
+        response = self.post_upload(body, HTTP_CONTENT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+    def test_invalid_lines_reported_by_index(self):
+        body = '\n'.join([START_FEN, 'not a fen', '{"fen": 3}', START_FEN, '{broken'])
+        response = self.post_upload(body)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['invalid_count'], 3)
+        self.assertEqual([error['index'] for error in response.json()['invalid_fens']], [1, 2, 4])
+
+    def test_empty_and_corrupt_uploads(self):
+        self.assertEqual(self.post_upload('\n\n').status_code, 400)
+        self.assertEqual(self.post_upload(b'not gzip', HTTP_CONTENT_ENCODING='gzip').status_code, 400)
+        self.assertEqual(self.post_upload(START_FEN, HTTP_CONTENT_ENCODING='br').status_code, 415)
+
+
+class AdmissionTests(SimpleTestCase):
+    def setUp(self):
+        # Cached results are served without admission.
+        get_result_cache().clear()
+
+    def test_cost_weights_renderer_and_descriptions(self):
+        fens = [START_FEN, {'fen': START_FEN, 'description': "1. e4"}]
+        svg_cost = estimate_cost(fens, {'renderer': 'svg', 'output_mode': 'vector'})
+        self.assertGreater(svg_cost, estimate_cost(fens, {'renderer': 'native', 'output_mode': 'vector'}))
+        self.assertGreater(svg_cost, estimate_cost([START_FEN] * 2, {'renderer': 'svg', 'output_mode': 'vector'}))
+
+    def test_cost_budget_and_render_slots(self):
+        controller = AdmissionController(max_total_cost=10, max_concurrent=1, queue_timeout=0.05, retry_after=7)
+        with controller.admit(6):
+            with self.assertRaises(AdmissionRejected) as over_budget:
+                with controller.admit(6):
+                    pass
+            self.assertEqual((over_budget.exception.status, over_budget.exception.retry_after), (429, 7))
+            with self.assertRaises(AdmissionRejected) as no_slot:
+                with controller.admit(1):
+                    pass
+            self.assertEqual(no_slot.exception.status, 503)
+        # Everything is released, including the cost of the request refused for lack of a slot.
+        self.assertEqual(controller.info()['cost_in_flight'], 0)
+        with controller.admit(10):
+            self.assertEqual(controller.info()['running'], 1)
+
+    def test_busy_server_answers_429_with_retry_after(self):
+        controller = AdmissionController(max_total_cost=1, max_concurrent=1, queue_timeout=0.05, retry_after=3)
+        release = threading.Event()
+
+        def hold():
+            with controller.admit(1):
+                release.wait(5)
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        self.addCleanup(holder.join)
+        self.addCleanup(release.set)
+        while not controller.info()['running']:
+            time.sleep(0.01)
+        with mock.patch('diagram.admission._controller', controller):
+            response = self.client.post(reverse('generate-pdf'), {'fens': [START_FEN]}, content_type='application/json')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '3')
+
+    def test_request_over_budget_gets_413(self):
+        with mock.patch.dict('diagram.admission.ADMISSION_CONFIG', {'max_request_cost': 2}):
+            response = self.client.post(
+                reverse('generate-pdf'), {'fens': [START_FEN] * 3}, content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 413)
+            upload = self.client.post(reverse('generate-pdf'), '\n'.join([START_FEN] * 3), content_type='text/plain')
+            self.assertEqual(upload.status_code, 413)
+
+    def test_render_deadline(self):
+        with self.assertRaises(RenderTimeout):
+            create_pdf_from_fens([START_FEN] * 4, diagrams_per_page=1, deadline=time.monotonic() - 1)
+        with mock.patch('diagram.admission.render_deadline', return_value=time.monotonic() - 1):
+            response = self.client.post(reverse('generate-pdf'), {'fens': [START_FEN]}, content_type='application/json')
+        self.assertEqual(response.status_code, 504)
+
+
+class AsyncGeneratePdfTests(SimpleTestCase):
+    def setUp(self):
+        get_result_cache().clear()
+        self.addCleanup(shutdown_render_executor)
+
+    async def post(self, payload):
+        return await self.async_client.post(reverse('generate-pdf-async'), payload, content_type='application/json')
+
+    async def test_renders_in_executor(self):
+        response = await self.post({'fens': [START_FEN, BLACK_TO_MOVE_FEN], 'diagrams_per_page': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content.startswith(b'%PDF'))
+        self.assertIn('drawings;dur=', response['Server-Timing'])
+        # Same bytes as the synchronous view, which serves them from the result cache.
+        sync_response = await self.async_client.post(
+            reverse('generate-pdf'), {'fens': [START_FEN, BLACK_TO_MOVE_FEN], 'diagrams_per_page': 2},
+            content_type='application/json'
+        )
+        self.assertEqual(sync_response.content, response.content)
+
+    def test_threads_render_the_shared_shapes_concurrently(self):
+        drawing_cache.clear()
+        fens = [START_FEN, BLACK_TO_MOVE_FEN] * 4
+        options = [
+            {'renderer': renderer, 'output_mode': output_mode, 'show_coordinates': True,
+             'show_turn_indicator': True, 'diagrams_per_page': 4}
+            for renderer in ('svg', 'native') for output_mode in ('vector', 'xobject')
+        ]
+        expected = [render_pdf(fens, render_options) for render_options in options]
+        # Switch threads as often as possible, so the renders interleave inside the shapes they share.
+        switch_interval = sys.getswitchinterval()
+        self.addCleanup(sys.setswitchinterval, switch_interval)
+        sys.setswitchinterval(1e-6)
+        with mock.patch.dict('diagram.executor.EXECUTOR_CONFIG', {'kind': 'thread', 'max_workers': 8}):
+            shutdown_render_executor()
+            executor = get_render_executor()
+            futures = [executor.submit(render_pdf, fens, render_options) for render_options in options * 4]
+            results = [future.result() for future in futures]
+        self.assertEqual(results, expected * 4)
+
+    async def test_invalid_payload(self):
+        response = await self.post({'fens': [START_FEN, 'not a fen']})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['invalid_count'], 1)
+
+    async def test_concurrent_requests_keep_the_event_loop_responsive(self):
+        render_seconds = 0.2
+        workers = 4
+
+        def slow_render(fens, render_options, deadline=None):
+            time.sleep(render_seconds)
+            return render_pdf(fens, render_options, deadline)
+
+        lags = []
+
+        async def ticker(stop):
+            while not stop.is_set():
+                start = time.perf_counter()
+                await asyncio.sleep(0.01)
+                lags.append(time.perf_counter() - start - 0.01)
+
+        stop = asyncio.Event()
+        with mock.patch('diagram.executor.render_pdf', slow_render), \
+                mock.patch.dict('diagram.executor.EXECUTOR_CONFIG', {'kind': 'thread', 'max_workers': workers}), \
+                mock.patch.dict('diagram.admission.ADMISSION_CONFIG', {'max_concurrent': workers}), \
+                mock.patch('diagram.admission._controller', None):
+            shutdown_render_executor()
+            tick = asyncio.ensure_future(ticker(stop))
+            start = time.perf_counter()
+            # Distinct payloads, so no response comes from the result cache.
+            responses = await asyncio.gather(*[
+                self.post({'fens': [START_FEN], 'title': f"Request {i}"}) for i in range(2 * workers)
+            ])
+            elapsed = time.perf_counter() - start
+            stop.set()
+            await tick
+
+        self.assertEqual([response.status_code for response in responses], [200] * (2 * workers))
+        # Two waves of renders, not one render after the other.
+        self.assertLess(elapsed, render_seconds * 2 * workers * 0.75)
+        # The loop kept running while the renders slept in the executor.
+        self.assertLess(max(lags), render_seconds)
+
+
+class BatchApiTests(SimpleTestCase):
+    def setUp(self):
+        get_result_cache().clear()
+
+    def post(self, payload):
+        return self.client.post(reverse('generate-pdf-batch'), payload, content_type='application/json')
+
+    def read_zip(self, response):
+        return zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+
+    def test_zip_holds_one_pdf_per_document_in_order(self):
+        response = self.post({
+            'diagrams_per_page': 1,
+            'documents': [
+                {'name': 'Openings', 'fens': [START_FEN]},
+                {'name': 'Openings', 'fens': [START_FEN, START_FEN], 'renderer': 'native'},
+                {'fens': [{'fen': START_FEN, 'description': "1. e4"}]},
+            ],
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = self.read_zip(response)
+        self.assertEqual(archive.namelist(), ['Openings.pdf', 'Openings (2).pdf', 'document-3.pdf'])
+        for name in archive.namelist():
+            self.assertTrue(archive.read(name).startswith(b'%PDF'))
+
+    def test_invalid_documents_are_reported_by_index(self):
+        response = self.post({'documents': [{'fens': [START_FEN]}, {'fens': ['not a fen']}, 'oops']})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['index'] for error in response.json()['invalid_documents']], [1, 2])
+        self.assertEqual(self.post({'documents': []}).status_code, 400)
+
+    def test_failed_document_becomes_error_entry(self):
+        with mock.patch('diagram.batch.create_pdf_from_fens', side_effect=[RuntimeError("boom"), None]):
+            response = self.post({'documents': [{'name': 'a', 'fens': [START_FEN]}, {'name': 'b', 'fens': [START_FEN]}]})
+            archive = self.read_zip(response)
+        self.assertEqual(archive.namelist(), ['a.error.txt', 'b.pdf'])
+
+    def test_prewarm_stops_at_the_deadline(self):
+        documents = [('a.pdf', [{'fen': START_FEN}], {}), ('b.pdf', [{'fen': BLACK_TO_MOVE_FEN}], {})]
+        with mock.patch('diagram.batch.prepare_drawings') as prepare, \
+                mock.patch('diagram.pdf_service.prepare_drawings') as prepare_document:
+            stream = BatchZipStream(documents, deadline=time.monotonic() - 1)
+            archive = zipfile.ZipFile(io.BytesIO(b''.join(stream)))
+        prepare.assert_not_called()
+        prepare_document.assert_not_called()
+        self.assertEqual(archive.namelist(), ['a.error.txt'])
+
+    def test_admission_slot_held_until_stream_closed(self):
+        response = self.post({'documents': [{'fens': [START_FEN]}]})
+        self.assertEqual(get_admission_controller().info()['running'], 1)
+        response.close()
+        self.assertEqual(get_admission_controller().info()['running'], 0)
+
+
+class ShardedBuildTests(SimpleTestCase):
+    def setUp(self):
+        self.addCleanup(shutdown_process_pool)
+        self.fens = [{'fen': START_FEN, 'description': f"Diagram {index}"} for index in range(11)]
+
+    def test_sharded_pages_match_single_process_build(self):
+        for layout_engine, output_mode in (('canvas', 'vector'), ('platypus', 'xobject')):
+            options = dict(diagrams_per_page=2, title="Openings", show_page_numbers=True, renderer='native',
+                           layout_engine=layout_engine, output_mode=output_mode)
+            single = create_pdf_from_fens(self.fens, **options)
+            with mock.patch.dict('diagram.pdf_service.PARALLEL_CONFIG', {'min_pages_per_shard': 2, 'pool_size': 3}):
+                sharded = create_pdf_from_fens(self.fens, shards=3, **options)
+            with self.subTest(layout_engine=layout_engine, output_mode=output_mode):
+                contents = PdfFile(sharded).page_contents()
+                self.assertEqual(len(contents), 6)
+                self.assertEqual(contents, PdfFile(single).page_contents())
+                self.assertIn(b'(Page 6)', contents[-1])
+
+    def test_api_requests_are_sharded_by_configuration(self):
+        get_result_cache().clear()
+        config = {'shards': 2, 'min_pages_per_shard': 2, 'pool_size': 2}
+        with mock.patch.dict('diagram.pdf_service.PARALLEL_CONFIG', config), \
+                mock.patch('diagram.pdf_service._create_sharded_pdf',
+                           wraps=_create_sharded_pdf) as sharded:
+            response = self.client.post(
+                reverse('generate-pdf'),
+                {'fens': self.fens[:8], 'diagrams_per_page': 2, 'renderer': 'native'},
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 200)
+        sharded.assert_called_once()
+        self.assertEqual(sharded.call_args.args[1], 2)
+        self.assertEqual(len(PdfFile(response.content).page_contents()), 4)
+
+    def test_normalized_fens_are_a_sequence(self):
+        fens = validate_fens(self.fens)
+        self.assertEqual(fens[3], {'fen': START_FEN, 'description': "Diagram 3"})
+        self.assertEqual(list(fens[2:4]), self.fens[2:4])
+        self.assertEqual(len(fens[::2]), 6)
+
+    def test_shards_are_capped_at_the_size_of_the_pool(self):
+        config = {'min_pages_per_shard': 1, 'pool_size': 2}
+        with mock.patch.dict('diagram.pdf_service.PARALLEL_CONFIG', config), \
+                mock.patch('diagram.pdf_service._create_sharded_pdf', wraps=_create_sharded_pdf) as sharded:
+            pool = get_process_pool()
+            create_pdf_from_fens(self.fens, diagrams_per_page=2, renderer='native', shards=4)
+            create_pdf_from_fens(self.fens, diagrams_per_page=2, renderer='native', shards=2)
+            self.assertIs(get_process_pool(), pool)
+        self.assertEqual([call.args[1] for call in sharded.call_args_list], [2, 2])
+
+    def test_small_documents_are_built_in_one_process(self):
+        with mock.patch('diagram.pdf_service._create_sharded_pdf') as sharded:
+            create_pdf_from_fens(self.fens, diagrams_per_page=2, renderer='native', shards=4)
+        sharded.assert_not_called()
+
+    def test_merge_writes_shared_objects_once(self):
+        pdf_data = create_pdf_from_fens(self.fens[:2], renderer='native', output_mode='xobject')
+        merged = PdfFile(merge_pdfs([pdf_data, pdf_data]))
+        self.assertEqual(len(merged.page_numbers()), 2)
+        # Only the page object is added; the fonts, forms and content stream are shared.
+        self.assertEqual(len(merged.objects), len(PdfFile(pdf_data).objects) + 1)
+
+    def test_merge_declares_the_highest_version(self):
+        pdf_data = create_pdf_from_fens(self.fens[:2], renderer='native', output_mode='xobject')
+        version = re.match(rb'%PDF-\d\.\d', pdf_data).group(0)
+        # Same length, so the offsets of the cross-reference table stay valid.
+        older, newer = pdf_data.replace(version, b'%PDF-1.3', 1), pdf_data.replace(version, b'%PDF-1.7', 1)
+        self.assertTrue(merge_pdfs([older, newer]).startswith(b'%PDF-1.7'))
+        self.assertEqual(PdfFile(merge_pdfs([newer, older])).version, (1, 7))
+
+
+class DrawingStoreTests(SimpleTestCase):
+    def setUp(self):
+        drawing_cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'drawings.sqlite3')
+        self.store = DrawingStore(self.path, max_bytes=1024 * 1024)
+
+    def test_boards_rendered_by_another_worker_are_loaded(self):
+        with mock.patch('diagram.utils.get_drawing_store', return_value=self.store):
+            fen_to_drawing(START_FEN)
+        drawing_cache.clear()
+        # A second store on the same file stands for another worker process.
+        other_worker = DrawingStore(self.path, max_bytes=1024 * 1024)
+        with mock.patch('diagram.utils.get_drawing_store', return_value=other_worker), \
+                mock.patch('diagram.parallel.get_drawing_store', return_value=other_worker), \
+                mock.patch.dict('diagram.utils.RENDERERS', {'svg': mock.Mock(side_effect=AssertionError)}):
+            with collect() as metrics:
+                drawing = fen_to_drawing(START_FEN)
+                prepare_drawings([START_FEN, START_FEN])
+        self.assertEqual(metrics.counters['drawing_store_hits'], 1)
+        self.assertEqual(metrics.counters['drawing_cache_hits'], 1)
+        self.assertEqual(metrics.counters['boards_rendered'], 0)
+        self.assertEqual(len(drawing.contents), len(fen_to_drawing(START_FEN).contents))
+
+    def test_corrupt_entries_are_deleted(self):
+        self.store.put('board', Drawing(10, 10))
+        with sqlite3.connect(self.path) as connection:
+            connection.execute("UPDATE drawings SET data = X'00'")
+        self.assertIsNone(self.store.get('board'))
+        self.assertEqual(self.store.info()['entries'], 0)
+
+    def test_entries_without_a_valid_signature_are_never_unpickled(self):
+        self.store.put('board', Drawing(10, 10))
+        # A writer without SECRET_KEY can compute a plain checksum of its payload, but not the signature.
+        payload = zlib.compress(pickle.dumps(Drawing(20, 20)))
+        with sqlite3.connect(self.path) as connection:
+            connection.execute("UPDATE drawings SET data = ?, signature = ?",
+                               [payload, hashlib.sha256(payload).hexdigest()])
+        with mock.patch('diagram.drawing_store.pickle.loads') as loads:
+            self.assertIsNone(self.store.get('board'))
+        loads.assert_not_called()
+        self.assertEqual(self.store.info()['entries'], 0)
+
+    def test_default_database_is_in_a_private_directory(self):
+        with tempfile.TemporaryDirectory() as base_dir, override_settings(BASE_DIR=base_dir):
+            store = DrawingStore(None, max_bytes=1024 * 1024)
+            store.put('board', Drawing(10, 10))
+            self.assertEqual(os.path.dirname(store.path), os.path.join(base_dir, 'var', 'drawing_store'))
+            self.assertEqual(os.stat(os.path.dirname(store.path)).st_mode & 0o777, 0o700)
+            self.assertEqual(store.get('board').width, 10)
+
+    def test_shared_directories_are_refused(self):
+        with tempfile.TemporaryDirectory() as directory:
+            os.chmod(directory, 0o777)
+            store = DrawingStore(os.path.join(directory, 'drawings.sqlite3'), max_bytes=1024 * 1024)
+            with self.assertRaises(PermissionError):
+                store.put('board', Drawing(10, 10))
+
+    def test_least_recently_used_drawings_are_evicted(self):
+        self.store.put_many([('old', Drawing(10, 10)), ('recent', Drawing(20, 20))])
+        with sqlite3.connect(self.path) as connection:
+            connection.execute("UPDATE drawings SET last_used = 0 WHERE key = ?", [store_key('old')])
+        # Room for two drawings (their pickles may differ by a few bytes), not for three.
+        self.store.max_bytes = self.store.info()['bytes'] * 5 // 4
+        self.store.put('new', Drawing(30, 30))
+        self.assertEqual(self.store.info()['entries'], 2)
+        self.assertIsNone(self.store.get('old'))
+        self.assertEqual(self.store.get('recent').width, 20)
+
+
+class DraftOutputTests(SimpleTestCase):
+    def test_identical_boards_share_one_image(self):
+        pdf_data = create_pdf_from_fens([START_FEN] * 5 + [BLACK_TO_MOVE_FEN] * 3, diagrams_per_page=4,
+                                        output_mode='draft', show_turn_indicator=True)
+        pdf = PdfFile(pdf_data)
+        self.assertEqual(len(pdf.page_numbers()), 2)
+        self.assertEqual(pdf_data.count(b'/Subtype /Image'), 2)
+        self.assertEqual(pdf_data.count(b'/ColorSpace [ /Indexed /DeviceRGB'), 2)
+
+    def test_resolution_sets_the_bitmap_size(self):
+        low, high = (
+            create_pdf_from_fens([START_FEN], diagrams_per_page=1, output_mode='draft', draft_dpi=dpi)
+            for dpi in (50, 100)
+        )
+        low_width = int(re.search(rb'/Width (\d+)', low).group(1))
+        high_width = int(re.search(rb'/Width (\d+)', high).group(1))
+        self.assertAlmostEqual(high_width / low_width, 2, delta=0.01)
+
+    def test_api_validates_the_resolution(self):
+        for draft_dpi, status_code in ((72, 200), (1000, 400), (True, 400)):
+            with self.subTest(draft_dpi=draft_dpi):
+                response = self.client.post(
+                    reverse('generate-pdf'),
+                    {'fens': [START_FEN], 'output_mode': 'draft', 'draft_dpi': draft_dpi},
+                    content_type='application/json'
+                )
+                self.assertEqual(response.status_code, status_code)
+
+
+class RasterTests(SimpleTestCase):
+    def test_png_preview_matches_the_vector_board_with_coordinates(self):
+        drawing = diagram_preview_drawing(START_FEN, show_coordinates=True, renderer='native')
+        width, height = round(drawing.width), round(drawing.height)
+        image = Image.open(io.BytesIO(render_preview(drawing, width, 'png'))).convert('RGB')
+
+        def distance(pixel, color):
+            return max(abs(channel - round(value * 255)) for channel, value in zip(pixel, color.rgb()))
+
+        squares = labels = 0
+        for kind, (x1, y1, x2, y2), fill_color, _stroke_color, _stroke_width in flatten_shapes(drawing):
+            # Image rows run down from the top of the drawing.
+            box = (math.floor(min(x1, x2)), math.floor(height - max(y1, y2)),
+                   math.ceil(max(x1, x2)), math.ceil(height - min(y1, y2)))
+            fill_color = colors.toColor(fill_color)
+            if kind == 'Rect' and box[2] - box[0] == SQUARE_SIZE:
+                squares += 1
+                # The corners of the squares are clear of the pieces.
+                self.assertLess(distance(image.getpixel((box[0] + 3, box[1] + 3)), fill_color), 8)
+            elif min(box[2], box[3]) <= COORDINATE_MARGIN or max(box[0], box[1]) >= width - COORDINATE_MARGIN:
+                labels += 1
+                pixels = image.crop(box).getdata()
+                self.assertLess(min(distance(pixel, fill_color) for pixel in pixels), 64)
+        self.assertEqual((squares, labels), (64, 32))
+
+    def test_every_shape_is_drawn_or_rejected(self):
+        drawing = Drawing(40, 10)
+        drawing.add(Line(1, 5, 9, 5, strokeColor=colors.red, strokeWidth=2))
+        drawing.add(PolyLine([11, 2, 15, 8, 19, 2], strokeColor=colors.red, strokeWidth=2))
+        drawing.add(Polygon([21, 1, 29, 1, 25, 9], fillColor=colors.red, strokeColor=None))
+        drawing.add(Ellipse(35, 5, 4, 3, fillColor=colors.red, strokeColor=None))
+        image = rasterize_drawing(drawing, 40)
+        for left in (0, 10, 20, 30):
+            with self.subTest(left=left):
+                self.assertIn((255, 0, 0), image.crop((left, 0, left + 10, 10)).getdata())
+
+        drawing.add(ImageShape(0, 0, 10, 10, 'board.png'))
+        with self.assertRaises(TypeError):
+            rasterize_drawing(drawing, 40)
+
+
+class CoalescingTests(SimpleTestCase):
+    def start(self, coalescer, key, render, results):
+        thread = threading.Thread(target=lambda: results.append(coalescer.run(key, render)))
+        thread.start()
+        self.addCleanup(thread.join)
+        return thread
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def test_identical_renders_share_one_call(self):
+        coalescer = RenderCoalescer()
+        release = threading.Event()
+        render = mock.Mock(side_effect=lambda: release.wait() and b'%PDF')
+        results = []
+        threads = [self.start(coalescer, 'key', render, results)]
+        self.wait_for(lambda: render.called)
+        threads += [self.start(coalescer, 'key', render, results) for _ in range(3)]
+        self.wait_for(lambda: coalescer.info()['waiting'] == 3)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(sorted(results), [(b'%PDF', False)] + [(b'%PDF', True)] * 3)
+        self.assertEqual(coalescer.info(), {'in_flight': 0, 'waiting': 0})
+        # Later requests render again.
+        self.assertEqual(coalescer.run('key', lambda: b'%PDF-2'), (b'%PDF-2', False))
+
+    def test_waiting_requests_receive_the_error(self):
+        coalescer = RenderCoalescer()
+        release = threading.Event()
+
+        def render():
+            release.wait()
+            raise RenderTimeout("Too slow")
+
+        errors = []
+
+        def run():
+            try:
+                coalescer.run('key', render)
+            except RenderTimeout as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run) for _ in range(2)]
+        threads[0].start()
+        self.wait_for(lambda: coalescer.info()['in_flight'] == 1)
+        threads[1].start()
+        self.wait_for(lambda: coalescer.info()['waiting'] == 1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 2)
+
+    def test_renders_are_coalesced_across_workers(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # Two coalescers on the same directory stand for two worker processes.
+        first_worker = RenderCoalescer(directory.name, poll_interval=0.01)
+        second_worker = RenderCoalescer(directory.name, poll_interval=0.01)
+        release = threading.Event()
+        first_render = mock.Mock(side_effect=lambda: release.wait() and b'%PDF')
+        second_render = mock.Mock(return_value=b'%PDF-other')
+        results = []
+        first = self.start(first_worker, 'key', first_render, results)
+        self.wait_for(lambda: first_render.called)
+        second = self.start(second_worker, 'key', second_render, results)
+        time.sleep(0.2)
+        release.set()
+        first.join()
+        second.join()
+        second_render.assert_not_called()
+        self.assertEqual(sorted(results), [(b'%PDF', False), (b'%PDF', True)])
+        # A request arriving after the render renders again, even while the result file is kept.
+        self.assertEqual(second_worker.run('key', second_render), (b'%PDF-other', False))
+
+    def test_api_requests_share_one_render(self):
+        get_result_cache().clear()
+        release = threading.Event()
+        payload = {'fens': [START_FEN], 'diagrams_per_page': 1}
+        responses = []
+
+        def post():
+            responses.append(Client().post(reverse('generate-pdf'), payload, content_type='application/json'))
+
+        coalesced_before = registry.counters['renders_coalesced']
+        with mock.patch('diagram.pdf_service.create_pdf_from_fens',
+                        side_effect=lambda **kwargs: release.wait() and b'%PDF') as create_pdf:
+            threads = [threading.Thread(target=post) for _ in range(3)]
+            threads[0].start()
+            self.wait_for(lambda: create_pdf.called)
+            for thread in threads[1:]:
+                thread.start()
+            self.wait_for(lambda: get_render_coalescer().info()['waiting'] == 2)
+            release.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(create_pdf.call_count, 1)
+        self.assertEqual([(response.status_code, response.content) for response in responses], [(200, b'%PDF')] * 3)
+        self.assertEqual(registry.counters['renders_coalesced'] - coalesced_before, 2)
+
+
+class RenderDiagramsCommandTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def read(self, name):
+        with open(os.path.join(self.directory, name), 'rb') as f:
+            return f.read()
+
+    def test_renders_each_input_into_a_pdf(self):
+        fens = self.write('openings.fen', f"{START_FEN}\n\n{json.dumps({'fen': BLACK_TO_MOVE_FEN})}\n")
+        rows = self.write('book.csv', f'fen,description\n{START_FEN},"Start, position"\n')
+        stdout = io.StringIO()
+        call_command('render_diagrams', fens, rows, '--output-dir', os.path.join(self.directory, 'pdf'),
+                     '--renderer', 'native', '--diagrams-per-page', '1', stdout=stdout)
+        self.assertIn('2 of 2 documents, 3 diagrams', stdout.getvalue())
+        self.assertEqual(len(PdfFile(self.read('pdf/openings.pdf')).page_numbers()), 2)
+        self.assertIn(b'Start, position', b''.join(PdfFile(self.read('pdf/book.pdf')).page_contents()))
+
+    def test_invalid_inputs_fail_without_output(self):
+        path = self.write('broken.fen', f"{START_FEN}\nnot a fen\n")
+        stderr = io.StringIO()
+        with self.assertRaises(CommandError):
+            call_command('render_diagrams', path, '--renderer', 'native', stdout=io.StringIO(), stderr=stderr)
+        self.assertIn('item 1', stderr.getvalue())
+        self.assertEqual(os.listdir(self.directory), ['broken.fen'])
+
+    def test_unexpected_errors_only_fail_their_document(self):
+        first = self.write('first.fen', START_FEN)
+        second = self.write('second.fen', BLACK_TO_MOVE_FEN)
+        stderr = io.StringIO()
+
+        def create(fens, **kwargs):
+            if kwargs['output'].name.endswith('first.pdf.part'):
+                raise RuntimeError("boom")
+            return create_pdf_from_fens(fens, **kwargs)
+
+        with mock.patch('diagram.pdf_service.create_pdf_from_fens', create), \
+                self.assertRaisesMessage(CommandError, '1 of 2 documents failed'):
+            call_command('render_diagrams', first, second, '--renderer', 'native',
+                         stdout=io.StringIO(), stderr=stderr)
+        self.assertIn('first.fen: RuntimeError: boom', stderr.getvalue())
+        self.assertEqual(sorted(os.listdir(self.directory)), ['first.fen', 'second.fen', 'second.pdf'])
+
+    def test_render_options_are_validated(self):
+        path = self.write('openings.fen', START_FEN)
+        with self.assertRaisesMessage(CommandError, 'output_mode must be one of'):
+            call_command('render_diagrams', path, '--output-mode', 'bitmap')
+        with self.assertRaisesMessage(CommandError, '--output is required'):
+            call_command('render_diagrams', '-')
+
+    def test_pool_options_are_passed_to_each_render(self):
+        path = self.write('openings.fen', START_FEN)
+        with mock.patch('diagram.pdf_service.create_pdf_from_fens', wraps=create_pdf_from_fens) as create, \
+                mock.patch.dict('diagram.parallel.PARALLEL_CONFIG') as config:
+            call_command('render_diagrams', path, '--renderer', 'native', '--parallel-boards', '--pool-size', '3',
+                         stdout=io.StringIO())
+            self.assertIsNone(config['pool_size'])
+        self.assertEqual(create.call_args.kwargs['pool_size'], 3)
+        self.assertIs(create.call_args.kwargs['parallel_boards'], True)
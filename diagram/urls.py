@@ -1,6 +1,24 @@
 from django.urls import path
-from .views import GeneratePdfApiView
+from .views import (
+    AsyncGeneratePdfView,
+    GenerateBatchApiView,
+    GeneratePdfApiView,
+    GeneratePgnPdfApiView,
+    MetricsApiView,
+    PreviewApiView,
+    RenderJobApiView,
+    RenderJobDownloadApiView,
+    RenderJobListApiView,
+)
 
 urlpatterns = [
     path('generate-pdf/', GeneratePdfApiView.as_view(), name='generate-pdf'),
+    path('generate-pdf/async/', AsyncGeneratePdfView.as_view(), name='generate-pdf-async'),
+    path('generate-pdf/batch/', GenerateBatchApiView.as_view(), name='generate-pdf-batch'),
+    path('generate-pdf/pgn/', GeneratePgnPdfApiView.as_view(), name='generate-pdf-pgn'),
+    path('preview/', PreviewApiView.as_view(), name='preview'),
+    path('jobs/', RenderJobListApiView.as_view(), name='render-jobs'),
+    path('jobs/<str:job_id>/', RenderJobApiView.as_view(), name='render-job'),
+    path('jobs/<str:job_id>/download/', RenderJobDownloadApiView.as_view(), name='render-job-download'),
+    path('metrics/', MetricsApiView.as_view(), name='metrics'),
 ]
@@ -1,28 +1,239 @@
 import logging
+import threading
+import time
+from collections import OrderedDict
 import chess
 import chess.svg
-from svglib.svglib import svg2rlg
+from svglib.svglib import svg2rlg, Svg2RlgAttributeConverter
 from io import StringIO
-from reportlab.graphics.shapes import Circle, Rect
+from reportlab.graphics import renderPDF, renderSVG
+from reportlab.graphics.renderbase import renderScaledDrawing
+from reportlab.graphics.shapes import (
+    Circle,
+    Drawing,
+    Ellipse,
+    Group,
+    Image,
+    Line,
+    Path,
+    Polygon,
+    PolyLine,
+    Rect,
+    String,
+    Wedge,
+)
 from reportlab.lib import colors
 
-from .config import CHESS_BOARD_CONFIG
+from .config import CHESS_BOARD_CONFIG, CACHE_CONFIG
+from .drawing_store import get_drawing_store, stores_renderer
+from .metrics import current_metrics
 
 logger = logging.getLogger(__name__)
 
-def fen_to_drawing(fen_string, board_colors=None, show_turn_indicator=False, show_coordinates=CHESS_BOARD_CONFIG['coordinates']):
+
+class DrawingCache:
     """
-    Converts a FEN string to a ReportLab Drawing object.
+    A bounded, thread-safe LRU cache of rendered board drawings.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            drawing = self._entries.get(key)
+            if drawing is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return drawing
+
+    def put(self, key, drawing):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = drawing
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._entries) > max(maxsize, 0):
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
+
+
+drawing_cache = DrawingCache(CACHE_CONFIG['drawing_cache_size'])
+
+class _SharedShapesRendering:
+    """
+    Dispatches the nodes of a drawing without the bookkeeping of reportlab's Renderer, which sets and
+    deletes `_canvas` and `_parent` on every node it draws. Shapes shared between drawings (cached boards,
+    piece and coordinate glyphs) are then only read, and can be drawn by several threads at once with
+    neither a lock nor a copy. Board drawings only hold plain shapes: no user nodes, derived values or
+    draw-time callbacks, which need that bookkeeping.
+    """
+    _methods = (
+        (Line, 'drawLine'), (Path, 'drawPath'), (String, 'drawString'), (Group, 'drawGroup'),
+        (Rect, 'drawRect'), (Image, 'drawImage'), (Circle, 'drawCircle'), (Ellipse, 'drawEllipse'),
+        (PolyLine, 'drawPolyLine'), (Polygon, 'drawPolygon'), (Wedge, 'drawWedge'),
+    )
+
+    def drawNodeDispatcher(self, node):
+        for shape_class, method in self._methods:
+            if isinstance(node, shape_class):
+                return getattr(self, method)(node)
+        raise TypeError(f"Unexpected element {node!r} in a shared drawing.")
+
+
+class _SharedShapesPDFRenderer(_SharedShapesRendering, renderPDF._PDFRenderer):
+    def drawGroup(self, group):
+        for node in group.getContents():
+            self.drawNode(node)
+
+
+class _SharedShapesSVGRenderer(_SharedShapesRendering, renderSVG._SVGRenderer):
+    pass
+
+
+def draw_shared_shapes(drawing, canvas, x, y):
+    """
+    Draws a Drawing whose shapes may be shared onto a PDF canvas, like renderPDF.draw.
+    """
+    _SharedShapesPDFRenderer().draw(renderScaledDrawing(drawing), canvas, x, y)
+
+
+def shared_shapes_to_svg(drawing):
+    """
+    Returns the SVG text of a Drawing whose shapes may be shared, like renderSVG.drawToString.
+    """
+    drawing = renderScaledDrawing(drawing)
+    canvas = renderSVG.SVGCanvas((drawing.width, drawing.height))
+    _SharedShapesSVGRenderer().draw(drawing, canvas, 0, 0)
+    output = StringIO()
+    canvas.save(output)
+    return output.getvalue()
+
+
+class SharedDrawing(Drawing):
+    """
+    A Drawing whose shapes are shared with the drawing cache. It is drawn with draw_shared_shapes,
+    so documents can be rendered from several threads at once.
+    """
+    def draw(self, showBoundary=None):
+        draw_shared_shapes(self, self.canv, 0, 0)
+
+
+def share_drawing(drawing):
+    """
+    Returns `drawing` as a SharedDrawing with the same shapes, ready to be put in the drawing cache;
+    copies of a SharedDrawing are SharedDrawings too.
+    """
+    return drawing._copy(SharedDrawing(drawing.width, drawing.height))
+
+
+def drawing_cache_key(board, colors_config, show_turn_indicator, show_coordinates, renderer='svg'):
+    """
+    Builds the normalized cache key for a board rendering.
+    Only the inputs that change the drawing are part of the key: the move counters,
+    castling rights and en passant square of the FEN are ignored.
+    """
+    return (
+        renderer,
+        board.board_fen(),
+        bool(show_turn_indicator and board.turn == chess.BLACK),
+        bool(show_coordinates),
+        tuple(sorted(colors_config.items())),
+    )
+
+
+def normalize_board_request(fen_string, board_colors, show_turn_indicator, show_coordinates, renderer):
     """
+    Parses a FEN string and merges the board colors over the defaults.
+    Returns the board, the merged colors and the drawing cache key.
+    """
+    if renderer not in RENDERERS:
+        raise ValueError(f"Unknown renderer '{renderer}', expected one of {', '.join(RENDERERS)}.")
+
     # Create a chess board from the FEN string
     board = chess.Board(fen_string)
 
     # Use provided colors merged over defaults to avoid missing keys
     base_colors = CHESS_BOARD_CONFIG['colors']
     colors_config = {**base_colors, **(board_colors or {})}
-    outline_color = colors_config.get('dark_squares')
+
+    key = drawing_cache_key(board, colors_config, show_turn_indicator, show_coordinates, renderer)
+    return board, colors_config, key
+
+
+def fen_to_drawing(fen_string, board_colors=None, show_turn_indicator=False, show_coordinates=CHESS_BOARD_CONFIG['coordinates'], renderer=CHESS_BOARD_CONFIG['renderer']):
+    """
+    Converts a FEN string to a ReportLab Drawing object.
+    `renderer` selects the rendering engine, one of RENDERERS ('svg' or 'native').
+    Drawings are served from the LRU cache when an identical board was already rendered, then from
+    the persistent drawing store when it is enabled (see drawing_store.py).
+    Renders and cache hits are counted in the metrics being collected, if any (see metrics.collect).
+    The returned Drawing is a copy with its own transform and size, so it can be scaled freely;
+    the shapes it contains are shared with the cache and must not be modified, and drawing them
+    elsewhere than through its drawOn must go through draw_shared_shapes or shared_shapes_to_svg.
+    """
+    board, colors_config, key = normalize_board_request(
+        fen_string, board_colors, show_turn_indicator, show_coordinates, renderer
+    )
+    metrics = current_metrics()
+    drawing = drawing_cache.get(key)
+    store = get_drawing_store() if drawing is None and stores_renderer(renderer) else None
+    if store is not None:
+        drawing = store.get(key)
+        if drawing is not None:
+            drawing = share_drawing(drawing)
+            drawing_cache.put(key, drawing)
+            if metrics is not None:
+                metrics.incr('drawing_store_hits')
+            return drawing.copy()
+
+    if drawing is None:
+        start = time.perf_counter()
+        rendered = RENDERERS[renderer](board, colors_config, show_turn_indicator, show_coordinates)
+        drawing = share_drawing(rendered)
+        drawing_cache.put(key, drawing)
+        if metrics is not None:
+            metrics.add_time('render', time.perf_counter() - start)
+            metrics.incr('boards_rendered')
+        if store is not None:
+            store.put(key, rendered)
+    elif metrics is not None:
+        metrics.incr('drawing_cache_hits')
+
+    return drawing.copy()
+
+
+def _board_to_svg_drawing(board, colors_config, show_turn_indicator, show_coordinates):
+    """
+    Renders a chess board to a ReportLab Drawing through python-chess SVG output and svglib.
+    """
     border_color = colors_config.get('border_color')
-    
+
     # Generate an SVG string of the board
     svg_board = chess.svg.board(
         board=board,
@@ -43,7 +254,7 @@ def fen_to_drawing(fen_string, board_colors=None, show_turn_indicator=False, sho
                            r'\g<1>' + border_color + r'\2',
                            svg_board,
                            count=1)
-    
+
     # If there's no coordinates, we'll draw the desired
     # border at the Drawing level to avoid brittle SVG regex manipulation.
 
@@ -53,6 +264,122 @@ def fen_to_drawing(fen_string, board_colors=None, show_turn_indicator=False, sho
     # Convert the SVG file to a ReportLab Drawing object
     drawing = svg2rlg(svg_file)
 
+    _add_board_decorations(drawing, board, colors_config, show_turn_indicator, show_coordinates)
+    return drawing
+
+
+# Geometry used by chess.svg.board, in SVG user units.
+SQUARE_SIZE = chess.svg.SQUARE_SIZE
+COORDINATE_MARGIN = 15
+COORDINATE_SCALE = COORDINATE_MARGIN / chess.svg.MARGIN
+COORDINATE_OFFSET = int(SQUARE_SIZE - COORDINATE_SCALE * SQUARE_SIZE) // 2
+
+_color_converter = Svg2RlgAttributeConverter()
+
+
+def _parse_svg_glyph(fragment, width, height):
+    """
+    Converts an SVG fragment to a ReportLab Group expressed in SVG coordinates (y axis down).
+    """
+    svg = (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {height}" '
+        f'width="{width}" height="{height}">{fragment}</svg>'
+    )
+    drawing = svg2rlg(StringIO(svg))
+    # svglib wraps the content in a group flipping the y axis; keep what is inside it.
+    return Group(*drawing.contents[0].contents)
+
+
+def _load_piece_glyphs():
+    return {
+        symbol: _parse_svg_glyph(fragment, SQUARE_SIZE, SQUARE_SIZE)
+        for symbol, fragment in chess.svg.PIECES.items()
+    }
+
+
+def _load_coordinate_glyphs():
+    coord_color = CHESS_BOARD_CONFIG['coord']
+    return {
+        text: _parse_svg_glyph(
+            f'<g fill="{coord_color}" stroke="{coord_color}">{fragment}</g>',
+            SQUARE_SIZE, SQUARE_SIZE
+        )
+        for text, fragment in chess.svg.COORDS.items()
+    }
+
+
+# Piece and coordinate glyphs are parsed from the python-chess SVGs once and shared by every native drawing.
+PIECE_GLYPHS = _load_piece_glyphs()
+COORDINATE_GLYPHS = _load_coordinate_glyphs()
+
+
+def _place_glyph(glyph, x, y, scale=1):
+    return Group(glyph, transform=(scale, 0, 0, scale, x, y))
+
+
+def _board_to_native_drawing(board, colors_config, show_turn_indicator, show_coordinates):
+    """
+    Renders a chess board directly as ReportLab shapes, mirroring the output of the SVG renderer.
+    """
+    size = CHESS_BOARD_CONFIG['size']
+    margin = COORDINATE_MARGIN if show_coordinates else 0
+    full_size = 8 * SQUARE_SIZE + 2 * margin
+    scale = size / full_size
+
+    # Like svglib, the board content is laid out in SVG coordinates under a y-flipping transform.
+    content = Group(transform=(scale, 0, 0, -scale, 0, size))
+
+    if show_coordinates:
+        border_color = colors_config.get('border_color') or chess.svg.DEFAULT_COLORS['margin']
+        content.add(Rect(
+            margin / 2, margin / 2,
+            full_size - margin, full_size - margin,
+            fillColor=None,
+            strokeColor=_color_converter.convertColor(border_color),
+            strokeWidth=margin
+        ))
+        for file_index, file_name in enumerate(chess.FILE_NAMES):
+            x = file_index * SQUARE_SIZE + margin + COORDINATE_OFFSET
+            glyph = COORDINATE_GLYPHS[file_name]
+            content.add(_place_glyph(glyph, x, 1, COORDINATE_SCALE))
+            content.add(_place_glyph(glyph, x, full_size - margin, COORDINATE_SCALE))
+        for rank_index, rank_name in enumerate(chess.RANK_NAMES):
+            y = (7 - rank_index) * SQUARE_SIZE + margin + COORDINATE_OFFSET
+            glyph = COORDINATE_GLYPHS[rank_name]
+            content.add(_place_glyph(glyph, 0, y, COORDINATE_SCALE))
+            content.add(_place_glyph(glyph, full_size - margin, y, COORDINATE_SCALE))
+
+    light_color = _color_converter.convertColor(colors_config.get('light_squares'))
+    dark_color = _color_converter.convertColor(colors_config.get('dark_squares'))
+    for square in chess.SQUARES:
+        x = chess.square_file(square) * SQUARE_SIZE + margin
+        y = (7 - chess.square_rank(square)) * SQUARE_SIZE + margin
+        is_light = bool(chess.BB_LIGHT_SQUARES & chess.BB_SQUARES[square])
+        content.add(Rect(
+            x, y, SQUARE_SIZE, SQUARE_SIZE,
+            fillColor=light_color if is_light else dark_color,
+            strokeColor=None
+        ))
+
+    for square, piece in board.piece_map().items():
+        x = chess.square_file(square) * SQUARE_SIZE + margin
+        y = (7 - chess.square_rank(square)) * SQUARE_SIZE + margin
+        content.add(_place_glyph(PIECE_GLYPHS[piece.symbol()], x, y))
+
+    drawing = Drawing(size, size)
+    drawing.add(content)
+
+    _add_board_decorations(drawing, board, colors_config, show_turn_indicator, show_coordinates)
+    return drawing
+
+
+def _add_board_decorations(drawing, board, colors_config, show_turn_indicator, show_coordinates):
+    """
+    Adds the outline and the turn indicator shared by every rendering engine.
+    """
+    # Converted here as renderSVG (used by previews), unlike renderPDF, does not accept color strings.
+    outline_color = _color_converter.convertColor(colors_config.get('dark_squares'))
+
     # Add outline
 
     if not show_coordinates:
@@ -79,4 +406,9 @@ def fen_to_drawing(fen_string, board_colors=None, show_turn_indicator=False, sho
         )
         drawing.add(circle)
 
-    return drawing
+
+# Available board rendering engines, selectable per request.
+RENDERERS = {
+    'svg': _board_to_svg_drawing,
+    'native': _board_to_native_drawing,
+}
@@ -0,0 +1,153 @@
+import logging
+from array import array
+from collections.abc import Sequence
+
+import chess
+
+logger = logging.getLogger(__name__)
+
+# Number of invalid items detailed in a validation report; the total count is always given.
+MAX_REPORTED_ERRORS = 100
+
+
+class FenValidationError(ValueError):
+    """
+    Raised when some FEN items are invalid. `errors` lists them as {'index', 'fen', 'error'} dicts.
+    """
+    def __init__(self, errors, error_count):
+        super().__init__(f"{error_count} invalid FEN item(s).")
+        self.errors = errors
+        self.error_count = error_count
+
+
+class NormalizedFens(Sequence):
+    """
+    A validated list of FEN items stored compactly: every distinct position is kept once, in canonical
+    FEN form, and items refer to it through an array of indexes. Items are {'fen', 'description'} dicts
+    in input order, as accepted by create_pdf_from_fens; a slice is a NormalizedFens sharing the positions.
+    """
+    def __init__(self):
+        self.positions = []
+        self.position_indexes = array('I')
+        self.descriptions = []
+
+    def __len__(self):
+        return len(self.position_indexes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            items = NormalizedFens()
+            items.positions = self.positions
+            items.position_indexes = self.position_indexes[index]
+            items.descriptions = self.descriptions[index]
+            return items
+        return {'fen': self.positions[self.position_indexes[index]], 'description': self.descriptions[index]}
+
+    def __iter__(self):
+        for position_index, description in zip(self.position_indexes, self.descriptions):
+            yield {'fen': self.positions[position_index], 'description': description}
+
+
+class InvalidFenItem:
+    """
+    An input item that could not be read as a FEN item, e.g. a malformed line of an upload (see ingest).
+    Validation reports it with `error`; `fen` is the text of the item, if any.
+    """
+    def __init__(self, error, fen=None):
+        self.error = error
+        self.fen = fen
+
+
+def _split_item(fen_item):
+    """
+    Returns the FEN and description of an item, and the error making it invalid before parsing, if any.
+    """
+    if isinstance(fen_item, InvalidFenItem):
+        return fen_item.fen, None, fen_item.error
+    # Support both dict objects with 'fen' and raw FEN strings
+    if isinstance(fen_item, dict):
+        fen = fen_item.get('fen')
+        description = fen_item.get('description')
+    else:
+        fen = fen_item
+        description = None
+
+    if not isinstance(fen, str):
+        return None, description, "Expected a FEN string or an object with a 'fen' string."
+    if description is not None and not isinstance(description, str):
+        return fen, None, "description must be a string."
+    return fen, description, None
+
+
+def validate_fens(fens):
+    """
+    Validates and normalizes a list of FEN items (FEN strings or {'fen', 'description'} dicts) in one pass,
+    before any rendering work. Each distinct FEN string is parsed once.
+    Returns a NormalizedFens, or raises FenValidationError reporting every invalid item by index.
+    """
+    normalized = NormalizedFens()
+    position_index_by_fen = {}
+    position_index_by_canonical = {}
+    parse_errors = {}
+    errors = []
+    error_count = 0
+
+    for index, fen_item in enumerate(fens):
+        fen, description, error = _split_item(fen_item)
+        if error is None and fen not in position_index_by_fen and fen not in parse_errors:
+            try:
+                canonical = chess.Board(fen).fen()
+            except ValueError as e:
+                parse_errors[fen] = str(e) or "Invalid FEN."
+            else:
+                if canonical not in position_index_by_canonical:
+                    position_index_by_canonical[canonical] = len(normalized.positions)
+                    normalized.positions.append(canonical)
+                position_index_by_fen[fen] = position_index_by_canonical[canonical]
+
+        if error is None:
+            error = parse_errors.get(fen)
+
+        if error is not None:
+            error_count += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({'index': index, 'fen': fen, 'error': error})
+            continue
+
+        if not error_count:
+            normalized.position_indexes.append(position_index_by_fen[fen])
+            normalized.descriptions.append(description or None)
+
+    if error_count:
+        raise FenValidationError(errors, error_count)
+    return normalized
+
+
+def iter_validated_fens(fens):
+    """
+    Validates FEN items as they are consumed and yields them as {'fen', 'description'} dicts in canonical
+    FEN form, for inputs too large to be held in memory (see ingest). Nothing is kept per item, so memory
+    does not depend on the number of items.
+    Nothing more is yielded after an invalid item, but the input is read to its end so that the
+    FenValidationError raised then reports every invalid item by index, as validate_fens does.
+    """
+    errors = []
+    error_count = 0
+
+    for index, fen_item in enumerate(fens):
+        fen, description, error = _split_item(fen_item)
+        if error is None:
+            try:
+                canonical = chess.Board(fen).fen()
+            except ValueError as e:
+                error = str(e) or "Invalid FEN."
+
+        if error is not None:
+            error_count += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({'index': index, 'fen': fen, 'error': error})
+        elif not error_count:
+            yield {'fen': canonical, 'description': description or None}
+
+    if error_count:
+        raise FenValidationError(errors, error_count)
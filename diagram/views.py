@@ -1,63 +1,307 @@
+import io
+import json
 import logging
-from django.http import HttpResponse
+import tempfile
+from contextlib import ExitStack
+from itertools import chain
+from asgiref.sync import sync_to_async
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.decorators import method_decorator
+from django.utils.http import parse_etags
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import TemplateView
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 
-from .pdf_service import create_pdf_from_fens
+from .config import BATCH_CONFIG, CHESS_BOARD_CONFIG, DRAFT_CONFIG, METRICS_CONFIG, PDF_CONFIG, PREVIEW_CONFIG
+from .coalescing import get_render_coalescer
+from .jobs import FINISHED, PENDING_STATUSES, get_job_manager
+from .metrics import collect, profile_call, prometheus_text
+from .result_cache import get_result_cache, request_key
+
+# The render stack (pdf_service, utils, pgn, preview, validation) is imported inside the views that use it,
+# so loading the URLconf, e.g. for management commands, does not import reportlab, svglib and python-chess.
+# Server processes preload it through DiagramConfig.ready (see startup.warm_up).
 
 logger = logging.getLogger(__name__)
 
+class InvalidRenderRequest(Exception):
+    """
+    Raised when a render payload is invalid; the message and details are returned to the client as a 400.
+    """
+    def __init__(self, message, details=None):
+        super().__init__(message)
+        self.details = details or {}
+
+
+# The error helpers build DRF Responses; plain Django views (see AsyncGeneratePdfView) pass JsonResponse.
+
+def _bad_request(error, response_class=Response):
+    return response_class({"error": str(error), **error.details}, status=status.HTTP_400_BAD_REQUEST)
+
+
+def _rejected(error, metrics, response_class=Response):
+    """
+    Returns the response to a request refused by admission control (see admission.AdmissionRejected).
+    """
+    metrics.incr('admission_rejected')
+    response = response_class({"error": str(error)}, status=error.status)
+    if error.retry_after is not None:
+        response['Retry-After'] = str(error.retry_after)
+    return response
+
+
+def _render_timed_out(metrics, response_class=Response):
+    metrics.incr('render_timeouts')
+    return response_class(
+        {"error": "The PDF took too long to render; submit large documents to /api/jobs/ instead."},
+        status=status.HTTP_504_GATEWAY_TIMEOUT
+    )
+
+
+def _boolean(value):
+    """
+    Reads the strings 'true' and 'false' of form data and query parameters as booleans.
+    """
+    if isinstance(value, str) and value.lower() in ('true', 'false'):
+        return value.lower() == 'true'
+    return value
+
+
+def _form_payload(data):
+    """
+    Converts multipart form data to a payload dict, reading 'true' and 'false' as booleans.
+    """
+    return {key: _boolean(value) for key, value in data.items()}
+
+
+def _query_payload(query_params):
+    """
+    Converts query parameters to a payload dict like _form_payload, reading the object options as JSON.
+    """
+    payload = _form_payload(query_params)
+    for key in ('padding', 'board_colors', 'columns_for_diagrams_per_page'):
+        if isinstance(payload.get(key), str):
+            try:
+                payload[key] = json.loads(payload[key])
+            except ValueError:
+                raise InvalidRenderRequest(f"{key} must be a JSON object.")
+    return payload
+
+
+def parse_render_options(data):
+    """
+    Validates the layout and style fields of a render payload and returns the create_pdf_from_fens options.
+    """
+    from .pdf_service import LAYOUT_ENGINES, OUTPUT_MODES
+    from .utils import RENDERERS
+
+    diagrams_per_page = data.get('diagrams_per_page', 1)
+    padding = data.get('padding')
+    board_colors = data.get('board_colors')
+    columns_for_diagrams_per_page = data.get('columns_for_diagrams_per_page')
+    title = data.get('title')
+    show_turn_indicator = data.get('show_turn_indicator', False)
+    show_page_numbers = data.get('show_page_numbers', False)
+    show_coordinates = data.get('show_coordinates', False)
+    renderer = data.get('renderer', CHESS_BOARD_CONFIG['renderer'])
+    output_mode = data.get('output_mode', PDF_CONFIG['output_mode'])
+    layout_engine = data.get('layout_engine', PDF_CONFIG['layout_engine'])
+
+    if not isinstance(renderer, str) or renderer not in RENDERERS:
+        raise InvalidRenderRequest(f"renderer must be one of: {', '.join(RENDERERS)}.")
+
+    if not isinstance(output_mode, str) or output_mode not in OUTPUT_MODES:
+        raise InvalidRenderRequest(f"output_mode must be one of: {', '.join(OUTPUT_MODES)}.")
+
+    if not isinstance(layout_engine, str) or layout_engine not in LAYOUT_ENGINES:
+        raise InvalidRenderRequest(f"layout_engine must be one of: {', '.join(LAYOUT_ENGINES)}.")
+
+    # The colors are part of the drawing cache keys, so they must be hashable strings.
+    if board_colors is not None and (
+        not isinstance(board_colors, dict)
+        or not all(isinstance(name, str) and isinstance(color, str) for name, color in board_colors.items())
+    ):
+        raise InvalidRenderRequest("board_colors must be an object mapping color names to color strings.")
+
+    try:
+        # Ensure diagrams_per_page is an integer
+        diagrams_per_page = int(diagrams_per_page)
+    except (ValueError, TypeError):
+        raise InvalidRenderRequest("diagrams_per_page must be an integer.")
+
+    if diagrams_per_page < 1:
+        raise InvalidRenderRequest("diagrams_per_page must be a positive integer.")
+
+    # The resolution is only part of the options of draft documents, so it does not change other cache keys.
+    draft_options = {}
+    if output_mode == 'draft':
+        draft_dpi = data.get('draft_dpi', DRAFT_CONFIG['dpi'])
+        if (isinstance(draft_dpi, bool) or not isinstance(draft_dpi, (int, float))
+                or not DRAFT_CONFIG['min_dpi'] <= draft_dpi <= DRAFT_CONFIG['max_dpi']):
+            raise InvalidRenderRequest(
+                f"draft_dpi must be a number between {DRAFT_CONFIG['min_dpi']} and {DRAFT_CONFIG['max_dpi']}."
+            )
+        draft_options['draft_dpi'] = draft_dpi
+
+    return dict(
+        diagrams_per_page=diagrams_per_page,
+        padding=padding,
+        board_colors=board_colors,
+        columns_for_diagrams_per_page=columns_for_diagrams_per_page,
+        title=title if title != '' else None,
+        show_turn_indicator=show_turn_indicator,
+        show_page_numbers=show_page_numbers,
+        show_coordinates=show_coordinates,
+        renderer=renderer,
+        output_mode=output_mode,
+        layout_engine=layout_engine,
+        **draft_options
+    )
+
+
+def parse_render_request(data):
+    """
+    Validates a generate-pdf payload and returns the FENs and the create_pdf_from_fens options.
+    Every FEN is checked up front (see validation.validate_fens), so invalid items are reported
+    by index before any rendering starts.
+    """
+    from .validation import FenValidationError, validate_fens
+
+    fens = data.get('fens')
+
+    if not fens or not isinstance(fens, list):
+        raise InvalidRenderRequest("FENs must be provided in a list.")
+
+    render_options = parse_render_options(data)
+
+    try:
+        fens = validate_fens(fens)
+    except FenValidationError as e:
+        raise InvalidRenderRequest(
+            "Some FENs are invalid.",
+            {"invalid_fens": e.errors, "invalid_count": e.error_count}
+        )
+
+    return fens, render_options
+
+
 class GeneratePdfApiView(APIView):
     """
     API View to generate a PDF from FEN strings.
+    Renders go through admission control (see admission.py): requests over the per-request cost get a 413,
+    requests over the process budget or finding no render slot a 429 or 503 with Retry-After, and
+    renders running past the render timeout are cancelled with a 504.
+    Identical requests rendered in memory at the same time share one render (see coalescing.py): the
+    waiting requests hold no render slot and receive the bytes, or the error, of the render they joined.
+    Responses carry a Server-Timing header with the stage durations and counters of the request.
+    With `stream`, or from PDF_CONFIG['stream_min_fens'] FENs, the PDF is spooled to a temporary file
+    rather than rendered in memory (see _spooled_response).
+    Staff users may set `profile` to receive a cProfile summary of the rendering instead of the PDF.
     """
     def post(self, request, *args, **kwargs):
-        
-        fens = request.data.get('fens')
-        diagrams_per_page = request.data.get('diagrams_per_page', 1)
-        padding = request.data.get('padding')
-        board_colors = request.data.get('board_colors')
-        columns_for_diagrams_per_page = request.data.get('columns_for_diagrams_per_page')
-        title = request.data.get('title')
-        show_turn_indicator = request.data.get('show_turn_indicator', False)
-        show_page_numbers = request.data.get('show_page_numbers', False)
-        show_coordinates = request.data.get('show_coordinates', False)
-
-
-        if not fens or not isinstance(fens, list):
-            return Response(
-                {"error": "FENs must be provided in a list."},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        with collect() as metrics:
+            with metrics.timer('total'):
+                response = self._generate(request, metrics)
+        if METRICS_CONFIG['server_timing']:
+            response['Server-Timing'] = metrics.server_timing()
+        return response
+
+    def _generate(self, request, metrics):
+        from .admission import AdmissionRejected, admit, check_request_cost, estimate_cost, render_deadline
+        from .ingest import INGEST_CONTENT_TYPES
+        from .pdf_service import RenderTimeout, create_pdf_from_fens
+
+        # Newline-delimited uploads are read as a stream, before DRF would parse the whole body.
+        if request.content_type.split(';')[0].strip().lower() in INGEST_CONTENT_TYPES:
+            return self._generate_from_upload(request, metrics)
+
+        stream = request.data.get('stream', False)
+        # Only a true value profiles, so 'false' or '0' from a form does not.
+        profile = _boolean(request.data.get('profile', False)) is True
+
+        if profile and not request.user.is_staff:
+            return Response({"error": "Profiling is restricted to staff users."}, status=status.HTTP_403_FORBIDDEN)
 
         try:
-            # Ensure diagrams_per_page is an integer
-            diagrams_per_page = int(diagrams_per_page)
-        except (ValueError, TypeError):
-            return Response(
-                {"error": "diagrams_per_page must be an integer."},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+            with metrics.timer('validate'):
+                fens, render_options = parse_render_request(request.data)
+        except InvalidRenderRequest as e:
+            return _bad_request(e)
+
+        cost = estimate_cost(fens, render_options)
+
+        if profile:
+            # Always render, bypassing the ETag and result cache, so the summary shows the real work.
+            try:
+                check_request_cost(cost)
+                with admit(cost):
+                    summary = profile_call(
+                        create_pdf_from_fens, fens=fens, deadline=render_deadline(), **render_options
+                    )
+            except AdmissionRejected as e:
+                return _rejected(e, metrics)
+            except RenderTimeout:
+                return _render_timed_out(metrics)
+            return HttpResponse(summary, content_type='text/plain; charset=utf-8')
+
+        # Identical requests render identical bytes, so the request hash is a strong ETag.
+        cache_key = request_key(fens, render_options)
+        etag = f'"{cache_key}"'
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match and (etag in parse_etags(if_none_match) or '*' in parse_etags(if_none_match)):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+            response['ETag'] = etag
+            return response
+
+        result_cache = get_result_cache()
+        pdf_data = None
+        if result_cache is not None:
+            with metrics.timer('result_cache'):
+                pdf_data = result_cache.get(cache_key)
+            metrics.incr('result_cache_misses' if pdf_data is None else 'result_cache_hits')
+        if pdf_data is not None:
+            response = HttpResponse(pdf_data, content_type='application/pdf')
+            response['Content-Disposition'] = 'attachment; filename="chess_diagrams.pdf"'
+            response['ETag'] = etag
+            return response
+
+        def render():
+            with admit(cost):
+                pdf_data = create_pdf_from_fens(fens=fens, deadline=render_deadline(), **render_options)
+            if result_cache is not None:
+                result_cache.set(cache_key, pdf_data)
+            return pdf_data
 
         try:
-            pdf_data = create_pdf_from_fens(
-                fens=fens,
-                diagrams_per_page=diagrams_per_page,
-                padding=padding,
-                board_colors=board_colors,
-                columns_for_diagrams_per_page=columns_for_diagrams_per_page,
-                title=title if title != '' else None,
-                show_turn_indicator=show_turn_indicator,
-                show_page_numbers=show_page_numbers,
-                show_coordinates=show_coordinates
-            )
+            check_request_cost(cost)
+            if stream or len(fens) >= PDF_CONFIG['stream_min_fens']:
+                with admit(cost):
+                    response = self._spooled_response(fens, render_options, cache_key, result_cache)
+                    response['ETag'] = etag
+                    return response
+
+            # Identical requests arriving while the document is rendered wait for that render.
+            coalescer = get_render_coalescer()
+            if coalescer is None:
+                pdf_data = render()
+            else:
+                pdf_data, coalesced = coalescer.run(cache_key, render)
+                if coalesced:
+                    metrics.incr('renders_coalesced')
 
             response = HttpResponse(pdf_data, content_type='application/pdf')
             response['Content-Disposition'] = 'attachment; filename="chess_diagrams.pdf"'
+            response['ETag'] = etag
 
             return response
+        except AdmissionRejected as e:
+            return _rejected(e, metrics)
+        except RenderTimeout:
+            return _render_timed_out(metrics)
         except Exception as e:
             # Log the exception e
             logger.error(f"Error generating PDF: {str(e)}", exc_info=True)
@@ -66,5 +310,481 @@ class GeneratePdfApiView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    def _generate_from_upload(self, request, metrics):
+        """
+        Renders a text/plain or NDJSON body, one FEN or {"fen", "description"} object per line, optionally
+        gzip-encoded, with the render options given as query parameters.
+        The body is decoded and validated line by line as the document is built (see ingest.iter_upload_fens),
+        so it is never held in memory as a whole; the document being built still grows with the number of FENs,
+        as ReportLab keeps its pages until it is saved. The PDF is always spooled (see _spooled_response) and,
+        as its key is only known once the body has been read, not cached. Invalid lines abort the render and
+        are reported by index as a 400.
+        """
+        from .admission import AdmissionRejected, admit, limit_cost
+        from .config import ADMISSION_CONFIG
+        from .ingest import CORRUPT_UPLOAD_ERRORS, UnsupportedEncoding, iter_upload_fens, open_upload
+        from .pdf_service import RenderTimeout
+        from .validation import FenValidationError
+
+        try:
+            render_options = parse_render_options(_query_payload(request.query_params))
+        except InvalidRenderRequest as e:
+            return _bad_request(e)
+
+        try:
+            handle = open_upload(request.stream or io.BytesIO(), request.headers.get('Content-Encoding'))
+        except UnsupportedEncoding as e:
+            return Response({"error": str(e)}, status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+        fens = iter_upload_fens(handle)
+        try:
+            first_fen = next(fens, None)
+            if first_fen is None:
+                return _bad_request(InvalidRenderRequest("The upload contains no FEN."))
+            # The size of the upload is unknown until it is read: reserve the largest request cost.
+            with admit(ADMISSION_CONFIG['max_request_cost']):
+                return self._spooled_response(limit_cost(chain([first_fen], fens), render_options), render_options)
+        except AdmissionRejected as e:
+            return _rejected(e, metrics)
+        except RenderTimeout:
+            return _render_timed_out(metrics)
+        except FenValidationError as e:
+            return _bad_request(InvalidRenderRequest(
+                "Some FENs are invalid.",
+                {"invalid_fens": e.errors, "invalid_count": e.error_count}
+            ))
+        except CORRUPT_UPLOAD_ERRORS:
+            return _bad_request(InvalidRenderRequest("The upload could not be decompressed."))
+        except Exception as e:
+            logger.error(f"Error generating PDF from upload: {str(e)}", exc_info=True)
+            return Response(
+                {"error": "An unexpected error occurred while generating the PDF."},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+    def _spooled_response(self, fens, render_options, cache_key=None, result_cache=None):
+        """
+        Renders the whole PDF into a spooled temporary file, then returns it as a FileResponse sent in chunks.
+        Nothing is sent before the render has finished. The spool avoids a second in-memory copy of the output:
+        a large PDF spills to disk instead of being copied into bytes, while the render itself still holds the
+        whole document in memory. The response has a Content-Length.
+        """
+        from .admission import render_deadline
+        from .pdf_service import create_pdf_from_fens
+
+        pdf_file = tempfile.SpooledTemporaryFile(max_size=PDF_CONFIG['spool_max_size'])
+        try:
+            create_pdf_from_fens(fens=fens, output=pdf_file, deadline=render_deadline(), **render_options)
+            if result_cache is not None:
+                size = pdf_file.tell()
+                pdf_file.seek(0)
+                result_cache.set_file(cache_key, pdf_file, size)
+        except Exception:
+            pdf_file.close()
+            raise
+        pdf_file.seek(0)
+        # FileResponse closes the file once the last chunk has been sent.
+        return FileResponse(
+            pdf_file,
+            as_attachment=True,
+            filename='chess_diagrams.pdf',
+            content_type='application/pdf'
+        )
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncGeneratePdfView(View):
+    """
+    Async variant of GeneratePdfApiView for ASGI deployments, taking the same JSON payload.
+    The payload is validated on the event loop and create_pdf_from_fens runs in the render executor
+    (see executor.py), so a render ties up an executor worker instead of the event loop or a request
+    thread. Renders go through the same admission control, ETag and result cache, and the PDF is
+    returned in one piece: large documents belong to /api/jobs/.
+    Like DRF views, it is exempt from CSRF checks.
+    """
+    async def post(self, request, *args, **kwargs):
+        with collect() as metrics:
+            with metrics.timer('total'):
+                response = await self._generate(request, metrics)
+        if METRICS_CONFIG['server_timing']:
+            response['Server-Timing'] = metrics.server_timing()
+        return response
+
+    async def _generate(self, request, metrics):
+        from .admission import AdmissionRejected, admit_async, check_request_cost, estimate_cost, render_deadline
+        from .executor import run_render
+        from .pdf_service import RenderTimeout
+
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            return JsonResponse({"error": "The body must be a JSON object."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            with metrics.timer('validate'):
+                fens, render_options = parse_render_request(data)
+        except InvalidRenderRequest as e:
+            return _bad_request(e, JsonResponse)
+
+        cache_key = request_key(fens, render_options)
+        etag = f'"{cache_key}"'
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match and (etag in parse_etags(if_none_match) or '*' in parse_etags(if_none_match)):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+            response['ETag'] = etag
+            return response
+
+        result_cache = get_result_cache()
+        pdf_data = None
+        if result_cache is not None:
+            with metrics.timer('result_cache'):
+                pdf_data = await sync_to_async(result_cache.get, thread_sensitive=False)(cache_key)
+            metrics.incr('result_cache_misses' if pdf_data is None else 'result_cache_hits')
+
+        if pdf_data is None:
+            cost = estimate_cost(fens, render_options)
+            try:
+                check_request_cost(cost)
+                async with admit_async(cost):
+                    pdf_data = await run_render(fens, render_options, render_deadline())
+            except AdmissionRejected as e:
+                return _rejected(e, metrics, JsonResponse)
+            except RenderTimeout:
+                return _render_timed_out(metrics, JsonResponse)
+            except Exception as e:
+                logger.error(f"Error generating PDF: {str(e)}", exc_info=True)
+                return JsonResponse(
+                    {"error": "An unexpected error occurred while generating the PDF."},
+                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                )
+            if result_cache is not None:
+                await sync_to_async(result_cache.set, thread_sensitive=False)(cache_key, pdf_data)
+
+        response = HttpResponse(pdf_data, content_type='application/pdf')
+        response['Content-Disposition'] = 'attachment; filename="chess_diagrams.pdf"'
+        response['ETag'] = etag
+        return response
+
+def parse_batch_request(data):
+    """
+    Validates a batch payload and returns a (filename, fens, render_options) tuple per document.
+    `documents` lists the document specs, each a generate-pdf payload with an optional `name`;
+    the other fields of the batch payload are defaults for every document.
+    Every document is validated up front and the invalid ones are reported by index.
+    """
+    from .batch import document_filenames
+
+    documents = data.get('documents')
+    if not documents or not isinstance(documents, list):
+        raise InvalidRenderRequest("documents must be a non-empty list of document specs.")
+    if len(documents) > BATCH_CONFIG['max_documents']:
+        raise InvalidRenderRequest(f"A batch may contain at most {BATCH_CONFIG['max_documents']} documents.")
+
+    defaults = {key: value for key, value in data.items() if key != 'documents'}
+    parsed = []
+    errors = []
+    for index, spec in enumerate(documents):
+        if not isinstance(spec, dict):
+            errors.append({'index': index, 'error': "A document spec must be an object."})
+            continue
+        try:
+            fens, render_options = parse_render_request({**defaults, **spec})
+        except InvalidRenderRequest as e:
+            errors.append({'index': index, 'error': str(e), **e.details})
+            continue
+        parsed.append((spec.get('name'), fens, render_options))
+
+    if errors:
+        raise InvalidRenderRequest("Some documents are invalid.", {"invalid_documents": errors})
+
+    filenames = document_filenames([name for name, _fens, _render_options in parsed])
+    return [(filename, fens, render_options) for filename, (_name, fens, render_options) in zip(filenames, parsed)]
+
+
+class GenerateBatchApiView(APIView):
+    """
+    API View rendering several documents in one request and streaming back a ZIP of their PDFs,
+    each added as soon as it is rendered (see batch.BatchZipStream and parse_batch_request).
+    The batch is admitted as one request of the total cost of its documents, and shares one deadline.
+    """
+    def post(self, request, *args, **kwargs):
+        with collect() as metrics:
+            with metrics.timer('total'):
+                response = self._generate(request, metrics)
+        if METRICS_CONFIG['server_timing']:
+            response['Server-Timing'] = metrics.server_timing()
+        return response
+
+    def _generate(self, request, metrics):
+        from .admission import AdmissionRejected, admit, check_request_cost, estimate_cost, render_deadline
+        from .batch import BatchZipStream
+
+        try:
+            with metrics.timer('validate'):
+                documents = parse_batch_request(request.data)
+        except InvalidRenderRequest as e:
+            return _bad_request(e)
+
+        cost = sum(estimate_cost(fens, render_options) for _filename, fens, render_options in documents)
+        # The render slot is held until the ZIP stream is closed.
+        admission = ExitStack()
+        try:
+            check_request_cost(cost)
+            admission.enter_context(admit(cost))
+        except AdmissionRejected as e:
+            return _rejected(e, metrics)
+
+        stream = BatchZipStream(documents, deadline=render_deadline(), on_close=admission.close)
+        response = StreamingHttpResponse(stream, content_type='application/zip')
+        response['Content-Disposition'] = 'attachment; filename="chess_diagrams.zip"'
+        return response
+
+
+class MetricsApiView(APIView):
+    """
+    API View exposing the rendering metrics of this worker process in the Prometheus text format.
+    """
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(prometheus_text(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def parse_pgn_selectors(data):
+    """
+    Validates the position selectors of a PGN payload and returns the pgn.iter_pgn_diagrams options.
+    """
+    every_ply = data.get('every_ply')
+    after_moves = data.get('after_moves') or []
+    comments = data.get('comments', False)
+
+    if every_ply is not None:
+        try:
+            every_ply = int(every_ply)
+        except (ValueError, TypeError):
+            raise InvalidRenderRequest("every_ply must be an integer.")
+        if every_ply < 1:
+            raise InvalidRenderRequest("every_ply must be a positive integer.")
+
+    if isinstance(after_moves, str):
+        # Form fields carry the move numbers as a comma separated list
+        after_moves = [move for move in after_moves.split(',') if move.strip()]
+    try:
+        after_moves = [int(move) for move in after_moves]
+    except (ValueError, TypeError):
+        raise InvalidRenderRequest("after_moves must be a list of move numbers.")
+    if any(move < 1 for move in after_moves):
+        raise InvalidRenderRequest("after_moves must contain positive move numbers.")
+
+    return dict(every_ply=every_ply, after_moves=after_moves, comments=bool(comments))
+
+
+class GeneratePgnPdfApiView(GeneratePdfApiView):
+    """
+    API View to generate a PDF from the games of a PGN, uploaded as a `pgn` file or sent as a `pgn` string,
+    with the layout options of generate-pdf and the selectors of parse_pgn_selectors.
+    Games are read and rendered one at a time, so the PDF is always spooled (see _spooled_response)
+    and not cached.
+    """
+    def _generate(self, request, metrics):
+        from .admission import AdmissionRejected, admit, limit_cost
+        from .config import ADMISSION_CONFIG
+        from .pdf_service import RenderTimeout
+        from .pgn import iter_pgn_diagrams
+
+        data = request.data
+        if hasattr(data, 'getlist'):
+            data = _form_payload(data)
+
+        try:
+            upload = request.FILES.get('pgn')
+            if upload is not None:
+                handle = io.TextIOWrapper(upload.file, encoding='utf-8-sig', errors='replace')
+            elif isinstance(data.get('pgn'), str) and data['pgn'].strip():
+                handle = io.StringIO(data['pgn'])
+            else:
+                raise InvalidRenderRequest("A PGN must be uploaded as a 'pgn' file or sent as a 'pgn' string.")
+            selectors = parse_pgn_selectors(data)
+            render_options = parse_render_options(data)
+        except InvalidRenderRequest as e:
+            return _bad_request(e)
+
+        diagrams = iter_pgn_diagrams(handle, **selectors)
+        try:
+            first_diagram = next(diagrams, None)
+            if first_diagram is None:
+                return _bad_request(InvalidRenderRequest("No position of the PGN matches the selectors."))
+            # The number of positions is unknown until the PGN is read: reserve the largest request cost.
+            with admit(ADMISSION_CONFIG['max_request_cost']):
+                return self._spooled_response(limit_cost(chain([first_diagram], diagrams), render_options),
+                                                render_options)
+        except AdmissionRejected as e:
+            return _rejected(e, metrics)
+        except RenderTimeout:
+            return _render_timed_out(metrics)
+        except Exception as e:
+            logger.error(f"Error generating PDF from PGN: {str(e)}", exc_info=True)
+            return Response(
+                {"error": "An unexpected error occurred while generating the PDF."},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+class PreviewApiView(APIView):
+    """
+    API View returning a small PNG or SVG image of the first page (`preview`: 'page') or of the
+    diagram at `index` (`preview`: 'diagram') of a generate-pdf payload, `width` pixels wide.
+    Only the FENs shown are validated and rendered, and images are cached in memory.
+    """
+    def post(self, request, *args, **kwargs):
+        from .preview import (
+            PREVIEW_FORMATS,
+            diagram_preview_drawing,
+            page_preview_drawing,
+            preview_cache,
+            render_preview,
+        )
+        from .validation import FenValidationError, validate_fens
+
+        data = request.data
+        fens = data.get('fens')
+        kind = data.get('preview', 'page')
+        image_format = data.get('format', 'png')
+        width = data.get('width', PREVIEW_CONFIG['default_width'])
+        index = data.get('index', 0)
+
+        try:
+            if not fens or not isinstance(fens, list):
+                raise InvalidRenderRequest("FENs must be provided in a list.")
+            if kind not in ('page', 'diagram'):
+                raise InvalidRenderRequest("preview must be 'page' or 'diagram'.")
+            if not isinstance(image_format, str) or image_format not in PREVIEW_FORMATS:
+                raise InvalidRenderRequest(f"format must be one of: {', '.join(PREVIEW_FORMATS)}.")
+            try:
+                width = int(width)
+                index = int(index)
+            except (ValueError, TypeError):
+                raise InvalidRenderRequest("width and index must be integers.")
+            if not 16 <= width <= PREVIEW_CONFIG['max_width']:
+                raise InvalidRenderRequest(f"width must be between 16 and {PREVIEW_CONFIG['max_width']}.")
+            if not 0 <= index < len(fens):
+                raise InvalidRenderRequest("index must point to one of the FENs.")
+
+            render_options = parse_render_options(data)
+            if kind == 'page':
+                shown = fens[:render_options['diagrams_per_page']]
+            else:
+                shown = [fens[index]]
+            try:
+                shown = list(validate_fens(shown))
+            except FenValidationError as e:
+                raise InvalidRenderRequest(
+                    "Some FENs are invalid.",
+                    {"invalid_fens": e.errors, "invalid_count": e.error_count}
+                )
+        except InvalidRenderRequest as e:
+            return _bad_request(e)
+
+        cache_key = request_key(shown, {**render_options, 'preview': kind, 'format': image_format, 'width': width})
+        image = preview_cache.get(cache_key)
+        if image is None:
+            try:
+                if kind == 'page':
+                    drawing = page_preview_drawing(shown, **render_options)
+                else:
+                    drawing = diagram_preview_drawing(
+                        shown[0]['fen'],
+                        render_options['board_colors'],
+                        render_options['show_turn_indicator'],
+                        render_options['show_coordinates'],
+                        render_options['renderer']
+                    )
+                image = render_preview(drawing, width, image_format)
+            except Exception as e:
+                logger.error(f"Error generating preview: {str(e)}", exc_info=True)
+                return Response(
+                    {"error": "An unexpected error occurred while generating the preview."},
+                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                )
+            preview_cache.put(cache_key, image)
+
+        return HttpResponse(image, content_type=PREVIEW_FORMATS[image_format])
+
+def _job_payload(request, job):
+    payload = job.to_dict()
+    payload['status_url'] = request.build_absolute_uri(reverse('render-job', args=[job.id]))
+    if job.status == FINISHED:
+        payload['download_url'] = request.build_absolute_uri(reverse('render-job-download', args=[job.id]))
+    return payload
+
+
+class RenderJobListApiView(APIView):
+    """
+    API View to start an asynchronous render job; accepts the generate-pdf payload.
+    Jobs costing more than JOB_CONFIG['max_cost'] get a 413 (see admission.check_job_cost).
+    """
+    def post(self, request, *args, **kwargs):
+        from .admission import AdmissionRejected, check_job_cost, estimate_cost
+
+        try:
+            fens, render_options = parse_render_request(request.data)
+        except InvalidRenderRequest as e:
+            return _bad_request(e)
+
+        try:
+            check_job_cost(estimate_cost(fens, render_options))
+        except AdmissionRejected as e:
+            return Response({"error": str(e)}, status=e.status)
+
+        job = get_job_manager().submit(fens, render_options)
+        response = Response(_job_payload(request, job), status=status.HTTP_202_ACCEPTED)
+        response['Location'] = reverse('render-job', args=[job.id])
+        return response
+
+
+class RenderJobApiView(APIView):
+    """
+    API View returning the status and progress of a render job (GET) or cancelling it (DELETE).
+    Deleting a job that is no longer pending discards its PDF.
+    """
+    def get(self, request, job_id, *args, **kwargs):
+        job = get_job_manager().get(job_id)
+        if job is None:
+            return Response({"error": "Unknown or expired job."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(_job_payload(request, job))
+
+    def delete(self, request, job_id, *args, **kwargs):
+        manager = get_job_manager()
+        job = manager.get(job_id)
+        if job is None:
+            return Response({"error": "Unknown or expired job."}, status=status.HTTP_404_NOT_FOUND)
+        if job.status in PENDING_STATUSES:
+            job = manager.cancel(job_id)
+            return Response(_job_payload(request, job), status=status.HTTP_202_ACCEPTED)
+        manager.delete(job_id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class RenderJobDownloadApiView(APIView):
+    """
+    API View serving the PDF of a finished render job.
+    """
+    def get(self, request, job_id, *args, **kwargs):
+        job = get_job_manager().get(job_id)
+        if job is None:
+            return Response({"error": "Unknown or expired job."}, status=status.HTTP_404_NOT_FOUND)
+        if job.status != FINISHED:
+            return Response(
+                {"error": f"Job is {job.status}, the PDF is not available."},
+                status=status.HTTP_409_CONFLICT
+            )
+        try:
+            pdf_file = open(job.path, 'rb')
+        except FileNotFoundError:
+            return Response({"error": "Unknown or expired job."}, status=status.HTTP_404_NOT_FOUND)
+        return FileResponse(
+            pdf_file,
+            as_attachment=True,
+            filename='chess_diagrams.pdf',
+            content_type='application/pdf'
+        )
+
 class ReactAppView(TemplateView):
     template_name = 'index.html'
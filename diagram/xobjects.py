@@ -0,0 +1,108 @@
+import hashlib
+import logging
+import chess
+from reportlab.graphics.shapes import Drawing, Group
+from reportlab.lib import colors
+from reportlab.platypus import Flowable
+
+from .config import CHESS_BOARD_CONFIG
+from .utils import (
+    COORDINATE_MARGIN,
+    PIECE_GLYPHS,
+    SQUARE_SIZE,
+    _board_to_native_drawing,
+    draw_shared_shapes,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def board_form_name(colors_config, show_coordinates):
+    """
+    Returns the Form XObject name of the empty board background for a color scheme.
+    """
+    key = repr((bool(show_coordinates), tuple(sorted(colors_config.items()))))
+    return 'DiagramBoard' + hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+def piece_form_name(symbol):
+    """
+    Returns the Form XObject name of a piece glyph, e.g. 'DiagramPiecewN' for a white knight.
+    """
+    return 'DiagramPiece' + ('w' if symbol.isupper() else 'b') + symbol.upper()
+
+
+def _define_board_form(canv, name, colors_config, show_coordinates):
+    size = CHESS_BOARD_CONFIG['size']
+    drawing = _board_to_native_drawing(chess.Board(None), colors_config, False, show_coordinates)
+    canv.beginForm(name, 0, 0, size, size)
+    draw_shared_shapes(drawing, canv, 0, 0)  # The coordinate glyphs are shared
+    canv.endForm()
+
+
+def _define_piece_form(canv, name, symbol):
+    drawing = Drawing(SQUARE_SIZE, SQUARE_SIZE)
+    # Glyphs are stored in SVG coordinates, flip them into the form's y-up space.
+    drawing.add(Group(PIECE_GLYPHS[symbol], transform=(1, 0, 0, -1, 0, SQUARE_SIZE)))
+    canv.beginForm(name, 0, 0, SQUARE_SIZE, SQUARE_SIZE)
+    draw_shared_shapes(drawing, canv, 0, 0)
+    canv.endForm()
+
+
+class FormBoardFlowable(Flowable):
+    """
+    A chess diagram drawn from shared Form XObjects.
+    The empty board and each piece glyph are defined once per document, the first time
+    they are needed, and every diagram places them by reference. The geometry is the
+    one of the native renderer, so the output matches the vector diagrams.
+    """
+    def __init__(self, fen_string, size, board_colors=None, show_turn_indicator=False,
+                 show_coordinates=CHESS_BOARD_CONFIG['coordinates']):
+        super().__init__()
+        self.board = chess.Board(fen_string)
+        self.size = size
+        self.colors_config = {**CHESS_BOARD_CONFIG['colors'], **(board_colors or {})}
+        self.show_turn_indicator = show_turn_indicator
+        self.show_coordinates = show_coordinates
+        self.width = self.height = size
+
+    def wrap(self, availWidth, availHeight):
+        return self.size, self.size
+
+    def draw(self):
+        canv = self.canv
+        board_size = CHESS_BOARD_CONFIG['size']
+        margin = COORDINATE_MARGIN if self.show_coordinates else 0
+        square_scale = board_size / (8 * SQUARE_SIZE + 2 * margin)
+
+        board_name = board_form_name(self.colors_config, self.show_coordinates)
+        if not canv.hasForm(board_name):
+            _define_board_form(canv, board_name, self.colors_config, self.show_coordinates)
+
+        canv.saveState()
+        # Forms are defined at the native board size, scale them down to the diagram size.
+        canv.scale(self.size / board_size, self.size / board_size)
+        canv.doForm(board_name)
+
+        for square, piece in self.board.piece_map().items():
+            symbol = piece.symbol()
+            piece_name = piece_form_name(symbol)
+            if not canv.hasForm(piece_name):
+                _define_piece_form(canv, piece_name, symbol)
+            canv.saveState()
+            canv.translate(
+                square_scale * (chess.square_file(square) * SQUARE_SIZE + margin),
+                square_scale * (chess.square_rank(square) * SQUARE_SIZE + margin)
+            )
+            canv.scale(square_scale, square_scale)
+            canv.doForm(piece_name)
+            canv.restoreState()
+
+        if self.show_turn_indicator and self.board.turn == chess.BLACK:
+            # Same black circle as the one added to vector drawings
+            canv.setFillColor(colors.black)
+            canv.setStrokeColor(colors.white)
+            canv.setLineWidth(1)
+            canv.circle(board_size + 15, board_size - 10, 10, stroke=1, fill=1)
+
+        canv.restoreState()
@@ -0,0 +1,374 @@
+# -----------------------------------------------------------------------------
+# Chess Diagram PDF Stage Benchmark
+#
+# Description:
+#   Times each stage of the PDF pipeline separately, so a slowdown can be
+#   traced to the step that caused it:
+#     - board_parse:       chess.Board(fen)
+#     - svg_generation:    chess.svg.board(...)
+#     - svg2rlg:           SVG -> ReportLab Drawing conversion
+#     - paragraph_measure: PageGrid.description_paragraph(description)
+#     - table_layout:      building (PageGrid.page_table) and wrapping the per-page Tables
+#     - doc_build:         SimpleDocTemplate.build on the prepared story
+#     - end_to_end:        create_pdf_from_fens with cold drawing and page caches
+#   The board stages are measured once per number of diagrams, the layout
+#   stages once per (number of diagrams, diagrams_per_page) case.
+#   Peak memory of every stage is recorded in a second, traced run
+#   (tracemalloc slows the code down, so it never overlaps the timing run).
+#
+# Usage:
+#   Run from the project root directory:
+#     python tests/benchmark.py                       # full run, 10 to 10,000 diagrams
+#     python tests/benchmark.py --quick               # the sizes of the committed baseline
+#     python tests/benchmark.py --output results.json
+#     python tests/benchmark.py --quick --compare tests/benchmark_baseline.json
+#     python tests/benchmark.py --quick --output tests/benchmark_baseline.json  # record the baseline
+#   The baseline is only meaningful on the machine it was recorded on: record it
+#   there before a change and compare on the same machine after it. The
+#   committed tests/benchmark_baseline.json was recorded on a single-core Linux
+#   machine, see its environment block.
+#   With --compare, the script exits with status 1 when a stage is slower than
+#   the baseline by more than --tolerance, or uses more memory by more than
+#   --memory-tolerance (peaks under 1 MB are not compared). Record the baseline
+#   with the options the comparison runs with (--quick, default --repeat).
+#
+# -----------------------------------------------------------------------------
+
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from io import BytesIO, StringIO
+
+# Add project root to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import chess
+import chess.svg
+import reportlab
+from reportlab.platypus import PageBreak, SimpleDocTemplate
+from svglib.svglib import svg2rlg
+
+from diagram.config import CHESS_BOARD_CONFIG, PDF_CONFIG
+from diagram.parallel import prepare_drawings
+from diagram.pdf_service import PageGrid, create_pdf_from_fens, page_cache
+from diagram.utils import drawing_cache
+
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+QUICK_SIZES = [10, 100]
+DEFAULT_DIAGRAMS_PER_PAGE = [1, 6, 12]
+DEFAULT_TOLERANCE = 0.25
+# Peak memory depends on what earlier stages left in reportlab's caches, and the flowables of doc_build keep
+# state across runs, so memory gets a wider tolerance than time and small peaks are not compared.
+DEFAULT_MEMORY_TOLERANCE = 1.0
+MIN_MEMORY_KB = 1024
+
+BOARD_STAGES = ('board_parse', 'svg_generation', 'svg2rlg')
+LAYOUT_STAGES = ('paragraph_measure', 'table_layout', 'doc_build', 'end_to_end')
+
+# --- Test Data ---
+
+def generate_fens(count, seed=64):
+    """
+    Returns `count` distinct FEN items reached by random play from the starting position.
+    Every third item has a description, so paragraph measurement has work to do.
+    """
+    rng = random.Random(seed)
+    fens = []
+    seen = set()
+    board = chess.Board()
+    while len(fens) < count:
+        moves = list(board.legal_moves)
+        if not moves or board.fullmove_number > 80:
+            board = chess.Board()
+            continue
+        board.push(rng.choice(moves))
+        fen = board.fen()
+        if fen in seen:
+            continue
+        seen.add(fen)
+        if len(fens) % 3 == 0:
+            fens.append({'fen': fen, 'description': f"Position {len(fens) + 1}, after {board.peek().uci()}"})
+        else:
+            fens.append(fen)
+    return fens
+
+
+def _fen_and_description(fen_item):
+    if isinstance(fen_item, dict):
+        return fen_item['fen'], fen_item.get('description')
+    return fen_item, None
+
+# --- Stages ---
+# Each stage is split into a setup, which is not measured, and a callable doing the measured work.
+
+def _svg_options():
+    colors_config = CHESS_BOARD_CONFIG['colors']
+    return {
+        'size': CHESS_BOARD_CONFIG['size'],
+        'coordinates': CHESS_BOARD_CONFIG['coordinates'],
+        'colors': {
+            "square light": colors_config['light_squares'],
+            "square dark": colors_config['dark_squares'],
+            "coord": CHESS_BOARD_CONFIG['coord'],
+        },
+    }
+
+
+def stage_board_parse(fens):
+    fen_strings = [_fen_and_description(fen_item)[0] for fen_item in fens]
+    return lambda: [chess.Board(fen) for fen in fen_strings]
+
+
+def stage_svg_generation(fens):
+    boards = [chess.Board(_fen_and_description(fen_item)[0]) for fen_item in fens]
+    options = _svg_options()
+    return lambda: [chess.svg.board(board=board, **options) for board in boards]
+
+
+def stage_svg2rlg(fens):
+    options = _svg_options()
+    svgs = [chess.svg.board(board=chess.Board(_fen_and_description(fen_item)[0]), **options) for fen_item in fens]
+    return lambda: [svg2rlg(StringIO(svg)) for svg in svgs]
+
+
+def stage_paragraph_measure(fens, diagrams_per_page):
+    grid = PageGrid(diagrams_per_page)
+    descriptions = [description for _fen, description in map(_fen_and_description, fens) if description]
+
+    def run():
+        for description in descriptions:
+            grid.description_paragraph(description)
+    return run
+
+
+def _page_tables(fens, diagrams_per_page, drawings):
+    """
+    Builds the page tables of the platypus engine with pdf_service.PageGrid, from already prepared drawings.
+    """
+    grid = PageGrid(diagrams_per_page)
+    tables = []
+    for page_index, start in enumerate(range(0, len(fens), diagrams_per_page)):
+        group = fens[start:start + diagrams_per_page]
+        paragraphs = [
+            grid.description_paragraph(description) if description else None
+            for _fen, description in map(_fen_and_description, group)
+        ]
+        max_desc_height = max([paragraph.height for paragraph in paragraphs if paragraph is not None], default=0)
+        size, row_height = grid.cell_sizes(max_desc_height, page_index == 0)
+        cells = []
+        for drawing, paragraph in zip(drawings[start:start + diagrams_per_page], paragraphs):
+            drawing = drawing.copy()
+            scale = size / drawing.width
+            drawing.scale(scale, scale)
+            drawing.width = drawing.height = size
+            cells.append(grid.cell_flowables(drawing, paragraph))
+        tables.append(grid.page_table(cells, row_height))
+    return tables
+
+
+def _prepared_drawings(fens):
+    fen_strings = [_fen_and_description(fen_item)[0] for fen_item in fens]
+    return prepare_drawings(fen_strings, {}, False, CHESS_BOARD_CONFIG['coordinates'],
+                            CHESS_BOARD_CONFIG['renderer'], parallel=False)
+
+
+def stage_table_layout(fens, diagrams_per_page, drawings):
+    grid = PageGrid(diagrams_per_page)
+
+    def run():
+        for table in _page_tables(fens, diagrams_per_page, drawings):
+            table.wrap(grid.width, grid.height)
+    return run
+
+
+def stage_doc_build(fens, diagrams_per_page, drawings):
+    tables = _page_tables(fens, diagrams_per_page, drawings)
+    story = []
+    for index, table in enumerate(tables):
+        if index:
+            story.append(PageBreak())
+        story.append(table)
+
+    def run():
+        doc = SimpleDocTemplate(BytesIO(), pagesize=PDF_CONFIG['page_size'], invariant=PDF_CONFIG['invariant'])
+        doc.build(list(story))
+    return run
+
+
+def stage_end_to_end(fens, diagrams_per_page):
+    def run():
+        # Cold caches: every run renders the boards and draws the pages again.
+        drawing_cache.clear()
+        page_cache.clear()
+        create_pdf_from_fens(fens, diagrams_per_page=diagrams_per_page)
+    return run
+
+# --- Measurement ---
+
+def measure(run, repeat, trace_memory):
+    """
+    Returns the best wall time of `repeat` runs and, when `trace_memory` is set,
+    the peak memory of one more run traced with tracemalloc.
+    """
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    peak_kb = None
+    if trace_memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            run()
+            _current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        peak_kb = round(peak / 1024, 1)
+    return best, peak_kb
+
+
+def _result(stage, diagrams, diagrams_per_page, seconds, peak_kb):
+    return {
+        'stage': stage,
+        'diagrams': diagrams,
+        'diagrams_per_page': diagrams_per_page,
+        'seconds': round(seconds, 6),
+        'ms_per_diagram': round(seconds * 1000 / diagrams, 4),
+        'peak_memory_kb': peak_kb,
+    }
+
+
+def log(message):
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{timestamp}] {message}", file=sys.stderr)
+
+
+def run_benchmarks(sizes, diagrams_per_page_values, repeat=1, trace_memory=True):
+    results = []
+    for size in sizes:
+        fens = generate_fens(size)
+        for stage, factory in (
+            ('board_parse', stage_board_parse),
+            ('svg_generation', stage_svg_generation),
+            ('svg2rlg', stage_svg2rlg),
+        ):
+            seconds, peak_kb = measure(factory(fens), repeat, trace_memory)
+            results.append(_result(stage, size, None, seconds, peak_kb))
+            log(f"{stage:<18} {size:>6} diagrams            {seconds:9.4f}s")
+
+        drawings = _prepared_drawings(fens)
+        for diagrams_per_page in diagrams_per_page_values:
+            for stage, run in (
+                ('paragraph_measure', stage_paragraph_measure(fens, diagrams_per_page)),
+                ('table_layout', stage_table_layout(fens, diagrams_per_page, drawings)),
+                ('doc_build', stage_doc_build(fens, diagrams_per_page, drawings)),
+                ('end_to_end', stage_end_to_end(fens, diagrams_per_page)),
+            ):
+                seconds, peak_kb = measure(run, repeat, trace_memory)
+                results.append(_result(stage, size, diagrams_per_page, seconds, peak_kb))
+                log(f"{stage:<18} {size:>6} diagrams, {diagrams_per_page:>2}/page {seconds:9.4f}s")
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'reportlab': reportlab.Version,
+        'chess': chess.__version__,
+        'cpu_count': os.cpu_count(),
+        'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+    }
+
+# --- Baseline Comparison ---
+
+def _case_key(result):
+    return (result['stage'], result['diagrams'], result['diagrams_per_page'])
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE, min_seconds=0.005,
+            memory_tolerance=DEFAULT_MEMORY_TOLERANCE, min_memory_kb=MIN_MEMORY_KB):
+    """
+    Compares results with a baseline report and returns the regressions as strings.
+    A case regresses when its time exceeds the baseline by more than `tolerance` (a fraction), or its peak
+    memory by more than `memory_tolerance`. Baseline times under `min_seconds` and peaks under `min_memory_kb`
+    are too noisy to compare and are skipped. Cases missing from either side are ignored.
+    """
+    baseline_by_case = {_case_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        reference = baseline_by_case.get(_case_key(result))
+        if reference is None:
+            continue
+        stage, diagrams, diagrams_per_page = _case_key(result)
+        case = f"{stage} ({diagrams} diagrams" + (f", {diagrams_per_page}/page)" if diagrams_per_page else ")")
+        if reference['seconds'] >= min_seconds and result['seconds'] > reference['seconds'] * (1 + tolerance):
+            regressions.append(
+                f"{case}: {result['seconds']:.4f}s vs {reference['seconds']:.4f}s baseline "
+                f"(+{result['seconds'] / reference['seconds'] - 1:.0%})"
+            )
+        if result['peak_memory_kb'] and (reference['peak_memory_kb'] or 0) >= min_memory_kb \
+                and result['peak_memory_kb'] > reference['peak_memory_kb'] * (1 + memory_tolerance):
+            regressions.append(
+                f"{case}: peak memory {result['peak_memory_kb']:.0f} KB vs {reference['peak_memory_kb']:.0f} KB "
+                f"baseline (+{result['peak_memory_kb'] / reference['peak_memory_kb'] - 1:.0%})"
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stage-level benchmark of the chess diagram PDF pipeline.")
+    parser.add_argument('--sizes', type=int, nargs='+', help=f"Numbers of diagrams (default: {DEFAULT_SIZES}).")
+    parser.add_argument('--per-page', type=int, nargs='+', default=DEFAULT_DIAGRAMS_PER_PAGE,
+                        help=f"diagrams_per_page values (default: {DEFAULT_DIAGRAMS_PER_PAGE}).")
+    parser.add_argument('--quick', action='store_true', help=f"Only run the baseline sizes {QUICK_SIZES}.")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per case, the best one is kept.")
+    parser.add_argument('--no-memory', action='store_true', help="Skip the tracemalloc peak memory run.")
+    parser.add_argument('--output', help="Write the JSON report to this file instead of stdout.")
+    parser.add_argument('--compare', metavar='BASELINE', help="Compare the results with a JSON report.")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed slowdown as a fraction of the baseline (default: %(default)s).")
+    parser.add_argument('--memory-tolerance', type=float, default=DEFAULT_MEMORY_TOLERANCE,
+                        help="Allowed peak memory growth as a fraction of the baseline (default: %(default)s).")
+    args = parser.parse_args(argv)
+
+    sizes = args.sizes or (QUICK_SIZES if args.quick else DEFAULT_SIZES)
+    results = run_benchmarks(sizes, args.per_page, args.repeat, not args.no_memory)
+    report = {'environment': environment(), 'results': results}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+        log(f"Results written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, memory_tolerance=args.memory_tolerance)
+        if regressions:
+            log(f"{len(regressions)} regression(s) against {args.compare}:")
+            for regression in regressions:
+                log(f"  {regression}")
+            return 1
+        log(f"No regression against {args.compare} "
+            f"(tolerance {args.tolerance:.0%}, memory {args.memory_tolerance:.0%}).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
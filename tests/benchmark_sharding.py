@@ -0,0 +1,123 @@
+# -----------------------------------------------------------------------------
+# Chess Diagram Sharded Build Benchmark
+#
+# Description:
+#   Measures how create_pdf_from_fens scales with the number of page-range
+#   shards (PARALLEL_CONFIG['shards']) built in the process pool:
+#     - shards=1 builds the document in this process, as without sharding,
+#     - shards=N builds N page ranges in N worker processes and joins them
+#       with pdf_merge.merge_pdfs.
+#   Every run starts with cold drawing and page caches: the caches of this
+#   process are cleared and the pool is restarted, so its workers start empty.
+#   The best of --repeat runs is kept, and each sharded document is checked to
+#   have the pages of the single-process build.
+#   Scaling is bounded by the cores of the machine: run it where the workers
+#   will run, and read the speedup against the reported cpu_count.
+#
+# Usage:
+#   Run from the project root directory:
+#     python tests/benchmark_sharding.py                      # 1, 2, 4... up to the core count
+#     python tests/benchmark_sharding.py --shards 1 2 4 8 --diagrams 3000
+#     python tests/benchmark_sharding.py --output sharding.json
+#
+# -----------------------------------------------------------------------------
+
+import argparse
+import json
+import os
+import sys
+import time
+
+# Add project root to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from benchmark import environment, generate_fens, log
+from diagram.config import PARALLEL_CONFIG
+from diagram.parallel import shutdown_process_pool
+from diagram.pdf_merge import PdfFile
+from diagram.pdf_service import create_pdf_from_fens, page_cache
+from diagram.utils import drawing_cache
+
+
+def default_shard_counts():
+    counts = [1]
+    while counts[-1] * 2 <= (os.cpu_count() or 1):
+        counts.append(counts[-1] * 2)
+    return counts
+
+
+def build(fens, shards, diagrams_per_page, renderer):
+    drawing_cache.clear()
+    page_cache.clear()
+    shutdown_process_pool()
+    start = time.perf_counter()
+    pdf_data = create_pdf_from_fens(fens, diagrams_per_page=diagrams_per_page, renderer=renderer,
+                                    title="Sharding benchmark", show_page_numbers=True, shards=shards)
+    return time.perf_counter() - start, pdf_data
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scaling of the sharded multi-process document build.")
+    parser.add_argument('--shards', type=int, nargs='+', default=default_shard_counts(),
+                        help="Shard counts to measure (default: powers of two up to the core count).")
+    parser.add_argument('--diagrams', type=int, default=1200, help="Diagrams in the document.")
+    parser.add_argument('--diagrams-per-page', type=int, default=6)
+    parser.add_argument('--renderer', default='svg', help="Board renderer, 'svg' or 'native'.")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per shard count, the best one is kept.")
+    parser.add_argument('--output', help="Write the JSON report to this file instead of stdout.")
+    args = parser.parse_args(argv)
+
+    fens = generate_fens(args.diagrams)
+    # Measure the requested shard counts, whatever the size of the shards.
+    PARALLEL_CONFIG['min_pages_per_shard'] = 1
+    # Shards are capped at the size of the process pool, so size it for the largest count.
+    PARALLEL_CONFIG['pool_size'] = max(args.shards)
+
+    results = []
+    reference_pages = None
+    baseline = None
+    try:
+        for shards in sorted(set(args.shards)):
+            runs = [build(fens, shards, args.diagrams_per_page, args.renderer) for _ in range(args.repeat)]
+            seconds = min(seconds for seconds, _pdf_data in runs)
+            pages = PdfFile(runs[0][1]).page_contents()
+            if reference_pages is None:
+                reference_pages = pages
+            elif pages != reference_pages:
+                raise SystemExit(f"The document built in {shards} shards differs from the first build.")
+            baseline = baseline or seconds
+            results.append({
+                'shards': shards,
+                'seconds': round(seconds, 6),
+                'speedup': round(baseline / seconds, 3),
+                'efficiency': round(baseline / seconds / shards, 3),
+                'pages': len(pages),
+                'bytes': len(runs[0][1]),
+            })
+            log(f"shards={shards:<3} {seconds:8.3f} s  speedup {baseline / seconds:5.2f}x")
+    finally:
+        shutdown_process_pool()
+
+    report = {
+        'environment': environment(),
+        'parameters': {
+            'diagrams': args.diagrams,
+            'diagrams_per_page': args.diagrams_per_page,
+            'renderer': args.renderer,
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+        log(f"Results written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+# -----------------------------------------------------------------------------
+# Chess Diagram Startup Benchmark
+#
+# Description:
+#   Measures what a fresh process pays before and on its first request, each
+#   scenario in a new Python interpreter so imports are really cold:
+#     - setup_lazy:         django.setup() and loading the URLconf, warm-up off
+#                           (what a management command pays)
+#     - setup_warm:         the same with the warm-up of DiagramConfig.ready
+#                           (what a server process pays at boot)
+#     - first_render_cold:  importing pdf_service and the first create_pdf_from_fens
+#                           call without warm-up
+#     - first_render_warm:  the same after the warm-up
+#   The best of --repeat runs of every scenario is kept.
+#
+# Usage:
+#   Run from the project root directory:
+#     python tests/benchmark_startup.py
+#     python tests/benchmark_startup.py --repeat 10 --output startup.json
+#
+# -----------------------------------------------------------------------------
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from benchmark import environment, log
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Each snippet prints the seconds it measured as its last line of output.
+_SETUP = """
+import os, sys, time
+sys.path.insert(0, {root!r})
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chess_pdf_generator.settings')
+from diagram.config import STARTUP_CONFIG
+STARTUP_CONFIG['warm_up'] = {warm_up!r}
+start = time.perf_counter()
+import django
+django.setup()
+import diagram.urls
+setup_seconds = time.perf_counter() - start
+"""
+
+_FIRST_RENDER = """
+start = time.perf_counter()
+from diagram.pdf_service import create_pdf_from_fens
+create_pdf_from_fens(['r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3'])
+print(time.perf_counter() - start)
+"""
+
+SCENARIOS = {
+    'setup_lazy': (False, 'print(setup_seconds)'),
+    'setup_warm': (True, 'print(setup_seconds)'),
+    'first_render_cold': (False, _FIRST_RENDER),
+    'first_render_warm': (True, _FIRST_RENDER),
+}
+
+
+def run_scenario(warm_up, body):
+    code = _SETUP.format(root=project_root, warm_up=warm_up) + body
+    output = subprocess.run(
+        [sys.executable, '-c', code], cwd=project_root, check=True, capture_output=True, text=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Startup and first-request benchmark of the chess diagram app.")
+    parser.add_argument('--repeat', type=int, default=5, help="Fresh processes per scenario, the best one is kept.")
+    parser.add_argument('--output', help="Write the JSON report to this file instead of stdout.")
+    args = parser.parse_args(argv)
+
+    results = []
+    for scenario, (warm_up, body) in SCENARIOS.items():
+        seconds = min(run_scenario(warm_up, body) for _ in range(args.repeat))
+        results.append({'scenario': scenario, 'seconds': round(seconds, 6)})
+        log(f"{scenario:<18} {seconds * 1000:9.1f} ms")
+
+    report = {
+        'environment': environment(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+        log(f"Results written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,441 @@
+# -----------------------------------------------------------------------------
+# Chess Diagram Load Test
+#
+# Description:
+#   Replays a log of recorded API requests against the Django app, either
+#   in-process (through the Django test client, no server needed) or against
+#   a running server, and reports:
+#     - throughput (completed requests per second),
+#     - p50/p95/p99 latency, overall and per endpoint,
+#     - error rate (transport errors and 5xx other than 503) and rejection
+#       rate (413, 429 and 503 from admission control),
+#     - peak RSS of the process serving the requests.
+#   Requests are sent by --concurrency worker threads, back to back or, with
+#   --rate, on a fixed schedule. On a schedule, latency is measured from the
+#   time a request was due, so a saturated server shows up as growing latency
+#   instead of a quietly lower send rate.
+#
+# Request log format:
+#   One JSON object per line (lines without a "path" are skipped):
+#     {"path": "/api/generate-pdf/", "method": "POST", "body": {...},
+#      "content_type": "application/json", "headers": {"Content-Encoding": "gzip"},
+#      "name": "generate-pdf"}
+#   Only "path" is required. "body" is sent as JSON unless it is a string;
+#   "name" groups requests in the report (the path by default).
+#   --generate-log writes a synthetic log of mixed traffic in this format.
+#
+# Usage:
+#   Run from the project root directory:
+#     python tests/load_test.py --generate-log tests/load_log.jsonl --count 500
+#     python tests/load_test.py tests/load_log.jsonl --concurrency 4 --requests 200
+#     python tests/load_test.py tests/load_log.jsonl --url http://127.0.0.1:8000 \
+#         --server-pid <pid> --rate 10 --duration 60 --output load.json
+#     python tests/load_test.py tests/load_log.jsonl --compare load.json
+#   With --compare, the script exits with status 1 when throughput drops, the
+#   p95 latency or the error rate grows by more than --tolerance.
+#
+# -----------------------------------------------------------------------------
+
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+# Add project root to the Python path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from benchmark import environment, generate_fens, log
+
+DEFAULT_TOLERANCE = 0.25
+REJECTED_STATUSES = (413, 429, 503)
+
+# --- Request Log ---
+
+def load_log(path):
+    """
+    Reads a request log and returns its entries, normalized to dicts with
+    'name', 'method', 'path', 'body' (bytes), 'content_type' and 'headers'.
+    """
+    entries = []
+    skipped = 0
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                raw = json.loads(line)
+            except ValueError:
+                skipped += 1
+                continue
+            if not isinstance(raw, dict) or not isinstance(raw.get('path'), str):
+                skipped += 1
+                continue
+            entries.append(normalize_entry(raw))
+    if skipped:
+        log(f"Skipped {skipped} line(s) of {path} that are not recorded requests.")
+    return entries
+
+
+def normalize_entry(raw):
+    body = raw.get('body')
+    content_type = raw.get('content_type')
+    if body is None:
+        data = b''
+    elif isinstance(body, str):
+        data = body.encode('utf-8')
+        content_type = content_type or 'text/plain'
+    else:
+        data = json.dumps(body).encode('utf-8')
+        content_type = content_type or 'application/json'
+    return {
+        'name': raw.get('name') or raw['path'],
+        'method': raw.get('method', 'POST' if data else 'GET').upper(),
+        'path': raw['path'],
+        'body': data,
+        'content_type': content_type,
+        'headers': raw.get('headers') or {},
+    }
+
+
+SAMPLE_PGN = """[Event "Casual"]
+[White "White"]
+[Black "Black"]
+[Result "1-0"]
+
+1. e4 e5 2. Qh5 Nc6 3. Bc4 Nf6 4. Qxf7# 1-0
+"""
+
+
+def generate_log(count, seed=64):
+    """
+    Returns `count` raw log entries of mixed traffic: mostly small documents, some large spooled ones,
+    previews, PGN and newline-delimited uploads, and requests to the async endpoint.
+    """
+    rng = random.Random(seed)
+    pool = generate_fens(2000, seed)
+    fen_strings = [fen_item['fen'] if isinstance(fen_item, dict) else fen_item for fen_item in pool]
+    kinds = [
+        ('generate-pdf', 50), ('generate-pdf-large', 10), ('preview', 15),
+        ('generate-pdf-pgn', 10), ('generate-pdf-upload', 10), ('generate-pdf-async', 5),
+    ]
+    names = [name for name, _weight in kinds]
+    weights = [weight for _name, weight in kinds]
+
+    entries = []
+    for _ in range(count):
+        kind = rng.choices(names, weights)[0]
+        options = {'diagrams_per_page': rng.choice([1, 4, 6, 9, 12]), 'renderer': rng.choice(['svg', 'native'])}
+        if kind in ('generate-pdf', 'generate-pdf-async'):
+            fens = rng.sample(pool, rng.randint(1, 24))
+            path = '/api/generate-pdf/async/' if kind == 'generate-pdf-async' else '/api/generate-pdf/'
+            entries.append({'name': kind, 'path': path, 'body': {'fens': fens, **options}})
+        elif kind == 'generate-pdf-large':
+            fens = rng.sample(pool, rng.randint(100, 300))
+            entries.append({'name': kind, 'path': '/api/generate-pdf/', 'body': {'fens': fens, 'stream': True, **options}})
+        elif kind == 'preview':
+            fens = rng.sample(pool, rng.randint(1, 12))
+            body = {'fens': fens, 'preview': rng.choice(['page', 'diagram']), 'format': 'svg', **options}
+            entries.append({'name': kind, 'path': '/api/preview/', 'body': body})
+        elif kind == 'generate-pdf-pgn':
+            entries.append({'name': kind, 'path': '/api/generate-pdf/pgn/',
+                            'body': {'pgn': SAMPLE_PGN, 'every_ply': rng.choice([1, 2]), **options}})
+        else:
+            lines = '\n'.join(rng.sample(fen_strings, rng.randint(20, 200)))
+            query = '&'.join(f'{key}={value}' for key, value in options.items())
+            entries.append({'name': kind, 'path': f'/api/generate-pdf/?{query}', 'body': lines,
+                            'content_type': 'text/plain'})
+    return entries
+
+# --- Targets ---
+
+class InProcessTarget:
+    """
+    Sends requests through the Django test client, one client per worker thread.
+    """
+    name = 'in-process'
+
+    def __init__(self):
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chess_pdf_generator.settings')
+        import django
+        django.setup()
+        self._local = threading.local()
+
+    def _client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            from django.test import Client
+            client = self._local.client = Client(HTTP_HOST='localhost')
+        return client
+
+    def send(self, entry):
+        headers = {f"HTTP_{key.upper().replace('-', '_')}": value for key, value in entry['headers'].items()}
+        response = self._client().generic(
+            entry['method'], entry['path'], entry['body'], content_type=entry['content_type'], **headers
+        )
+        if response.streaming:
+            size = sum(len(chunk) for chunk in response.streaming_content)
+        else:
+            size = len(response.content)
+        response.close()
+        return response.status_code, size
+
+    def peak_rss_kb(self):
+        # ru_maxrss is in kilobytes on Linux (bytes on macOS); it includes the harness itself.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+class HttpTarget:
+    """
+    Sends requests to a running server with urllib; the peak RSS is read from /proc for `server_pid`.
+    """
+    name = 'http'
+
+    def __init__(self, base_url, server_pid=None, timeout=300):
+        self.base_url = base_url.rstrip('/')
+        self.server_pid = server_pid
+        self.timeout = timeout
+
+    def send(self, entry):
+        request = urllib.request.Request(
+            self.base_url + entry['path'], data=entry['body'] or None, method=entry['method'],
+            headers={**({'Content-Type': entry['content_type']} if entry['content_type'] else {}), **entry['headers']}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.status, len(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, len(e.read())
+
+    def peak_rss_kb(self):
+        if self.server_pid is None:
+            return None
+        try:
+            with open(f'/proc/{self.server_pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1])
+        except OSError:
+            return None
+        return None
+
+# --- Runner ---
+
+def run_load(target, entries, requests=None, duration=None, concurrency=1, rate=None, seed=64):
+    """
+    Replays `entries` in a shuffled cycle until `requests` have been sent or `duration` seconds have passed,
+    and returns the (name, status, latency, bytes, error) of every request and the elapsed time.
+    """
+    order = list(range(len(entries)))
+    random.Random(seed).shuffle(order)
+    lock = threading.Lock()
+    results = []
+    next_index = [0]
+    start = time.perf_counter()
+
+    def next_request():
+        with lock:
+            index = next_index[0]
+            if requests is not None and index >= requests:
+                return None
+            due = start + index / rate if rate else None
+            if duration is not None and (due or time.perf_counter()) - start >= duration:
+                return None
+            next_index[0] += 1
+            return entries[order[index % len(order)]], due
+
+    def worker():
+        while True:
+            item = next_request()
+            if item is None:
+                return
+            entry, due = item
+            if due is not None:
+                time.sleep(max(0.0, due - time.perf_counter()))
+            sent = due if due is not None else time.perf_counter()
+            error = None
+            status = size = None
+            try:
+                status, size = target.send(entry)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            latency = time.perf_counter() - sent
+            with lock:
+                results.append((entry['name'], status, latency, size, error))
+
+    threads = [threading.Thread(target=worker, name=f'load-{i}') for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+# --- Report ---
+
+def percentile(sorted_values, fraction):
+    """
+    Returns the nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(fraction * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def _summary(results, elapsed):
+    latencies = sorted(latency for _name, _status, latency, _size, _error in results)
+    errors = sum(1 for _name, status, _latency, _size, error in results
+                 if error is not None or (status >= 500 and status not in REJECTED_STATUSES))
+    rejected = sum(1 for _name, status, _latency, _size, _error in results if status in REJECTED_STATUSES)
+    statuses = {}
+    for _name, status, _latency, _size, error in results:
+        key = str(status) if error is None else 'exception'
+        statuses[key] = statuses.get(key, 0) + 1
+    count = len(results)
+    return {
+        'requests': count,
+        'throughput': round(count / elapsed, 3) if elapsed else None,
+        'latency_p50': _round(percentile(latencies, 0.50)),
+        'latency_p95': _round(percentile(latencies, 0.95)),
+        'latency_p99': _round(percentile(latencies, 0.99)),
+        'latency_max': _round(latencies[-1] if latencies else None),
+        'error_rate': round(errors / count, 4) if count else None,
+        'rejected_rate': round(rejected / count, 4) if count else None,
+        'bytes_received': sum(size or 0 for _name, _status, _latency, size, _error in results),
+        'statuses': dict(sorted(statuses.items())),
+    }
+
+
+def _round(seconds):
+    return None if seconds is None else round(seconds, 6)
+
+
+def summarize(results, elapsed, peak_rss_kb):
+    by_name = {}
+    for result in results:
+        by_name.setdefault(result[0], []).append(result)
+    overall = _summary(results, elapsed)
+    overall['elapsed'] = round(elapsed, 3)
+    overall['peak_rss_kb'] = peak_rss_kb
+    return {
+        'overall': overall,
+        'endpoints': {name: _summary(endpoint_results, elapsed) for name, endpoint_results in sorted(by_name.items())},
+        'sample_errors': sorted({error for *_rest, error in results if error})[:10],
+    }
+
+
+def _format_ms(seconds):
+    return '-' if seconds is None else f"{seconds * 1000:.0f} ms"
+
+
+def print_summary(summary):
+    overall = summary['overall']
+    log(f"{overall['requests']} requests in {overall['elapsed']:.1f}s: {overall['throughput']} req/s, "
+        f"p50 {_format_ms(overall['latency_p50'])}, p95 {_format_ms(overall['latency_p95'])}, "
+        f"p99 {_format_ms(overall['latency_p99'])}, errors {overall['error_rate']:.1%}, "
+        f"rejected {overall['rejected_rate']:.1%}, peak RSS {overall['peak_rss_kb']} KB")
+    for name, endpoint in summary['endpoints'].items():
+        log(f"  {name:<22} {endpoint['requests']:>6} req  p50 {_format_ms(endpoint['latency_p50']):>8}  "
+            f"p95 {_format_ms(endpoint['latency_p95']):>8}  errors {endpoint['error_rate']:.1%}")
+    for error in summary['sample_errors']:
+        log(f"  error: {error}")
+
+# --- Baseline Comparison ---
+
+def compare(summary, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compares the overall results with a baseline report and returns the regressions as strings:
+    a throughput drop, or a p95 latency or error rate increase, beyond `tolerance` (a fraction).
+    """
+    current = summary['overall']
+    reference = baseline['summary']['overall']
+    regressions = []
+    if reference['throughput'] and current['throughput'] < reference['throughput'] * (1 - tolerance):
+        regressions.append(f"throughput {current['throughput']} req/s vs {reference['throughput']} req/s baseline")
+    if reference['latency_p95'] and current['latency_p95'] > reference['latency_p95'] * (1 + tolerance):
+        regressions.append(f"p95 latency {_format_ms(current['latency_p95'])} vs "
+                           f"{_format_ms(reference['latency_p95'])} baseline")
+    if current['error_rate'] > reference['error_rate'] + tolerance * max(reference['error_rate'], 0.01):
+        regressions.append(f"error rate {current['error_rate']:.1%} vs {reference['error_rate']:.1%} baseline")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replays a request log against the chess diagram API.")
+    parser.add_argument('log', nargs='?', help="JSONL request log to replay (or to write with --generate-log).")
+    parser.add_argument('--generate-log', metavar='PATH', help="Write a synthetic request log and exit.")
+    parser.add_argument('--count', type=int, default=500, help="Entries of the generated log (default: %(default)s).")
+    parser.add_argument('--url', help="Base URL of a running server; requests are sent in-process without it.")
+    parser.add_argument('--server-pid', type=int, help="PID of the server process, to report its peak RSS.")
+    parser.add_argument('--concurrency', type=int, default=4, help="Worker threads (default: %(default)s).")
+    parser.add_argument('--rate', type=float, help="Requests per second on a fixed schedule (default: back to back).")
+    parser.add_argument('--requests', type=int, help="Requests to send (default: one pass over the log).")
+    parser.add_argument('--duration', type=float, help="Stop sending after this many seconds.")
+    parser.add_argument('--seed', type=int, default=64, help="Seed of the replay order and of the generated log.")
+    parser.add_argument('--output', help="Write the JSON report to this file instead of stdout.")
+    parser.add_argument('--compare', metavar='BASELINE', help="Compare the results with a JSON report.")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed regression as a fraction of the baseline (default: %(default)s).")
+    args = parser.parse_args(argv)
+
+    if args.generate_log:
+        with open(args.generate_log, 'w', encoding='utf-8') as f:
+            for entry in generate_log(args.count, args.seed):
+                f.write(json.dumps(entry) + '\n')
+        log(f"Wrote {args.count} requests to {args.generate_log}")
+        return 0
+    if not args.log:
+        parser.error("a request log is required (or --generate-log)")
+
+    entries = load_log(args.log)
+    if not entries:
+        log(f"No recorded request in {args.log}.")
+        return 1
+    requests = args.requests if args.requests is not None or args.duration is not None else len(entries)
+
+    target = HttpTarget(args.url, args.server_pid) if args.url else InProcessTarget()
+    log(f"Replaying {args.log} ({len(entries)} entries) {target.name}, concurrency {args.concurrency}"
+        + (f", {args.rate} req/s" if args.rate else ""))
+    results, elapsed = run_load(target, entries, requests, args.duration, args.concurrency, args.rate, args.seed)
+    summary = summarize(results, elapsed, target.peak_rss_kb())
+    print_summary(summary)
+
+    report = {
+        'environment': environment(),
+        'settings': {
+            'log': args.log, 'target': args.url or target.name, 'concurrency': args.concurrency,
+            'rate': args.rate, 'requests': requests, 'duration': args.duration,
+        },
+        'summary': summary,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+        log(f"Results written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(summary, baseline, args.tolerance)
+        if regressions:
+            log(f"{len(regressions)} regression(s) against {args.compare}:")
+            for regression in regressions:
+                log(f"  {regression}")
+            return 1
+        log(f"No regression against {args.compare} (tolerance {args.tolerance:.0%}).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())